@@ -216,6 +216,10 @@ def run(cmdConfig=[], type='gui', exitPoint=None):
             
     if type == 'test':
         database.createTables()
+    database.closure.init()
+    database.fulltext.init()
+    database.words.init()
+    database.toplevel.init()
             
     if exitPoint == 'database':
         return app
@@ -251,7 +255,7 @@ def run(cmdConfig=[], type='gui', exitPoint=None):
             runInstaller()
             
         # In most test scripts these caches would only be overhead.
-        database.tags.cacheValues()
+        database.tags.warmCacheInBackground()
         
     flags.init()
     
@@ -263,6 +267,9 @@ def run(cmdConfig=[], type='gui', exitPoint=None):
     levels.init()
     from maestro.core import covers
     covers.init()
+    from maestro import search
+    search.cache.init()
+    search.index.init()
 
     global network
     network = QtNetwork.QNetworkAccessManager()
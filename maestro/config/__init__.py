@@ -140,6 +140,21 @@ configOptions = collections.OrderedDict((
     'port': (int, 0, 'Port of the database server'),    
     'sqlite_path': (str, 'config:maestro.db', 'Path to the SQLite database. May start with "config:" indicating that the path is relative to the configuration directory.'),
     'prefix':  (str, '', 'Prefix which will be prepended to the table names.'),
+    'id_list_threshold': (int, 500, 'Queries for more element ids than this number will store the ids in a temporary table instead of sending them as a list.'),
+    'element_cache_size': (int, 50000, 'Maximal number of database elements kept in memory. Least recently used elements which are not in use will be removed from memory and reloaded when necessary. Use 0 to disable the limit.'),
+    'value_cache_size': (int, 100000, 'Maximal number of tag values whose ids are kept in memory. Use 0 to disable the limit.'),
+    'contents_closure': (bool, False, 'Maintain a table containing all ancestor/descendant pairs of the contents hierarchy. This speeds up queries for all ancestors or descendants of elements in large collections at the cost of additional space and slower changes of contents.'),
+    'fulltext_index': (bool, False, 'Maintain a full-text index of all varchar and text values (SQLite only). This speeds up substring searches of at least three characters in large collections at the cost of additional space.'),
+    'word_index': (bool, False, 'Maintain an index of the words in all varchar values (SQLite only). This speeds up #word searches in large collections at the cost of additional space.'),
+    'toplevel_index': (bool, True, 'Maintain a table of all elements which are not contained in any container. This speeds up loading the browser when it displays all elements of a large collection.'),
+}),
+
+('search', {
+    'query_planner': (bool, True, 'Process the most selective criteria of a search first and search the remaining criteria only within their result.'),
+    'cache_size': (int, 50, 'Maximal memory in MB used to cache search results. Use 0 to disable the cache.'),
+    'index': (bool, False, 'Keep an index of all tag values and flags in memory and use it instead of the database for most searches. The index is built in the background at startup and needs roughly 100 bytes per element and tag value.'),
+    'parallelism': (int, 1, 'Number of independent criteria of a search that are processed at the same time, each in its own thread with its own database connection. Use 1 to process all criteria one after another.'),
+    'workers': (int, 2, 'Number of threads shared by all browsers, cover browsers and similar widgets to search and load their contents. Identical searches of several widgets are processed only once.'),
 }),
 
 ('tags', {
@@ -162,7 +177,8 @@ configOptions = collections.OrderedDict((
 }),
 ('filesystem', {
     'acoustid_apikey': (str, 'VGPeEVtB', 'API key for AcoustID web service'),
-    'disable': (bool, False, 'Disable all filesystem tracking, overriding the individuial sources\' configuration')
+    'disable': (bool, False, 'Disable all filesystem tracking, overriding the individuial sources\' configuration'),
+    'tag_reader_processes': (int, 0, 'Number of processes used to read tags when many files are loaded. Use 0 to use one process per CPU.'),
 }),
 ('misc', {
     'show_ids': (bool, False, 'Whether Maestro should display element IDs'),
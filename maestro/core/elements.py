@@ -97,11 +97,19 @@ class Element:
     
     def getAllFiles(self):
         """Return all files below this element. Doesn't eliminate duplicates."""
+        if self.isContainer() and len(self.contents) > 0 and self.isInDb():
+            from .. import database as db
+            if db.closure.enabled():
+                # Load all descendants with one query instead of one query per level of the hierarchy
+                self.level.fetch(list(db.closure.descendants((self.id,))))
+        return self._getAllFiles()
+    
+    def _getAllFiles(self):
         if self.isFile():
             yield self
         else:
             for id in self.contents:
-                for file in self.level.fetch(id).getAllFiles():
+                for file in self.level.fetch(id)._getAllFiles():
                     yield file
     
     def getStickers(self, type):
@@ -17,6 +17,7 @@
 #
 
 import collections.abc
+import itertools
 import weakref
 
 from PyQt5 import QtCore
@@ -89,9 +90,15 @@ class LevelChangeEvent(application.ChangeEvent):
         
     The constructor accepts these sets as keyword-arguments.
     Note: ids in 'removedIds' will be removed from all other sets.
+    
+    If 'dataIds' is not empty, the attributes 'changedTags', 'changedFlags' and 'changedStickers' specify
+    which tags, flags and sticker types of these elements have changed. They may be given as iterables
+    to the constructor. The default value None means that this is unknown, i.e. anything may have changed.
     """
     # Attributes which store a list of element ids; used by the generic implementation of merge and filtered.
     _idAttributes = ('dataIds', 'contentIds', 'addedIds', 'removedIds', 'dbAddedIds', 'dbRemovedIds')
+    # Attributes which store the tags/flags/sticker types that have changed in the elements of dataIds
+    _dataAttributes = ('changedTags', 'changedFlags', 'changedStickers')
        
     def __init__(self, **args):
         super().__init__()
@@ -101,6 +108,12 @@ class LevelChangeEvent(application.ChangeEvent):
                 if not isinstance(ids, set):
                     ids = set(ids)
                 setattr(self, attr, ids)
+        for attr in self._dataAttributes:
+            if len(self.dataIds) == 0:
+                setattr(self, attr, set())
+            elif args.get(attr) is not None:
+                setattr(self, attr, set(args[attr]))
+            else: setattr(self, attr, None)
         if len(self.removedIds) > 0:
             self._clearIds(self.removedIds)
         
@@ -121,6 +134,11 @@ class LevelChangeEvent(application.ChangeEvent):
         
     def merge(self, other):
         if type(other) is type(self): # do not merge with subclasses because they might carry more data
+            for attr in self._dataAttributes:
+                mine, theirs = getattr(self, attr), getattr(other, attr)
+                if mine is not None and theirs is not None:
+                    mine.update(theirs)
+                else: setattr(self, attr, None)
             for attr in self._idAttributes:
                 if len(getattr(other, attr)) > 0:
                     idList = getattr(other, attr)
@@ -146,6 +164,8 @@ class LevelChangeEvent(application.ChangeEvent):
         
         if len(self.dataIds) > 0:
             idLists['dataIds'] = self.dataIds.difference(level.elements.keys())
+            for attr in self._dataAttributes:
+                idLists[attr] = getattr(self, attr)
         if len(self.contentIds) > 0:
             idLists['contentIds'] = self.contentIds.difference(level.elements.keys())
         # Never forward addedIds/removedIds
@@ -155,7 +175,7 @@ class LevelChangeEvent(application.ChangeEvent):
         if len(self.dbRemovedIds) > 0:
             idLists['dbRemovedIds'] = self.dbRemovedIds
         
-        if any(len(l) > 0 for l in idLists.values()):
+        if any(len(idLists[attr]) > 0 for attr in self._idAttributes if attr in idLists):
             return LevelChangeEvent(**idLists)
         else: return None
         
@@ -247,10 +267,21 @@ class Level(application.ChangeEventDispatcher):
     def _ensureLoaded(self, params):
         """Make sure that the elements specified by params (ids and/or urls) are loaded on this level or 
         any parent level."""
-        missing = [param for param in params if param not in self]
+        # Resolve all URLs at once. Otherwise each call of __contains__ would query the database (also
+        # for URLs without id, because those are not cached).
+        urlIds = idsFromUrls([param for param in params if isinstance(param, URL)])
+        missing = [param for param in params if not self._containsResolved(param, urlIds)]
         if len(missing) > 0:
             self.parent._ensureLoaded(missing)
     
+    def _containsResolved(self, param, urlIds):
+        """Like __contains__, but look up URLs in *urlIds* (a dict returned by idsFromUrls) instead of
+        the database."""
+        if isinstance(param, URL):
+            id = urlIds.get(param)
+            return id is not None and id in self
+        else: return param in self
+    
     #TODO do something about this ugly correct parents stuff
     def _correctParents(self, element, changeLevel):
         # This does only work if element comes from a level that is an ancestor or descendant of self,
@@ -569,18 +600,31 @@ class Level(application.ChangeEventDispatcher):
         if len(elements) > 0:
             self.emit(LevelChangeEvent(removedIds=[element.id for element in elements]))
 
-    def _applyDiffs(self, changes):
+    def _applyDiffs(self, changes, **args):
         """Given the dict *changes* mapping elements to Difference objects (e.g. tags.TagDifference, apply
-        these differences to the elements.
+        these differences to the elements. Keyword arguments are passed to the emitted LevelChangeEvent.
         """
         for element, diff in changes.items():
             diff.apply(element)
-        self.emitEvent(dataIds=[element.id for element in changes])
-        
-    # On real level these methods are implemented differently
-    _changeTags = _applyDiffs
-    _changeFlags = _applyDiffs
-    _changeStickers = _applyDiffs
+        self.emitEvent(dataIds=[element.id for element in changes], **args)
+        
+    # On real level the following methods are implemented differently
+    def _changeTags(self, changes):
+        """Apply the tags.TagDifferences in the dict *changes* to their elements."""
+        changedTags = set(tag for diff in changes.values()
+                          for tag, _ in itertools.chain(diff.getAdditions(), diff.getRemovals()))
+        self._applyDiffs(changes, changedTags=changedTags, changedFlags=(), changedStickers=())
+        
+    def _changeFlags(self, changes):
+        """Apply the flags.FlagDifferences in the dict *changes* to their elements."""
+        changedFlags = set(flag for diff in changes.values()
+                           for flag in itertools.chain(diff.getAdditions(), diff.getRemovals()))
+        self._applyDiffs(changes, changedTags=(), changedFlags=changedFlags, changedStickers=())
+        
+    def _changeStickers(self, changes):
+        """Apply the stickers.StickersDifferences in the dict *changes* to their elements."""
+        changedStickers = set(type for diff in changes.values() for type in diff.diffs)
+        self._applyDiffs(changes, changedTags=(), changedFlags=(), changedStickers=changedStickers)
 
     def _setStickers(self, type, elementToStickers):
         """For each element->stickerList map in *elementToStickers* change the stickers of the given type
@@ -593,13 +637,15 @@ class Level(application.ChangeEventDispatcher):
                 else: element.stickers[type] = tuple(stickers)
             elif type in element.stickers:
                 del element.stickers[type]
-        self.emitEvent(dataIds=[element.id for element in elementToStickers])
+        self.emitEvent(dataIds=[element.id for element in elementToStickers],
+                       changedTags=(), changedFlags=(), changedStickers=(type,))
     
     def _setTypes(self, containerTypes):
         """Set the type of containers. *containerTypes* must map containers to their desired type."""
         for container, type in containerTypes.items():
             container.type = type
-        self.emitEvent(dataIds=[container.id for container in containerTypes])
+        self.emitEvent(dataIds=[container.id for container in containerTypes],
+                       changedTags=(), changedFlags=(), changedStickers=())
     
     def _changeContents(self, contentDict):
         """Set contents according to *contentDict* which maps parents to content lists."""
@@ -620,7 +666,8 @@ class Level(application.ChangeEventDispatcher):
                 self[id].parents.append(parent.id)
                 dataIds.append(id)
         parent.contents = contents
-        self.emitEvent(dataIds=dataIds, contentIds=(parent.id,))
+        self.emitEvent(dataIds=dataIds, contentIds=(parent.id, ),
+                       changedTags=(), changedFlags=(), changedStickers=())
 
     def _insertContents(self, parent, insertions):
         """Insert some elements under *parent*. The insertions must be given as an iterable of
@@ -635,7 +682,8 @@ class Level(application.ChangeEventDispatcher):
             if parent.id not in element.parents:
                 element.parents.append(parent.id)
                 dataIds.append(element.id)
-        self.emitEvent(dataIds=dataIds, contentIds=(parent.id, ))
+        self.emitEvent(dataIds=dataIds, contentIds=(parent.id, ),
+                       changedTags=(), changedFlags=(), changedStickers=())
 
     def _removeContents(self, parent, positions):
         """Remove the children at given *positions* under parent.
@@ -649,14 +697,16 @@ class Level(application.ChangeEventDispatcher):
             if id not in parent.contents:
                 self[id].parents.remove(parent.id)
                 dataIds.append(id)
-        self.emitEvent(dataIds=dataIds, contentIds=(parent.id, ))
+        self.emitEvent(dataIds=dataIds, contentIds=(parent.id, ),
+                       changedTags=(), changedFlags=(), changedStickers=())
 
     def _renameFiles(self, renamings):
         """Rename files based on *renamings*, a dict from elements to (oldUrl, newUrl) pairs.
         """
         for element, (_, newUrl) in renamings.items():
             element.url = newUrl
-        self.emitEvent(dataIds=[elem.id for elem in renamings])
+        self.emitEvent(dataIds=[elem.id for elem in renamings],
+                       changedTags=(), changedFlags=(), changedStickers=())
 
     def _changePositions(self, parent, changes):
         """Change positions of elements."""
@@ -772,3 +822,25 @@ def idFromUrl(url, create=False):
             else: raise KeyError("There is no id for url '{}'".format(url))
         _urlToId[url] = id
         return id
+
+
+def idsFromUrls(urls, create=False):
+    """Like idFromUrl, but for many URLs: Resolve all URLs which are not cached yet using a few database
+    queries and return a dict mapping urls to ids. If *create* is True, ids are created for URLs which
+    are not in the database. Otherwise such URLs are missing in the result.
+    """
+    result = {}
+    missing = []
+    for url in urls:
+        if url in _urlToId:
+            result[url] = _urlToId[url]
+        else: missing.append(url)
+    if len(missing) > 0:
+        found = db.idsFromUrls(missing)
+        if create:
+            for url in missing:
+                if url not in found:
+                    found[url] = db.nextId()
+        _urlToId.update(found)
+        result.update(found)
+    return result
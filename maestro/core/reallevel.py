@@ -18,16 +18,20 @@
 
 import itertools
 import time
-import collections.abc
+import collections, collections.abc
+import weakref
 
 from maestro.core import elements, levels, tags, flags, domains
 from maestro.core.urls import URL, TagWriteError, changeTags
-from maestro import application, database as db, stack
+from maestro import application, config, database as db, stack
 
 
 # The ids of all elements that are in the database and have been loaded to some level 
 _dbIds = set()
 
+# Statistics of the element cache of the real level, see RealLevel.cacheInfo
+CacheInfo = collections.namedtuple('CacheInfo', 'hits misses evictions size budget')
+
 
 class RealFileEvent(application.ChangeEvent):
     _attrs = ("modified", "added", "removed", "renamed", "deleted")
@@ -76,63 +80,162 @@ class RealLevel(levels.Level):
     def __init__(self):
         super().__init__('REAL', None)
         self.filesystemDispatcher = application.ChangeEventDispatcher(stack.stack)
+        # Element cache: Database elements are kept in self.elements in LRU order (_lastUsed maps ids to None).
+        # When more than config.options.database.element_cache_size elements are loaded, the least recently
+        # used ones are moved to _evicted, which only holds weak references. Thus elements which are still
+        # used somewhere (e.g. by a wrapper) are never loaded twice.
+        self._lastUsed = collections.OrderedDict()
+        self._evicted = weakref.WeakValueDictionary()
+        self._hits = self._misses = self._evictions = 0
     
     def emitFilesystemEvent(self, **kwArgs):
         """Simple shortcut to emit a FileSystemEvent."""
         stack.addEvent(self.filesystemDispatcher, RealFileEvent(**kwArgs))
 
     def collect(self, params):
-        # We need to iterate params twice
         if not isinstance(params, collections.abc.Iterable):
-            self._ensureLoaded([params])
-            return self[params]
+            return self.collect([params])[0]
+        # We need to iterate params twice
         if not isinstance(params, collections.abc.Sized):  # exclude one-time generators
             params = list(params)
+        misses = self._misses
         self._ensureLoaded(params)
-        return [self[param] for param in params]
+        result = [self[param] for param in params]
+        for element in result:
+            if element.id in self._lastUsed:
+                self._lastUsed.move_to_end(element.id)
+        if self._misses > misses:
+            self._evict(protected=result)
+        return result
     
     # The difference between fetch, _fetch and collect is only important on levels below real.
     fetch = collect
     _fetch = collect
     
+    def __contains__(self, param):
+        if super().__contains__(param):
+            return True
+        id = param if isinstance(param, int) else levels._urlToId.get(param)
+        return id is not None and self._restore(id)
+    
+    def __getitem__(self, key):
+        try:
+            return super().__getitem__(key)
+        except KeyError:
+            # The element might have been evicted from the cache. Load it again transparently.
+            if key in self or (isinstance(key, int) and key in _dbIds):
+                return self.collect(key)
+            raise
+    
     def _ensureLoaded(self, params):
-        # note that __contains__ (p not in self) ensures that p is either int or url 
+        # Resolve all URLs at once, before checking which elements are loaded (see Level._ensureLoaded).
+        # Cached ids of URLs which are not loaded may have been created for files that are not in the
+        # database, so look those URLs up in the database.
+        # Note that __contains__ (p not in self) ensures that p is either int or url.
+        urlParams = [p for p in params if isinstance(p, URL)]
+        urlIds = {url: levels._urlToId[url] for url in urlParams
+                  if url in levels._urlToId and levels._urlToId[url] in self}
+        unresolved = [url for url in urlParams if url not in urlIds]
+        found = db.idsFromUrls(unresolved) if len(unresolved) > 0 else {}
+        levels._urlToId.update(found)
+        urlIds.update(found)
         ids = [p for p in params if isinstance(p, int) and p not in self]
-        urls = []
-        for p in params:
-            if isinstance(p, URL) and p not in self:
-                id = db.idFromUrl(p)
-                if id is not None:
-                    ids.append(id)
-                else: urls.append(p)
+        ids.extend(id for id in found.values() if id not in self)
+        urls = [url for url in unresolved if url not in found]
                 
+        self._misses += len(ids) + len(urls)
+        self._hits += len(params) - len(ids) - len(urls)
         if len(ids) > 0:
             # this will silently ignore ids which are not found in the DB
             self.loadFromDb(ids)
         if len(urls) > 0:
             self.loadFromUrls(urls)
-        if any(p not in self for p in params):
+            urlIds.update((url, levels._urlToId[url]) for url in urls if url in levels._urlToId)
+        missing = [p for p in params if not self._containsResolved(p, urlIds)]
+        if len(missing) > 0:
             # This means that an element could not be loaded (e.g. params contains the id of a new container
             # which only exists on the editor level).
-            raise levels.ElementGetError(self, [p for p in params if p not in self])
+            raise levels.ElementGetError(self, missing)
+    
+    def _restore(self, id):
+        """If the element with the given id has been evicted but is still referenced somewhere, put it back
+        into the cache and return True. Otherwise return False."""
+        element = self._evicted.pop(id, None)
+        if element is None:
+            return False
+        self.elements[id] = element
+        self._lastUsed[id] = None
+        return True
+        
+    def _evict(self, protected):
+        """Evict least recently used elements until no more than config.options.database.element_cache_size
+        elements are loaded. Only elements which are contained in the database are evicted (others could
+        not be reloaded). Elements which are loaded on another level or are part of the global selection
+        are pinned, as well as the elements in *protected* (usually those that have just been requested).
+        """
+        budget = config.options.database.element_cache_size
+        if budget <= 0 or len(self.elements) <= budget:
+            return
+        pinned = set(element.id for element in protected)
+        for level in levels.allLevels:
+            if level is not self:
+                pinned.update(level.elements.keys())
+        from ..gui import selection
+        globalSelection = selection.getGlobalSelection()
+        if globalSelection and globalSelection.level is self:
+            pinned.update(element.id for element in globalSelection.elements())
+            
+        for id in list(self._lastUsed):
+            if len(self.elements) <= budget:
+                break
+            if id in pinned:
+                continue
+            del self._lastUsed[id]
+            if id in self.elements and id in _dbIds:
+                self._evicted[id] = self.elements.pop(id)
+                self._evictions += 1
+            
+    def cacheInfo(self):
+        """Return a CacheInfo-tuple with statistics about the element cache: the number of cache hits and
+        misses in requests for elements, the number of evictions, the current number of elements and the
+        configured budget."""
+        return CacheInfo(self._hits, self._misses, self._evictions, len(self.elements),
+                         config.options.database.element_cache_size)
      
     def loadFromDb(self, idList, level=None):
         """Load elements specified by *idList* from the database into *level* which defaults to the
-        real level."""
+        real level.
+        
+        Large id lists are staged in a temporary table (see db.idSubquery) so that each of the loading
+        phases below is a single set-based query whose rows are processed while they are fetched.
+        """
         if level is None:
             level = self
             
         if len(idList) == 0: # queries will fail otherwise
             return []
         
-        csIdList = db.csList(idList)
+        with db.idSubquery(idList, 'load_ids') as ids:
+            for phase in self._loadPhases:
+                phase(self, level, ids)
+        if level is self:
+            for id in idList:
+                if id in self.elements:
+                    self._lastUsed[id] = None
+                    self._lastUsed.move_to_end(id)
         
-        # bare elements
+        try:
+            return [self.elements[id] for id in idList]
+        except KeyError: # probably some ids were not contained in the database
+            raise levels.ElementGetError(self, [id for id in idList if id not in self])
+    
+    def _loadBareElements(self, level, ids):
+        """Create the element objects of the elements selected by the SQL fragment *ids* in *level*."""
         result = db.query("""
                 SELECT el.domain, el.id, el.file, el.type, f.url, f.length
                 FROM {0}elements AS el LEFT JOIN {0}files AS f ON el.id = f.element_id
                 WHERE el.id IN ({1})
-                """.format(db.prefix, csIdList))
+                """.format(db.prefix, ids))
         for domainId, id, file, elementType, url, length in result:
             _dbIds.add(id)
             if file:
@@ -142,52 +245,57 @@ class RealLevel(levels.Level):
             else:
                 level.elements[id] = elements.Container(domains.domainById(domainId), level, id,
                                                         type=elements.ContainerType(elementType))
-                
-        # contents
+    
+    def _loadContents(self, level, ids):
+        """Load the contents of the containers selected by *ids*."""
         result = db.query("""
-                SELECT el.id, c.position, c.element_id
-                FROM {0}elements AS el JOIN {0}contents AS c ON el.id = c.container_id
-                WHERE el.id IN ({1})
+                SELECT container_id, position, element_id
+                FROM {0}contents
+                WHERE container_id IN ({1})
                 ORDER BY position
-                """.format(db.prefix, csIdList))
+                """.format(db.prefix, ids))
         for id, pos, contentId in result:
             level.elements[id].contents.insert(pos, contentId)
             
-        # parents
+    def _loadParents(self, level, ids):
+        """Load the parents of the elements selected by *ids*."""
         result = db.query("""
-                SELECT el.id, c.container_id
-                FROM {0}elements AS el JOIN {0}contents AS c ON el.id = c.element_id
-                WHERE el.id IN ({1})
-                """.format(db.prefix, csIdList))
-        for id, contentId in result:
-            level.elements[id].parents.append(contentId)
+                SELECT element_id, container_id
+                FROM {0}contents
+                WHERE element_id IN ({1})
+                """.format(db.prefix, ids))
+        for id, parentId in result:
+            level.elements[id].parents.append(parentId)
             
-        # tags
+    def _loadTags(self, level, ids):
+        """Load the tags of the elements selected by *ids*."""
         result = db.query("""
-                SELECT el.id, t.tag_id, t.value_id
-                FROM {0}elements AS el JOIN {0}tags AS t ON el.id = t.element_id
-                WHERE el.id IN ({1})
-                """.format(db.prefix, csIdList))
+                SELECT element_id, tag_id, value_id
+                FROM {0}tags
+                WHERE element_id IN ({1})
+                """.format(db.prefix, ids))
         for id, tagId, valueId in result:
             tag = tags.get(tagId)
             level.elements[id].tags.add(tag, db.tags.value(tag, valueId))
             
-        # flags
+    def _loadFlags(self, level, ids):
+        """Load the flags of the elements selected by *ids*."""
         result = db.query("""
-                SELECT el.id, f.flag_id
-                FROM {0}elements AS el JOIN {0}flags AS f ON el.id = f.element_id
-                WHERE el.id IN ({1})
-                """.format(db.prefix, csIdList))
+                SELECT element_id, flag_id
+                FROM {0}flags
+                WHERE element_id IN ({1})
+                """.format(db.prefix, ids))
         for id, flagId in result:
             level.elements[id].flags.append(flags.get(flagId))
             
-        # stickers
+    def _loadStickers(self, level, ids):
+        """Load the stickers of the elements selected by *ids*."""
         result = db.query("""
                 SELECT element_id, type, data
                 FROM {}stickers
                 WHERE element_id IN ({})
                 ORDER BY element_id, type, sort
-                """.format(db.prefix, csIdList))
+                """.format(db.prefix, ids))
         # This is a bit complicated because the stickers should be stored in tuples, not lists
         # Changing the lists would break undo/redo
         #TODO: is this really necessary?
@@ -206,35 +314,58 @@ class RealLevel(levels.Level):
             buffer.append(sticker)
         if current is not None:
             level.elements[current[0]].stickers[current[1]] = tuple(buffer)
-        
-        try:
-            return [self.elements[id] for id in idList]
-        except KeyError: # probably some ids were not contained in the database
-            raise levels.ElementGetError(self, [id for id in idList if id not in self])
+    
+    # The phases of loadFromDb in the order in which they must run. Benchmarks time them individually.
+    _loadPhases = (_loadBareElements, _loadContents, _loadParents, _loadTags, _loadFlags, _loadStickers)
             
-    def loadFromUrls(self, urls, level=None):
+    def loadFromUrls(self, urls, level=None, progress=None):
         """Loads files given by *urls*, into *level* which defaults to the real level. This must not be
-        used for elements which are contained in the database."""
+        used for elements which are contained in the database.
+        
+        Tags are read in parallel (see filesystem.readTagsParallel). If *progress* is given, it is called
+        with the number of files read so far after each chunk. If it returns False, loading is cancelled.
+        Return the list of loaded elements (in the order of *urls*, without files skipped due to
+        cancellation).
+        """
         if level is None:
             level = self
-        result = []
-        for url in urls:
-            backendFile = url.backendFile()
-            backendFile.readTags()
-            fTags = backendFile.tags
-            fLength = backendFile.length
-            if db.idFromUrl(url) is not None:
-                raise RuntimeError("loadFromURLs called on '{}', which is in DB.".format(url))
-            id = levels.idFromUrl(url, create=True)
-            from .. import filesystem
-            source = filesystem.sourceByPath(url.path)
-            domain = source.domain if source else domains.default()
-            elem = elements.File(domain, level, id, url=url, length=fLength, tags=fTags)
-            if hasattr(backendFile, 'specialTags'):
-                elem.specialTags = backendFile.specialTags
-            level.elements[id] = elem
-            result.append(elem)
-        return result
+        inDb = db.idsFromUrls(urls)
+        if len(inDb) > 0:
+            raise RuntimeError("loadFromURLs called on '{}', which is in DB.".format(next(iter(inDb))))
+        ids = levels.idsFromUrls(urls, create=True)
+        from .. import filesystem
+        reader = filesystem.readTagsParallel(urls)
+        try:
+            count = 0
+            for chunk in reader:
+                for url, fTags, specialTags, fLength in chunk:
+                    id = ids[url]
+                    source = filesystem.sourceByPath(url.path)
+                    domain = source.domain if source else domains.default()
+                    elem = elements.File(domain, level, id, url=url, length=fLength, tags=fTags)
+                    if specialTags is not None:
+                        elem.specialTags = specialTags
+                    level.elements[id] = elem
+                count += len(chunk)
+                if progress is not None and not progress(count):
+                    break
+        finally:
+            reader.close()
+        return [level.elements[ids[url]] for url in urls if ids[url] in level.elements]
+    
+    def loadNewUrls(self, urls, progress=None):
+        """Load those of *urls* which are neither loaded nor contained in the database into the real level,
+        reading tags in parallel. This is much faster than collecting many new files one by one. *progress*
+        is used as in loadFromUrls. Return False if loading has been cancelled.
+        """
+        inDb = db.idsFromUrls(urls)
+        levels._urlToId.update(inDb)
+        newUrls = [url for url in urls if url not in inDb
+                   and not (url in levels._urlToId and levels._urlToId[url] in self.elements)]
+        if len(newUrls) == 0:
+            return True
+        self._misses += len(newUrls)
+        return len(self.loadFromUrls(newUrls, progress=progress)) == len(newUrls)
     
     def _commitHelper(self, elements):
         """Helper function called by Level.commit() if the parent level is real."""
@@ -362,26 +493,32 @@ class RealLevel(levels.Level):
     
             # Do this early, otherwise e.g. setFlags might raise a ConsistencyError)
             _dbIds.update(element.id for element in elements)
-                
-            for element in elements:
-                # Set tags
-                db.query("DELETE FROM {p}tags WHERE element_id = ?", element.id)
-                for tag in element.tags:
-                    db.multiQuery("INSERT INTO {p}tags (element_id,tag_id,value_id) VALUES (?,?,?)",
-                          [(element.id, tag.id, db.tags.id(tag, value, insert=True))
-                           for value in element.tags[tag]])
-                
-                # Set flags
-                db.query("DELETE FROM {p}flags WHERE element_id = ?", element.id)
-                if len(element.flags) > 0:
-                    db.multiQuery("INSERT INTO {p}flags (element_id, flag_id) VALUES (?,?)",
-                                  [(element.id, flag.id) for flag in element.flags])
+            
+            # Build the rows of each table for all elements and insert them with a single query per table
+            with db.idSubquery([element.id for element in elements], 'add_ids') as ids:
+                for table in ('tags', 'flags', 'stickers'):
+                    db.query("DELETE FROM {}{} WHERE element_id IN ({})".format(db.prefix, table, ids))
+            
+            # Set tags
+            tagTriples = [(element, tag, value) for element in elements
+                          for tag, values in element.tags.items() for value in values]
+            valueIds = self._valueIds(tagTriples, insert=True)
+            tagData = [(element.id, tag.id, valueIds[tag][value]) for element, tag, value in tagTriples]
+            if len(tagData) > 0:
+                db.multiQuery("INSERT INTO {p}tags (element_id,tag_id,value_id) VALUES (?,?,?)", tagData)
+            
+            # Set flags
+            flagData = [(element.id, flag.id) for element in elements for flag in element.flags]
+            if len(flagData) > 0:
+                db.multiQuery("INSERT INTO {p}flags (element_id, flag_id) VALUES (?,?)", flagData)
     
-                # Set stickers
-                db.query("DELETE FROM {p}stickers WHERE element_id = ?", element.id)
-                for stickerType, values in element.stickers.items():
-                    db.multiQuery("INSERT INTO {p}stickers (element_id, type, sort, data) VALUES (?,?,?,?)",
-                                  [(element.id, stickerType, i, val) for i, val in enumerate(values)])
+            # Set stickers
+            stickerData = [(element.id, stickerType, i, val) for element in elements
+                           for stickerType, values in element.stickers.items()
+                           for i, val in enumerate(values)]
+            if len(stickerData) > 0:
+                db.multiQuery("INSERT INTO {p}stickers (element_id, type, sort, data) VALUES (?,?,?,?)",
+                              stickerData)
                     
             newFiles = [element for element in elements if element.isFile()]
             if len(newFiles) > 0:
@@ -403,6 +540,9 @@ class RealLevel(levels.Level):
             if len(contentData) > 0:
                 db.multiQuery("INSERT INTO {p}contents (container_id, position, element_id) VALUES (?,?,?)",
                               contentData)
+                db.closure.update(set(row[0] for row in contentData))
+            db.toplevel.update(itertools.chain((element.id for element in elements),
+                                               (row[2] for row in contentData)))
 
         self.emit(levels.LevelChangeEvent(dbAddedIds=[el.id for el in elements]))
                 
@@ -411,16 +551,24 @@ class RealLevel(levels.Level):
         for element in elements:
             assert element.isInDb()
             if element.isContainer():
-                del self.elements[element.id]
+                self.elements.pop(element.id, None)
+                self._evicted.pop(element.id, None)
                 for childId in element.contents:
                     self[childId].parents.remove(element.id)
         _dbIds.difference_update(element.id for element in elements)
         
-        # Rely on foreign keys to delete all tags, flags etc. from the database
+        # Rely on foreign keys to delete all tags, flags, closure rows etc. from the database
         ids = itertools.chain.from_iterable(element.contents for element in elements
                                                              if element.isContainer())
+        removedIds = set(element.id for element in elements)
+        if db.closure.enabled():
+            ancestors = db.closure.ancestors(removedIds)
         db.query("DELETE FROM {}elements WHERE id IN ({})"
-                 .format(db.prefix, db.csList(element.id for element in elements)))
+                 .format(db.prefix, db.csList(removedIds)))
+        if db.closure.enabled():
+            db.closure.update(ancestors - removedIds)
+        # Former contents of the removed elements may have become toplevel elements
+        db.toplevel.update(ids)
         removedFiles = [element.url for element in elements if element.isFile()
                                                             and element.url.scheme == "file"]
         if len(removedFiles) > 0:
@@ -458,16 +606,17 @@ class RealLevel(levels.Level):
         dbChanges = {el: diffs for el, diffs in changes.items() if el.isInDb()}
         if len(dbChanges) > 0:
             with db.transaction():
-                dbRemovals = [(el.id, tag.id, db.tags.id(tag, value))
-                              for el, diff in dbChanges.items()
-                              for tag, value in diff.getRemovals() if tag.isInDb()]
-                if len(dbRemovals):
+                removals = [(el, tag, value) for el, diff in dbChanges.items()
+                            for tag, value in diff.getRemovals() if tag.isInDb()]
+                if len(removals):
+                    valueIds = self._valueIds(removals, insert=False)
                     db.multiQuery('DELETE FROM {p}tags WHERE element_id=? AND tag_id=? AND value_id=?',
-                                  dbRemovals)
+                                  [(el.id, tag.id, valueIds[tag][value]) for el, tag, value in removals])
                     
-                dbAdditions = [(el.id, tag.id, db.tags.id(tag, value, insert=True))
-                               for el, diff in dbChanges.items()
-                               for tag, value in diff.getAdditions() if tag.isInDb()]
+                additions = [(el, tag, value) for el, diff in dbChanges.items()
+                             for tag, value in diff.getAdditions() if tag.isInDb()]
+                valueIds = self._valueIds(additions, insert=True)
+                dbAdditions = [(el.id, tag.id, valueIds[tag][value]) for el, tag, value in additions]
                 if len(dbAdditions):
                     db.multiQuery('INSERT INTO {p}tags (element_id, tag_id, value_id) VALUES (?,?,?)',
                                   dbAdditions)
@@ -477,6 +626,14 @@ class RealLevel(levels.Level):
 
         super()._changeTags(changes)
         
+    @staticmethod
+    def _valueIds(triples, insert):
+        """Resolve the values in a list of (element, tag, value)-triples using db.tags.idsForTags."""
+        values = collections.defaultdict(set)
+        for _, tag, value in triples:
+            values[tag].add(value)
+        return db.tags.idsForTags(values, insert)
+        
     def _changeFlags(self, changes):
         if not all(element.isInDb() for element in changes.keys()):
             raise levels.ConsistencyError("Elements on real must be added to the DB before adding tags.")
@@ -544,6 +701,8 @@ class RealLevel(levels.Level):
                 db.multiQuery("INSERT INTO {p}contents (container_id, position, element_id) VALUES (?,?,?)",
                               [(parent.id, pos, childId) for pos, childId in contents.items()])
             db.updateElementsCounter((parent.id,))
+            db.closure.update((parent.id,))
+            db.toplevel.update(itertools.chain(parent.contents, contents))
 
         super()._setContents(parent, contents)
 
@@ -554,6 +713,8 @@ class RealLevel(levels.Level):
             db.multiQuery("INSERT INTO {p}contents (container_id, position, element_id) VALUES (?,?,?)",
                           [(parent.id, pos, child.id) for pos, child in insertions])
             db.updateElementsCounter((parent.id,))
+            db.closure.update((parent.id,))
+            db.toplevel.update(child.id for _, child in insertions)
 
         super()._insertContents(parent, insertions)
         
@@ -562,6 +723,8 @@ class RealLevel(levels.Level):
             db.multiQuery("DELETE FROM {p}contents WHERE container_id=? AND position=?",
                           [(parent.id, pos) for pos in positions])
             db.updateElementsCounter((parent.id,))
+            db.closure.update((parent.id,))
+            db.toplevel.update(parent.contents.at(pos) for pos in positions)
 
         super()._removeContents(parent, positions)
     
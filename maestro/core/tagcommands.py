@@ -47,8 +47,7 @@ class ChangeSortValueCommand:
         self.setSortValue(self.oldSort, self.newSort)
     
     def setSortValue(self, new, old):
-        db.query("UPDATE {}values_{} SET sort_value = ? WHERE tag_id = ? AND id = ?"
-                 .format(db.prefix, self.tag.type), new, self.tag.id, self.valueId)
+        db.tags.setSortValue(self.tag, self.valueId, new)
         application.dispatcher.emit(SortValueChangeEvent(self.tag, self.valueId, old, new))
 
 
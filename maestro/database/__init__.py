@@ -35,8 +35,11 @@ or, if the connection was already established in another module:
 
 """
 
-import os, threading
+import os, re, threading, sqlite3
+import contextlib
 import datetime
+import functools
+import time
 import sqlalchemy
 
 from .. import config, utils
@@ -51,6 +54,7 @@ tags = None # tags submodule
 # Next id that will be returned by nextId() and lock to make that method threadsafe
 _nextId = None
 _nextIdLock = threading.Lock()
+_local = threading.local() # stores the query observer of each thread (see observeQueries)
 
 
 DBException = sqlalchemy.exc.DBAPIError
@@ -75,18 +79,29 @@ class FlexiDateType(sqlalchemy.types.TypeDecorator):
         return FlexiDateType()
 
 
+@functools.lru_cache(maxsize=64)
+def _compileRegex(pattern):
+    """Compile the regular expression *pattern* (cached, because SQLite calls REGEXP once per row)."""
+    return re.compile(pattern)
+
+
+def _regexp(pattern, string):
+    """Implementation of SQLite's REGEXP operator ("string REGEXP pattern")."""
+    return _compileRegex(pattern).search(string) is not None
+
+
 def createEngine(**kwargs):
     """Create an SqlAlchemy-engine. Usually you should use the module-level variable 'engine'."""
     if kwargs['type'] == 'sqlite':
         url = 'sqlite:///' + kwargs['path'] # absolute paths will have 4 slashes
         def creator():
-            import sqlite3, re
             connection = sqlite3.connect(kwargs['path'])
             connection.execute("PRAGMA foreign_keys = ON")
-            connection.create_function('regexp', 2, lambda p, s: re.search(p, s) is not None)
+            connection.create_function('regexp', 2, _regexp, deterministic=True)
             return connection
         
-        return sqlalchemy.create_engine(url, creator=creator, poolclass=sqlalchemy.pool.SingletonThreadPool)
+        return sqlalchemy.create_engine(url, creator=creator, poolclass=sqlalchemy.pool.SingletonThreadPool,
+                                        pool_size=_poolSize())
     else:
         # full url: {type}+{driver}://{user}:{password}@{host}:{port}/{name}
         # leave out driver and port parts if not specified
@@ -98,7 +113,15 @@ def createEngine(**kwargs):
             url += ':{port}'
         url += '/{name}'
         url = url.format(**kwargs)
-        return sqlalchemy.create_engine(url, poolclass=sqlalchemy.pool.SingletonThreadPool)
+        return sqlalchemy.create_engine(url, poolclass=sqlalchemy.pool.SingletonThreadPool,
+                                        pool_size=_poolSize())
+
+
+def _poolSize():
+    """Return the maximal number of connections (i.e. threads using the database). When it is exceeded,
+    SqlAlchemy closes connections of other threads. Besides SqlAlchemy's default of 5 connections for the
+    main thread and worker threads, each thread of the search executor needs one (see search.executor)."""
+    return 5 + config.options.search.parallelism
 
 
 def connect(**kwargs):
@@ -114,7 +137,8 @@ def init(**kwargs):
     information from the config file."""
     # connect to default database with args from config
     global type, prefix, engine, driver, tags
-    import maestro.database.tags
+    import maestro.database.tags, maestro.database.closure, maestro.database.fulltext, \
+        maestro.database.words, maestro.database.toplevel
     type = kwargs['type'] = kwargs.get('type', config.options.database.type)
     prefix = kwargs.get('prefix', config.options.database.prefix)
     driver = kwargs.get('driver', config.options.database.driver)
@@ -140,6 +164,7 @@ def init(**kwargs):
                 kwargs[arg] = config.options.database[arg]
 
     engine = createEngine(**kwargs)
+    maestro.database.tags.init()
     
     # Initialize nextId-stuff when the first connection is created
     with _nextIdLock:
@@ -205,8 +230,13 @@ def query(queryString, *args, **kwargs):
         queryString = queryString.replace('?', '%s')
     if 'print' in kwargs:
         print(queryString, args)
-    result = engine.execute(queryString, *args)
-    return SqlResult(result)
+    observer = getattr(_local, 'observer', None)
+    if observer is None:
+        return SqlResult(engine.execute(queryString, *args))
+    start = time.perf_counter()
+    result = SqlResult(engine.execute(queryString, *args))
+    observer(queryString, args, result, time.perf_counter() - start)
+    return result
 
 def multiQuery(queryString, args, **kwargs):
     """Like 'query', but *args* is an iterable of argument list. The method will execute one query per
@@ -217,6 +247,68 @@ def transaction():
     """Start a database transaction."""
     return engine.begin()
 
+
+@contextlib.contextmanager
+def observeQueries(observer):
+    """Context manager which calls *observer* after each query that the current thread executes within the
+    with-block. The arguments are the final query string, the query arguments, the SqlResult and the time
+    in seconds the database needed to execute the query. Queries which *observer* executes itself are not
+    observed.
+    """
+    previous = getattr(_local, 'observer', None)
+    def wrapper(*args):
+        _local.observer = None
+        try:
+            observer(*args)
+        finally:
+            _local.observer = wrapper
+    _local.observer = wrapper
+    try:
+        yield
+    finally:
+        _local.observer = previous
+
+
+def explain(queryString, args=()):
+    """Return the plan the database uses to execute a query as list of strings (one per line of the
+    output of EXPLAIN QUERY PLAN or EXPLAIN, respectively). *queryString* and *args* must be given like
+    they are passed to an observer of observeQueries, i.e. placeholders in braces have been replaced.
+    """
+    if type == 'sqlite':
+        # Columns: id, parent, notused, detail. Indent each step below its parent.
+        depths = {0: -1}
+        lines = []
+        for id, parent, _, detail in engine.execute('EXPLAIN QUERY PLAN ' + queryString, *args):
+            depths[id] = depths.get(parent, -1) + 1
+            lines.append('  ' * depths[id] + detail)
+        return lines
+    else:
+        result = engine.execute('EXPLAIN ' + queryString, *args)
+        return [', '.join('{}={}'.format(key, value) for key, value in zip(result.keys(), row)
+                          if value is not None)
+                for row in result]
+
+class Interrupter:
+    """Allows other threads to abort the statement which the connection of the current thread is executing
+    (e.g. a long search). Create the Interrupter in the thread which executes the statements and call
+    interrupt from any other thread. The aborted statement raises a DBException.
+    """
+    def __init__(self):
+        if type == 'sqlite':
+            with engine.connect() as connection:
+                self._connection = connection.connection.connection # the sqlite3-connection of this thread
+        else: self._connectionId = query("SELECT CONNECTION_ID()").getSingle()
+
+    def interrupt(self):
+        """Abort the statement that is executed at the moment. Do nothing if there is none."""
+        if type == 'sqlite':
+            try:
+                self._connection.interrupt()
+            except sqlite3.ProgrammingError: # the connection has been closed in the meantime
+                pass
+        else: query("KILL QUERY {}".format(self._connectionId))
+
+
 def getDate(value):
     if isinstance(value, str):
         value = datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
@@ -302,6 +394,26 @@ def _contentsParentsHelper(elids,recursive,selectColumn,whereColumn):
     if isinstance(elids,int):
         newSet = set([elids])
     else: newSet = set(elids)
+    if len(newSet) == 0:
+        return set()
+    
+    if recursive and closure.enabled():
+        if selectColumn == 'container_id':
+            return closure.ancestors(newSet)
+        else: return closure.descendants(newSet)
+    
+    if recursive and hasRecursiveQueries():
+        # Walk the whole hierarchy in a single query. UNION (instead of UNION ALL) removes duplicates and
+        # thus also guarantees termination.
+        with idSubquery(newSet, 'walk_ids') as ids:
+            return set(query("""
+                WITH RECURSIVE walk(id) AS (
+                    SELECT {select} FROM {p}contents WHERE {where} IN ({ids})
+                    UNION
+                    SELECT c.{select} FROM {p}contents AS c JOIN walk ON c.{where} = walk.id
+                )
+                SELECT id FROM walk
+                """, select=selectColumn, where=whereColumn, ids=ids).getSingleColumn())
 
     resultSet = set()
     while len(newSet) > 0:
@@ -318,6 +430,22 @@ def _contentsParentsHelper(elids,recursive,selectColumn,whereColumn):
     return resultSet
 
 
+_recursiveQueries = None
+
+def hasRecursiveQueries():
+    """Return whether the database supports recursive common table expressions (WITH RECURSIVE). SQLite
+    supports them since 3.8.3, MySQL since 8.0 and MariaDB since 10.2. Older servers must walk hierarchies
+    level by level."""
+    global _recursiveQueries
+    if _recursiveQueries is None:
+        try:
+            query("WITH RECURSIVE test(n) AS (SELECT 1) SELECT n FROM test").getSingle()
+            _recursiveQueries = True
+        except DBException:
+            _recursiveQueries = False
+    return _recursiveQueries
+
+
 # elements-table
 #=======================================================================
 # def isFile(elid):
@@ -398,6 +526,21 @@ def idFromUrl(url):
         return None
 
 
+def idsFromUrls(urls, chunkSize=500):
+    """Like idFromUrl, but resolve any number of URLs with one query per *chunkSize* URLs. Return a dict
+    mapping those of the given *urls* which belong to a file in the database to the file's element_id.
+    """
+    urlsByString = {str(url): url for url in urls}
+    strings = list(urlsByString.keys())
+    result = {}
+    for i in range(0, len(strings), chunkSize):
+        chunk = strings[i:i+chunkSize]
+        for urlString, id in query("SELECT url, element_id FROM {p}files WHERE url IN ({placeholders})",
+                                   *chunk, placeholders=','.join('?'*len(chunk))):
+            result[urlsByString[urlString]] = id
+    return result
+
+
 # def idFromHash(hash):
 #     """Return the element_id of a file from its hash, or None if it is not found."""
 #     result = list(query("SELECT element_id FROM {p}files WHERE hash=?", hash))
@@ -433,3 +576,37 @@ def csIdList(objects):
         return ','.join(str(object.id) for object in objects)
     else: return str(objects.id)
 
+
+def stageIds(ids, name='ids'):
+    """Store the given element ids in a temporary table with a single column 'id' and return the table's
+    name. The table is named after *name* and belongs to the connection of the current thread. Existing
+    contents of the table are removed first.
+    """
+    table = prefix + 'tmp_' + name
+    query("CREATE TEMPORARY TABLE IF NOT EXISTS {} (id INTEGER NOT NULL PRIMARY KEY)".format(table))
+    query("DELETE FROM {}".format(table))
+    ids = set(ids)
+    if len(ids) > 0:
+        multiQuery("INSERT INTO {} (id) VALUES (?)".format(table), ((id,) for id in ids))
+    return table
+
+
+@contextlib.contextmanager
+def idSubquery(ids, name='ids'):
+    """Context manager returning a piece of SQL that selects the given element ids and can be used in
+    clauses like "WHERE el.id IN ({})". Short lists are simply inserted as comma-separated list. Longer lists
+    (see option database.id_list_threshold) would exceed the expression limits of SQLite and make the
+    server parse huge queries. They are staged into a temporary table (see stageIds) which is emptied when
+    the context is left. *ids* must not be empty.
+    """
+    if not isinstance(ids, (set, frozenset)):
+        ids = set(ids)
+    if len(ids) <= config.options.database.id_list_threshold:
+        yield csList(ids)
+    else:
+        table = stageIds(ids, name)
+        try:
+            yield "SELECT id FROM {}".format(table)
+        finally:
+            query("DELETE FROM {}".format(table))
+
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+# Maestro Music Manager  -  https://github.com/maestromusic/maestro
+# Copyright (C) 2009-2015 Martin Altmayer, Michael Helmling
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Optional materialised transitive closure of the contents hierarchy.
+
+The table {p}contents_closure stores a row (ancestor, descendant, depth) for each pair of elements where
+*descendant* is contained in *ancestor* at some level. *depth* is the length of the shortest path (1 for
+direct contents). Elements are not stored as their own ancestors. With this table all ancestors or all
+descendants of a set of elements can be fetched with a single indexed query, regardless of the depth of
+the hierarchy.
+
+The table is enabled with the option database.contents_closure. It is not part of the tables-module
+because it contains only redundant data: It is created and filled by init (or rebuild) and maintained by
+RealLevel whenever contents change in the database (see update).
+"""
+
+import collections
+
+from maestro import config, database as db, logging
+
+
+# Number of rows inserted per query in rebuild and update
+CHUNK_SIZE = 10000
+
+_enabled = False
+
+
+def tableName():
+    """Return the name of the closure table (including the prefix)."""
+    return db.prefix + 'contents_closure'
+
+
+def enabled():
+    """Return whether the closure table exists and is kept up to date."""
+    return _enabled
+
+
+def exists():
+    """Return whether the closure table exists in the database."""
+    return tableName() in db.listTables()
+
+
+def init():
+    """Create and fill the closure table if the option database.contents_closure is set and the table does
+    not exist yet. If the option is not set, drop the table, because it would not be maintained anymore.
+    Do nothing if Maestro's tables have not been created yet (e.g. in the install tool).
+    """
+    global _enabled
+    if db.prefix + 'contents' not in db.listTables():
+        return
+    if config.options.database.contents_closure:
+        if not exists():
+            logging.info(__name__, "Creating table {}".format(tableName()))
+            create()
+            rebuild()
+        _enabled = True
+    else:
+        _enabled = False
+        if exists():
+            drop()
+
+
+def create():
+    """Create the (empty) closure table."""
+    if db.type == 'mysql':
+        db.query("""
+            CREATE TABLE {p}contents_closure (
+                ancestor INT NOT NULL,
+                descendant INT NOT NULL,
+                depth SMALLINT UNSIGNED NOT NULL,
+                PRIMARY KEY (ancestor, descendant),
+                INDEX {p}contents_closure_descendant_idx (descendant),
+                FOREIGN KEY (ancestor) REFERENCES {p}elements(id) ON DELETE CASCADE,
+                FOREIGN KEY (descendant) REFERENCES {p}elements(id) ON DELETE CASCADE
+            ) ENGINE InnoDB, CHARACTER SET 'utf8'
+            """)
+    else:
+        db.query("""
+            CREATE TABLE {p}contents_closure (
+                ancestor INTEGER NOT NULL,
+                descendant INTEGER NOT NULL,
+                depth SMALLINT NOT NULL,
+                PRIMARY KEY (ancestor, descendant),
+                FOREIGN KEY (ancestor) REFERENCES {p}elements(id) ON DELETE CASCADE,
+                FOREIGN KEY (descendant) REFERENCES {p}elements(id) ON DELETE CASCADE
+            )
+            """)
+        db.query("CREATE INDEX {p}contents_closure_descendant_idx ON {p}contents_closure (descendant)")
+
+
+def drop():
+    """Drop the closure table."""
+    global _enabled
+    _enabled = False
+    db.query("DROP TABLE {p}contents_closure")
+
+
+def rebuild():
+    """Recompute the whole closure table from the contents table."""
+    edges = db.query("SELECT container_id, element_id FROM {p}contents")
+    closures = _computeClosures(edges)
+    with db.transaction():
+        db.query("DELETE FROM {p}contents_closure")
+        _insert(closures)
+
+
+def differences():
+    """Compare the closure table to the contents table. Return a list of tuples (ancestor, descendant,
+    depth in table, correct depth) for all wrong, missing (depth in table is None) and superfluous
+    (correct depth is None) rows."""
+    closures = _computeClosures(db.query("SELECT container_id, element_id FROM {p}contents"))
+    result = []
+    for ancestor, descendant, depth in db.query(
+                                    "SELECT ancestor, descendant, depth FROM {p}contents_closure"):
+        correct = closures.get(ancestor, {}).pop(descendant, None)
+        if correct != depth:
+            result.append((ancestor, descendant, depth, correct))
+    for ancestor, closure in closures.items():
+        result.extend((ancestor, descendant, None, depth) for descendant, depth in closure.items())
+    return result
+
+
+def update(containerIds):
+    """Update the closure table after the contents of the containers with the given ids have changed. This
+    recomputes the rows of these containers and of all their ancestors. Rows of all other containers must be
+    correct. Ids of containers which have been removed from the database may be contained in
+    *containerIds*; they are skipped.
+    """
+    if not _enabled:
+        return
+    changed = set(containerIds)
+    if len(changed) == 0:
+        return
+    with db.transaction():
+        affected = changed | ancestors(changed)
+        with db.idSubquery(affected, 'closure_ids') as ids:
+            edges = list(db.query("SELECT container_id, element_id FROM {p}contents "
+                                  "WHERE container_id IN ({ids})", ids=ids))
+            # Rows of children outside of the affected set are still correct and are used as they are
+            known = collections.defaultdict(dict)
+            external = set(elementId for _, elementId in edges).difference(affected)
+            if len(external) > 0:
+                with db.idSubquery(external, 'closure_external') as externalIds:
+                    for ancestor, descendant, depth in db.query(
+                            "SELECT ancestor, descendant, depth FROM {p}contents_closure "
+                            "WHERE ancestor IN ({ids})", ids=externalIds):
+                        known[ancestor][descendant] = depth
+            closures = _computeClosures(edges, known)
+            db.query("DELETE FROM {p}contents_closure WHERE ancestor IN ({ids})", ids=ids)
+        _insert(closures)
+
+
+def ancestors(elids):
+    """Return the ids of all ancestors of the given elements."""
+    with db.idSubquery(elids, 'closure_walk') as ids:
+        return set(db.query("SELECT DISTINCT ancestor FROM {p}contents_closure WHERE descendant IN ({ids})",
+                            ids=ids).getSingleColumn())
+
+
+def descendants(elids):
+    """Return the ids of all descendants of the given elements."""
+    with db.idSubquery(elids, 'closure_walk') as ids:
+        return set(db.query("SELECT DISTINCT descendant FROM {p}contents_closure WHERE ancestor IN ({ids})",
+                            ids=ids).getSingleColumn())
+
+
+def _computeClosures(edges, known=None):
+    """Compute the closure of each container occurring in *edges*, an iterable of (container id,
+    element id)-pairs. Return a dict mapping each container to a dict {descendant: depth}. *known* may map
+    containers which do not occur as container in *edges* to their (already correct) closure dicts.
+    Containers are processed children first. Cycles (which must not exist) are broken arbitrarily instead
+    of looping forever.
+    """
+    children = collections.defaultdict(list)
+    for containerId, elementId in edges:
+        children[containerId].append(elementId)
+    closures = dict(known) if known is not None else {}
+    result = {}
+    for root in children:
+        if root in result:
+            continue
+        # Depth-first search; *path* contains the containers on the stack, i.e. the ancestors of the
+        # current container.
+        stack = [(root, iter(children[root]))]
+        path = {root}
+        while len(stack) > 0:
+            id, childIter = stack[-1]
+            for childId in childIter:
+                if childId in children and childId not in result and childId not in path:
+                    stack.append((childId, iter(children[childId])))
+                    path.add(childId)
+                    break
+            else:
+                stack.pop()
+                path.discard(id)
+                closure = {}
+                for childId in children[id]:
+                    closure[childId] = 1
+                for childId in children[id]:
+                    for descendant, depth in closures.get(childId, {}).items():
+                        if depth + 1 < closure.get(descendant, depth + 2):
+                            closure[descendant] = depth + 1
+                closure.pop(id, None)
+                result[id] = closures[id] = closure
+    return result
+
+
+def _insert(closures):
+    """Insert the rows for the given result of _computeClosures."""
+    rows = []
+    for ancestor, closure in closures.items():
+        rows.extend((ancestor, descendant, depth) for descendant, depth in closure.items())
+        if len(rows) >= CHUNK_SIZE:
+            db.multiQuery("INSERT INTO {p}contents_closure (ancestor, descendant, depth) VALUES (?,?,?)",
+                          rows)
+            rows = []
+    if len(rows) > 0:
+        db.multiQuery("INSERT INTO {p}contents_closure (ancestor, descendant, depth) VALUES (?,?,?)", rows)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# Maestro Music Manager  -  https://github.com/maestromusic/maestro
+# Copyright (C) 2009-2015 Martin Altmayer, Michael Helmling
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Optional full-text index of varchar and text values.
+
+Without this index a substring search must scan the whole values_varchar or values_text table. With the
+option database.fulltext_index, the tables {p}values_varchar_fts and {p}values_text_fts store each value
+in an SQLite FTS5 table using the trigram tokenizer (the rowid is the value id). Varchar values are stored
+with diacritics removed, i.e. like the search_value column. The search (see AbstractTagCriterion.process)
+uses the index to find candidate values for substrings of at least three characters and checks the
+candidates with the usual conditions. This includes prefixes of words and #word searches.
+
+Like the closure table (see database.closure) the tables contain only redundant data: They are created and
+filled by init (or rebuild) and maintained by the database.tags module when values are inserted or
+deleted. The index requires SQLite 3.34 or later; it is not available for MySQL.
+"""
+
+from maestro import config, database as db, logging, utils
+from maestro.core import tags
+
+
+# Number of rows inserted per query in rebuild
+CHUNK_SIZE = 10000
+
+# Trigram tokenizer: Shorter search strings cannot use the index
+MIN_LENGTH = 3
+
+_enabled = False
+
+
+def valueTypes():
+    """Return the value types whose values are indexed."""
+    return (tags.TYPE_VARCHAR, tags.TYPE_TEXT)
+
+
+def tableName(valueType):
+    """Return the name of the full-text table for values of *valueType* (including the prefix)."""
+    return _valueTable(valueType) + '_fts'
+
+
+def enabled():
+    """Return whether the full-text tables exist and are kept up to date."""
+    return _enabled
+
+
+def exists():
+    """Return whether the full-text tables exist in the database."""
+    tables = db.listTables()
+    return all(tableName(valueType) in tables for valueType in valueTypes())
+
+
+def init():
+    """Create and fill the full-text tables if the option database.fulltext_index is set and they do not
+    exist yet. If the option is not set, drop the tables, because they would not be maintained anymore.
+    Do nothing if Maestro's tables have not been created yet (e.g. in the install tool).
+    """
+    global _enabled
+    if db.type != 'sqlite' or db.prefix + 'values_varchar' not in db.listTables():
+        if config.options.database.fulltext_index and db.type != 'sqlite':
+            logging.warning(__name__, "The full-text index is only available for SQLite.")
+        return
+    if config.options.database.fulltext_index:
+        if not exists():
+            logging.info(__name__, "Creating full-text index")
+            try:
+                create()
+            except db.DBException as e:
+                logging.warning(__name__, "Could not create the full-text index "
+                                          "(SQLite 3.34 or later is required): {}".format(e))
+                drop()
+                return
+            rebuild()
+        _enabled = True
+    else:
+        _enabled = False
+        if any(tableName(valueType) in db.listTables() for valueType in valueTypes()):
+            drop()
+
+
+def create():
+    """Create the (empty) full-text tables."""
+    for valueType in valueTypes():
+        db.query("CREATE VIRTUAL TABLE {} USING fts5(value, tokenize='trigram')".format(tableName(valueType)))
+
+
+def drop():
+    """Drop the full-text tables."""
+    global _enabled
+    _enabled = False
+    tables = db.listTables()
+    for valueType in valueTypes():
+        if tableName(valueType) in tables:
+            db.query("DROP TABLE {}".format(tableName(valueType)))
+
+
+def rebuild():
+    """Refill the full-text tables from the value tables."""
+    with db.transaction():
+        for valueType in valueTypes():
+            db.query("DELETE FROM {}".format(tableName(valueType)))
+            values = list(db.query("SELECT id, value FROM {}".format(_valueTable(valueType))))
+            _insert(valueType, values)
+
+
+def differences():
+    """Compare the full-text tables to the value tables. Return a list of tuples (value type name, value id,
+    text in the index, correct text) for all wrong, missing (text in the index is None) and superfluous
+    (correct text is None) rows."""
+    result = []
+    for valueType in valueTypes():
+        correct = {id: _text(valueType, value)
+                   for id, value in db.query("SELECT id, value FROM {}".format(_valueTable(valueType)))}
+        for id, text in db.query("SELECT rowid, value FROM {}".format(tableName(valueType))):
+            correctText = correct.pop(id, None)
+            if correctText != text:
+                result.append((valueType.name, id, text, correctText))
+        result.extend((valueType.name, id, None, text) for id, text in correct.items())
+    return result
+
+
+def insert(valueType, values):
+    """Add values of type *valueType* to the index. *values* is an iterable of (value id, value)-tuples
+    of values which have just been inserted into the value table. Do nothing if the index is disabled or
+    *valueType* is not indexed."""
+    if _enabled and valueType in valueTypes():
+        _insert(valueType, values)
+
+
+def deleteSuperfluous():
+    """Remove all rows whose value does not exist anymore. Call this after deleting values."""
+    if _enabled:
+        for valueType in valueTypes():
+            db.query("DELETE FROM {} WHERE rowid NOT IN (SELECT id FROM {})"
+                     .format(tableName(valueType), _valueTable(valueType)))
+
+
+def matchClause(valueType, string):
+    """Return a tuple (SQL condition, argument) for the WHERE clause of a query on the value table of
+    *valueType*, which selects all values that may contain *string*. The condition matches a superset of
+    the values containing *string* case-insensitively, so the caller must still check the exact condition.
+    For varchar values *string* must not contain diacritics. Return None if the index cannot be used, e.g.
+    because *string* is too short."""
+    if not _enabled or valueType not in valueTypes() or len(string) < MIN_LENGTH:
+        return None
+    table = tableName(valueType)
+    return ("id IN (SELECT rowid FROM {0} WHERE {0} MATCH ?)".format(table),
+            '"{}"'.format(string.replace('"', '""')))
+
+
+def _valueTable(valueType):
+    """Return the name of the value table of *valueType*. ValueType.table cannot be used before the
+    core.tags module has been initialized."""
+    return '{}values_{}'.format(db.prefix, valueType.name)
+
+
+def _text(valueType, value):
+    """Return the text stored in the index for *value*."""
+    if valueType == tags.TYPE_VARCHAR:
+        return utils.strings.removeDiacritics(value)
+    else: return value
+
+
+def _insert(valueType, values):
+    """Insert rows for the given (value id, value)-tuples."""
+    query = "INSERT INTO {} (rowid, value) VALUES (?,?)".format(tableName(valueType))
+    rows = []
+    for id, value in values:
+        rows.append((id, _text(valueType, value)))
+        if len(rows) >= CHUNK_SIZE:
+            db.multiQuery(query, rows)
+            rows = []
+    if len(rows) > 0:
+        db.multiQuery(query, rows)
@@ -16,21 +16,130 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-from maestro import database as db, utils
+import collections
+import threading
+
+from maestro import config, database as db, utils
 from maestro.core import tags as tagsModule
- 
-_idToValue = {}
-_valueToId = {}
+
+
+CacheInfo = collections.namedtuple('CacheInfo', 'hits misses size maxSize')
+
+
+class ValueCache:
+    """Cache for id<->value relations of tag values. The cache holds at most *maxSize* values (unless
+    *maxSize* is 0) and discards the least recently used values when it is full. All methods may be used
+    from several threads.
+    """
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self._lock = threading.Lock()
+        self._values = collections.OrderedDict() # (tag, id) -> value in LRU order
+        self._ids = {} # (tag, value) -> id
+        self._sortValues = {} # tag -> dict mapping values to their sort values (see sortValues)
+        self._hits = self._misses = 0
+        
+    def value(self, tag, valueId):
+        """Return the value of *tag* with id *valueId* or None if it is not cached."""
+        with self._lock:
+            value = self._values.get((tag, valueId))
+            if value is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+                self._values.move_to_end((tag, valueId))
+            return value
+        
+    def id(self, tag, value):
+        """Return the id of *value* for the tag *tag* or None if it is not cached."""
+        with self._lock:
+            valueId = self._ids.get((tag, value))
+            if valueId is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+                self._values.move_to_end((tag, valueId))
+            return valueId
+        
+    def add(self, tag, valueId, value):
+        """Store the relation between *valueId* and *value* of tag *tag*."""
+        if tag.type == tagsModule.TYPE_TEXT:
+            return # texts are mostly not displayed
+        with self._lock:
+            self._values[tag, valueId] = value
+            self._values.move_to_end((tag, valueId))
+            self._ids[tag, value] = valueId
+            if self.maxSize > 0:
+                while len(self._values) > self.maxSize:
+                    (oldTag, oldId), oldValue = self._values.popitem(last=False)
+                    if self._ids.get((oldTag, oldValue)) == oldId:
+                        del self._ids[oldTag, oldValue]
+                        
+    def sortValues(self, tag):
+        """Return the dict stored with setSortValues for *tag* or None if it is not cached."""
+        with self._lock:
+            return self._sortValues.get(tag)
+        
+    def setSortValues(self, tag, sortValues):
+        """Store the dict mapping the values of *tag* which have a sort value to their sort values."""
+        with self._lock:
+            self._sortValues[tag] = sortValues
+            
+    def removeSortValues(self, tag):
+        """Remove the sort values of *tag* from the cache."""
+        with self._lock:
+            self._sortValues.pop(tag, None)
+        
+    def isFull(self):
+        return self.maxSize > 0 and len(self._values) >= self.maxSize
+                    
+    def clear(self):
+        """Remove all values from the cache."""
+        with self._lock:
+            self._values.clear()
+            self._ids.clear()
+            self._sortValues.clear()
+            
+    def info(self):
+        """Return a CacheInfo-tuple with the number of hits and misses, the current size and the maximum
+        size of this cache."""
+        return CacheInfo(self._hits, self._misses, len(self._values), self.maxSize)
+
+
+_cache = None
+
+
+def init():
+    """Create the value cache. This is called when the database is initialized."""
+    global _cache
+    _cache = ValueCache(config.options.database.value_cache_size)
+    
+
+def cacheInfo():
+    """Return statistics about the value cache, see ValueCache.info."""
+    return _cache.info()
 
 
 def cacheValues():
-    """Cache all id<->value relations, except for text-tags (which are mostly not displayed)."""
+    """Fill the value cache with values of all tags except text-tags (which are mostly not displayed) until
+    it is full. Since values are cached lazily anyway, this is only an optimization and may run in a
+    background thread (see warmCacheInBackground).
+    """
     for tag in tagsModule.tagList:
-        if tag.type != tagsModule.TYPE_TEXT:
-            values = getIdsAndValues(tag)
-            _idToValue[tag] = {id: value for id, value in values}
-            # do not traverse *values* twice
-            _valueToId[tag] = {value: id for id,value in _idToValue[tag].items()}
+        if tag.type != tagsModule.TYPE_TEXT and tag.isInDb():
+            if _cache.isFull():
+                return
+            whereClause = '1' if _cache.maxSize <= 0 \
+                              else '1 LIMIT {}'.format(_cache.maxSize - _cache.info().size)
+            for id, value in getIdsAndValues(tag, whereClause):
+                _cache.add(tag, id, value)
+
+
+def warmCacheInBackground():
+    """Start a thread that fills the value cache using cacheValues."""
+    thread = threading.Thread(target=cacheValues, name='ValueCacheWarmer', daemon=True)
+    thread.start()
+    return thread
       
 
 def getIdsAndValues(tagSpec, whereClause='1', *args, **kwargs):
@@ -60,10 +169,9 @@ def value(tagSpec, valueId):
     tag = tagsModule.get(tagSpec)
     
     # Check cache
-    if tag in _idToValue:
-        value = _idToValue[tag].get(valueId)
-        if value is not None:
-            return value
+    value = _cache.value(tag, valueId)
+    if value is not None:
+        return value
         
     # Look up value
     values = list(getValues(tag, "id={}".format(valueId)))
@@ -71,11 +179,7 @@ def value(tagSpec, valueId):
         value = values[0]
     else: raise KeyError("There is no value of tag '{}' for id {}".format(tag,valueId))
     
-    # Store value in cache
-    if tag.type != tagsModule.TYPE_TEXT:
-        if tag not in _idToValue:
-            _idToValue[tag] = {}
-        _idToValue[tag][id] = value
+    _cache.add(tag, valueId, value)
     return value
 
 
@@ -87,13 +191,12 @@ def id(tagSpec, value, insert=False):
     tag = tagsModule.get(tagSpec)
     
     # Check cache
-    if tag in _valueToId:
-        id = _valueToId[tag].get(value)
-        if id is not None:
-            return id
+    id = _cache.id(tag, value)
+    if id is not None:
+        return id
 
     # Look up id
-    if tag.type in (tagsModule.TYPE_VARCHAR, tagsModule.TYPE_TEXT) and type == 'mysql':
+    if tag.type in (tagsModule.TYPE_VARCHAR, tagsModule.TYPE_TEXT) and db.type == 'mysql':
         whereClause = "value COLLATE utf8_bin = ?"
     else:
         whereClause = "value = ?"
@@ -113,17 +216,88 @@ def id(tagSpec, value, insert=False):
                           .format(tag.type.table, columns, ','.join(['?']*len(args))),
                           *args)
         id = result.insertId()
+        db.fulltext.insert(tag.type, [(id, value)])
+        db.words.insert(tag.type, [(id, value)])
     else:
         raise KeyError("No value id for tag '{}' and value '{}'".format(tag, value))
     
-    # Store id in cache
-    if tag.type != tagsModule.TYPE_TEXT:
-        if tag not in _valueToId:
-            _valueToId[tag] = {}
-        _valueToId[tag][value] = id
+    _cache.add(tag, id, value)
     return id
 
 
+def ids(tagSpec, values, insert=False):
+    """Return a dict mapping the given *values* of the tag *tagSpec* to their ids. Values which do not
+    exist are missing in the result, unless *insert* is True. In that case they are inserted into the
+    database. Contrary to calling id for each value, this needs only a few queries.
+    """
+    tag = tagsModule.get(tagSpec)
+    return idsForTags({tag: values}, insert)[tag]
+
+
+def idsForTags(valuesByTag, insert=False):
+    """Like ids, but for several tags at once: *valuesByTag* maps tags (or tag specifications) to iterables
+    of values. Return a dict mapping each tag to a dict mapping values to ids. The values of all tags which
+    use the same value table are looked up with one query (per 500 values).
+    """
+    result = {}
+    missing = collections.defaultdict(dict) # maps value types to dicts tag->set of values
+    for tagSpec, values in valuesByTag.items():
+        tag = tagsModule.get(tagSpec)
+        result[tag] = {}
+        for value in values:
+            id = _cache.id(tag, value)
+            if id is not None:
+                result[tag][value] = id
+            else: missing[tag.type].setdefault(tag, set()).add(value)
+            
+    for valueType, valuesByTag in missing.items():
+        _lookUpIds(valueType, valuesByTag, result)
+        if insert:
+            notFound = {}
+            for tag, values in valuesByTag.items():
+                values = [value for value in values if value not in result[tag]]
+                if len(values) > 0:
+                    notFound[tag] = values
+            if len(notFound) > 0:
+                if valueType == tagsModule.TYPE_VARCHAR:
+                    db.multiQuery("INSERT INTO {} (tag_id, value, search_value) VALUES (?,?,?)"
+                                  .format(valueType.table),
+                                  [(tag.id, tag.sqlFormat(value), _makeSearchValue(value))
+                                   for tag, values in notFound.items() for value in values])
+                else:
+                    db.multiQuery("INSERT INTO {} (tag_id, value) VALUES (?,?)".format(valueType.table),
+                                  [(tag.id, tag.sqlFormat(value))
+                                   for tag, values in notFound.items() for value in values])
+                _lookUpIds(valueType, notFound, result)
+                newValues = [(result[tag][value], tag.sqlFormat(value))
+                             for tag, values in notFound.items() for value in values]
+                db.fulltext.insert(valueType, newValues)
+                db.words.insert(valueType, newValues)
+    return result
+
+
+def _lookUpIds(valueType, valuesByTag, result, chunkSize=500):
+    """Look up the ids of the values in *valuesByTag* (a dict mapping tags of type *valueType* to values)
+    and store them in *result* (mapping tags to dicts value->id) and in the cache."""
+    wanted = {(tag.id, tag.sqlFormat(value)): (tag, value)
+              for tag, values in valuesByTag.items() for value in values}
+    if valueType in (tagsModule.TYPE_VARCHAR, tagsModule.TYPE_TEXT) and db.type == 'mysql':
+        column = "value COLLATE utf8_bin"
+    else: column = "value"
+    tagIds = db.csList(tag.id for tag in valuesByTag)
+    sqlValues = list(set(sqlValue for _, sqlValue in wanted))
+    for i in range(0, len(sqlValues), chunkSize):
+        chunk = sqlValues[i:i+chunkSize]
+        rows = db.query("SELECT tag_id, id, value FROM {} WHERE tag_id IN ({}) AND {} IN ({})"
+                        .format(valueType.table, tagIds, column, ','.join('?'*len(chunk))),
+                        *chunk)
+        for tagId, id, sqlValue in rows:
+            if (tagId, sqlValue) in wanted:
+                tag, value = wanted[tagId, sqlValue]
+                result[tag][value] = id
+                _cache.add(tag, id, value)
+                    
+
 def _makeSearchValue(value):
     """Return the search value for value (may be None)."""
     searchValue = utils.strings.removeDiacritics(value)
@@ -148,6 +322,10 @@ def deleteSuperfluousValues():
         else:
             # Cannot delete from a table used in a subquery in MySQL
             db.query("DELETE FROM {0} WHERE id IN (SELECT {0}.id {1})".format(table, mainPart))
+    db.fulltext.deleteSuperfluous()
+    db.words.deleteSuperfluous()
+    # Deleted ids might be reused
+    _cache.clear()
     
 
 def isHidden(tagSpec, valueId):
@@ -169,6 +347,27 @@ def sortValue(tagSpec, valueId, valueIfNone=False):
     elif valueIfNone:
         return value
     else: return None
+
+
+def sortValues(tagSpec):
+    """Return a dict mapping the values of the tag *tagSpec* which have a sort value to their sort values.
+    Usually only few values have a sort value, so the dict is loaded once and kept in the value cache. It
+    must not be modified."""
+    tag = tagsModule.get(tagSpec)
+    result = _cache.sortValues(tag)
+    if result is None:
+        result = dict(db.query("SELECT value, sort_value FROM {} WHERE tag_id = ? AND sort_value IS NOT NULL"
+                               .format(tag.type.table), tag.id))
+        _cache.setSortValues(tag, result)
+    return result
+
+
+def setSortValue(tagSpec, valueId, sortValue):
+    """Set the sort value of the value with id *valueId* of the tag *tagSpec* (None removes it)."""
+    tag = tagsModule.get(tagSpec)
+    db.query("UPDATE {} SET sort_value = ? WHERE tag_id = ? AND id = ?".format(tag.type.table),
+             sortValue, tag.id, valueId)
+    _cache.removeSortValues(tag)
     
 
 def getStorage(elid):
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# Maestro Music Manager  -  https://github.com/maestromusic/maestro
+# Copyright (C) 2009-2015 Martin Altmayer, Michael Helmling
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Optional table of toplevel elements.
+
+The browser, when it displays all elements of a domain, starts with the toplevel elements, i.e. elements
+which are not contained in any container. Without further help this requires an anti-join of the elements
+table with the contents table over the whole collection. With the option database.toplevel_index, the
+table {p}toplevel stores a row (domain, element_id) for each toplevel element, so that the toplevel
+elements of a domain can be selected with an index range scan. Use the SQL returned by subquery, which
+falls back to the anti-join if the table is disabled.
+
+Like the closure table (see database.closure) the table contains only redundant data: It is created and
+filled by init (or rebuild) and maintained by RealLevel whenever elements are added or contents change
+(see update). Rows of deleted elements are removed by foreign keys.
+"""
+
+from maestro import config, database as db, logging
+
+
+_enabled = False
+
+# Select (domain, id) of all toplevel elements without using the table. Used to fill and check the table.
+_SELECT_TOPLEVEL = """
+    SELECT el.domain, el.id
+    FROM {p}elements AS el
+    WHERE NOT EXISTS (SELECT 1 FROM {p}contents AS c WHERE c.element_id = el.id)
+    """
+
+
+def tableName():
+    """Return the name of the toplevel table (including the prefix)."""
+    return db.prefix + 'toplevel'
+
+
+def enabled():
+    """Return whether the toplevel table exists and is kept up to date."""
+    return _enabled
+
+
+def exists():
+    """Return whether the toplevel table exists in the database."""
+    return tableName() in db.listTables()
+
+
+def init():
+    """Create and fill the toplevel table if the option database.toplevel_index is set and the table does
+    not exist yet. If the option is not set, drop the table, because it would not be maintained anymore.
+    Do nothing if Maestro's tables have not been created yet (e.g. in the install tool).
+    """
+    global _enabled
+    if db.prefix + 'contents' not in db.listTables():
+        return
+    if config.options.database.toplevel_index:
+        if not exists():
+            logging.info(__name__, "Creating table {}".format(tableName()))
+            create()
+            rebuild()
+        _enabled = True
+    else:
+        _enabled = False
+        if exists():
+            drop()
+
+
+def create():
+    """Create the (empty) toplevel table."""
+    if db.type == 'mysql':
+        db.query("""
+            CREATE TABLE {p}toplevel (
+                domain INT NOT NULL,
+                element_id INT NOT NULL,
+                PRIMARY KEY (domain, element_id),
+                UNIQUE INDEX {p}toplevel_element_idx (element_id),
+                FOREIGN KEY (element_id) REFERENCES {p}elements(id) ON DELETE CASCADE
+            ) ENGINE InnoDB, CHARACTER SET 'utf8'
+            """)
+    else:
+        db.query("""
+            CREATE TABLE {p}toplevel (
+                domain INTEGER NOT NULL,
+                element_id INTEGER NOT NULL,
+                PRIMARY KEY (domain, element_id),
+                FOREIGN KEY (element_id) REFERENCES {p}elements(id) ON DELETE CASCADE
+            )
+            """)
+        db.query("CREATE UNIQUE INDEX {p}toplevel_element_idx ON {p}toplevel (element_id)")
+
+
+def drop():
+    """Drop the toplevel table."""
+    global _enabled
+    _enabled = False
+    db.query("DROP TABLE {p}toplevel")
+
+
+def rebuild():
+    """Refill the toplevel table from the elements and contents tables."""
+    with db.transaction():
+        db.query("DELETE FROM {p}toplevel")
+        db.query("INSERT INTO {p}toplevel (domain, element_id)" + _SELECT_TOPLEVEL)
+
+
+def differences():
+    """Compare the toplevel table to the elements and contents tables. Return a list of tuples (element id,
+    domain in the table, correct domain) for all wrong, missing (domain in the table is None) and
+    superfluous (correct domain is None) rows."""
+    correct = dict((id, domain) for domain, id in db.query(_SELECT_TOPLEVEL))
+    result = []
+    for domain, id in db.query("SELECT domain, element_id FROM {p}toplevel"):
+        correctDomain = correct.pop(id, None)
+        if correctDomain != domain:
+            result.append((id, domain, correctDomain))
+    result.extend((id, None, domain) for id, domain in correct.items())
+    result.sort()
+    return result
+
+
+def update(elids):
+    """Update the rows of the elements with the given ids after they have been added to the database or
+    after they have been inserted into or removed from containers. Ids of elements which have been removed
+    from the database may be contained in *elids*; they are skipped.
+    """
+    if not _enabled:
+        return
+    elids = set(elids)
+    if len(elids) == 0:
+        return
+    with db.transaction():
+        with db.idSubquery(elids, 'toplevel_ids') as ids:
+            db.query("DELETE FROM {p}toplevel WHERE element_id IN ({ids})", ids=ids)
+            db.query("INSERT INTO {p}toplevel (domain, element_id)" + _SELECT_TOPLEVEL
+                     + "AND el.id IN ({ids})", ids=ids)
+
+
+def subquery(domain):
+    """Return SQL selecting the ids of all toplevel elements of *domain*, which can be used in clauses like
+    "WHERE el.id IN ({})"."""
+    if _enabled:
+        return "SELECT element_id FROM {}toplevel WHERE domain = {}".format(db.prefix, domain.id)
+    else: return "SELECT el.id FROM {0}elements AS el WHERE el.domain = {1} AND NOT EXISTS " \
+                 "(SELECT 1 FROM {0}contents AS c WHERE c.element_id = el.id)".format(db.prefix, domain.id)
+
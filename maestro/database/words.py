@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# Maestro Music Manager  -  https://github.com/maestromusic/maestro
+# Copyright (C) 2009-2015 Martin Altmayer, Michael Helmling
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Optional word index of varchar values.
+
+SQLite has no built-in REGEXP operator. Maestro registers a Python function for it, so a #word search
+(TagCriterion with singleWord=True) calls Python for every row of values_varchar. With the option
+database.word_index, the table {p}values_varchar_words stores the words of each value, i.e. the maximal runs
+of word characters (\\w in Python's re module), in lower case and with diacritics removed like the
+search_value column. Every value in which the search string occurs as a whole word contains the words of
+the search string, so the search (see AbstractTagCriterion.process) uses an indexed lookup of one of these
+words to find candidate values and checks only the candidates with the usual REGEXP condition.
+
+Like the full-text index (see database.fulltext) the table contains only redundant data: It is created and
+filled by init (or rebuild) and maintained by the database.tags module when values are inserted or
+deleted. The index is only used with SQLite; MySQL evaluates REGEXP natively.
+"""
+
+import re
+
+from maestro import config, database as db, logging, utils
+from maestro.core import tags
+
+
+# Number of rows inserted per query in rebuild
+CHUNK_SIZE = 10000
+
+_enabled = False
+
+_wordRegex = re.compile(r'\w+')
+# Search strings which start and end with a word character. Each of their words occurs as a whole word in
+# the values matching \bstring\b.
+_searchRegex = re.compile(r'\w+(?:\W+\w+)*')
+
+
+def tableName():
+    """Return the name of the word table (including the prefix)."""
+    return db.prefix + 'values_varchar_words'
+
+
+def enabled():
+    """Return whether the word table exists and is kept up to date."""
+    return _enabled
+
+
+def exists():
+    """Return whether the word table exists in the database."""
+    return tableName() in db.listTables()
+
+
+def init():
+    """Create and fill the word table if the option database.word_index is set and it does not exist yet.
+    If the option is not set, drop the table, because it would not be maintained anymore. Do nothing if
+    Maestro's tables have not been created yet (e.g. in the install tool).
+    """
+    global _enabled
+    if db.type != 'sqlite' or db.prefix + 'values_varchar' not in db.listTables():
+        if config.options.database.word_index and db.type != 'sqlite':
+            logging.warning(__name__, "The word index is only available for SQLite.")
+        return
+    if config.options.database.word_index:
+        if not exists():
+            logging.info(__name__, "Creating table {}".format(tableName()))
+            create()
+            rebuild()
+        _enabled = True
+    else:
+        _enabled = False
+        if exists():
+            drop()
+
+
+def create():
+    """Create the (empty) word table."""
+    db.query("""
+        CREATE TABLE {p}values_varchar_words (
+            word VARCHAR NOT NULL,
+            value_id INTEGER NOT NULL,
+            PRIMARY KEY (word, value_id)
+        ) WITHOUT ROWID
+        """)
+    db.query("CREATE INDEX {p}values_varchar_words_value_idx ON {p}values_varchar_words (value_id)")
+
+
+def drop():
+    """Drop the word table."""
+    global _enabled
+    _enabled = False
+    db.query("DROP TABLE {p}values_varchar_words")
+
+
+def rebuild():
+    """Refill the word table from the values_varchar table."""
+    with db.transaction():
+        db.query("DELETE FROM {p}values_varchar_words")
+        _insert(list(db.query("SELECT id, value FROM {p}values_varchar")))
+
+
+def differences():
+    """Compare the word table to the values_varchar table. Return a list of tuples (value id, words in the
+    index, correct words) for all values whose words are wrong, missing (words in the index is None) or
+    superfluous (correct words is None). Words are given as space-separated sorted strings."""
+    correct = {id: words(value) for id, value in db.query("SELECT id, value FROM {p}values_varchar")}
+    indexed = {}
+    for id, word in db.query("SELECT value_id, word FROM {p}values_varchar_words"):
+        indexed.setdefault(id, set()).add(word)
+    result = []
+    for id in sorted(set(correct) | set(indexed)):
+        correctWords, indexedWords = correct.get(id), indexed.get(id)
+        if correctWords == indexedWords or (correctWords == set() and indexedWords is None):
+            continue # values without words have no rows
+        result.append((id,
+                       ' '.join(sorted(indexedWords)) if indexedWords is not None else None,
+                       ' '.join(sorted(correctWords)) if correctWords is not None else None))
+    return result
+
+
+def words(value):
+    """Return the set of words stored in the index for the varchar *value*."""
+    return set(_wordRegex.findall(utils.strings.removeDiacritics(value).lower()))
+
+
+def insert(valueType, values):
+    """Add values of type *valueType* to the index. *values* is an iterable of (value id, value)-tuples
+    of values which have just been inserted into the value table. Do nothing if the index is disabled or
+    *valueType* is not varchar."""
+    if _enabled and valueType == tags.TYPE_VARCHAR:
+        _insert(values)
+
+
+def deleteSuperfluous():
+    """Remove all rows whose value does not exist anymore. Call this after deleting values."""
+    if _enabled:
+        db.query("DELETE FROM {p}values_varchar_words "
+                 "WHERE value_id NOT IN (SELECT id FROM {p}values_varchar)")
+
+
+def matchClause(string):
+    """Return a tuple (SQL condition, argument) for the WHERE clause of a query on values_varchar, which
+    selects all values that may contain *string* as a whole word (case-insensitively). The condition
+    matches a superset of these values, so the caller must still check the exact condition. *string* must
+    not contain diacritics. Return None if the index cannot be used, e.g. because *string* does not start
+    and end with a word character."""
+    if not _enabled or _searchRegex.fullmatch(string) is None:
+        return None
+    # Use the longest word, it is usually the most selective one
+    word = max(_wordRegex.findall(string.lower()), key=len)
+    return "id IN (SELECT value_id FROM {}values_varchar_words WHERE word = ?)".format(db.prefix), word
+
+
+def _insert(values):
+    """Insert rows for the given (value id, value)-tuples."""
+    query = "INSERT INTO {p}values_varchar_words (word, value_id) VALUES (?,?)"
+    rows = []
+    for id, value in values:
+        rows.extend((word, id) for word in words(value))
+        if len(rows) >= CHUNK_SIZE:
+            db.multiQuery(query, rows)
+            rows = []
+    if len(rows) > 0:
+        db.multiQuery(query, rows)
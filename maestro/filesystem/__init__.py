@@ -17,6 +17,7 @@
 #
 
 import os, shutil, collections
+import concurrent.futures
 from PyQt5 import QtCore
 import taglib
 from maestro.core import levels, urls, tags
@@ -163,6 +164,77 @@ def parseAutoReplace():
         autoReplaceTags[oldName] = newName
 
 
+def _readRawTags(paths):
+    """Read length and tags of the files with the given paths using TagLib. Return a list of tuples
+    (path, length, tags) where length and tags are None if TagLib could not open the file. This function is
+    executed in worker processes by readTagsParallel and must therefore not rely on any state of Maestro.
+    """
+    result = []
+    for path in paths:
+        try:
+            file = taglib.File(path)
+        except OSError:
+            result.append((path, None, None))
+        else:
+            result.append((path, file.length, file.tags))
+    return result
+
+
+def readTagsParallel(urls, chunkSize=50):
+    """Read the tags of the files with the given URLs using several worker processes. This is a generator
+    yielding lists of tuples (url, tags, specialTags, length) as soon as a chunk of at most *chunkSize*
+    files has been read. Chunks are not necessarily yielded in the order of *urls*.
+    
+    Only local files are read in parallel; other URLs are read in this process. Error logging and the
+    processing of auto_delete and auto_replace is done in this process, too (see RealFile.processTags).
+    Closing the generator (e.g. when the user cancels loading) will cancel all pending chunks.
+    """
+    def makeResult(backendFile):
+        return (backendFile.url, backendFile.tags, getattr(backendFile, 'specialTags', None),
+                backendFile.length)
+    
+    localUrls = collections.OrderedDict()
+    others = []
+    for url in urls:
+        if url.scheme == RealFile.scheme:
+            localUrls[url.path] = url
+        else: others.append(url)
+    
+    processes = config.options.filesystem.tag_reader_processes
+    if processes <= 0:
+        processes = os.cpu_count() or 1
+    if processes == 1 or len(localUrls) <= chunkSize:
+        # Starting processes is not worth the effort
+        others = list(localUrls.values()) + others
+        localUrls = {}
+        
+    for i in range(0, len(others), chunkSize):
+        chunk = []
+        for url in others[i:i+chunkSize]:
+            backendFile = url.backendFile()
+            backendFile.readTags()
+            chunk.append(makeResult(backendFile))
+        yield chunk
+    
+    if len(localUrls) > 0:
+        paths = list(localUrls.keys())
+        executor = concurrent.futures.ProcessPoolExecutor(processes)
+        futures = [executor.submit(_readRawTags, paths[i:i+chunkSize])
+                   for i in range(0, len(paths), chunkSize)]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                chunk = []
+                for path, length, rawTags in future.result():
+                    backendFile = RealFile(localUrls[path])
+                    backendFile.processTags(length, rawTags)
+                    chunk.append(makeResult(backendFile))
+                yield chunk
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+
 class RealFile(urls.BackendFile):
     """A normal file that is accessed directly on the local filesystem."""
 
@@ -179,27 +251,38 @@ class RealFile(urls.BackendFile):
 
         Special tags (tracknumber, compilation, discnumber) are stored in the "specialTags" attribute.
         """
-        self.tags = tags.Storage()
-        self.specialTags = collections.OrderedDict()
         try:
             self._taglibFile = taglib.File(self.url.path)
         except OSError:
+            self.processTags(None, None)
+        else:
+            self.processTags(self._taglibFile.length, self._taglibFile.tags)
+            
+    def processTags(self, length, rawTags):
+        """Set the attributes tags, specialTags and length from the *length* and the tag dict *rawTags* as
+        read by TagLib. Both are None if TagLib failed to open the file. Tags are deleted and replaced
+        according to the config options tags.auto_delete and tags.auto_replace; in that case the file
+        is saved.
+        """
+        self.tags = tags.Storage()
+        self.specialTags = collections.OrderedDict()
+        if rawTags is None:
             if self.url.extension in config.options.main.audio_extensions:
                 logging.warning(__name__, 'TagLib failed to open "{}". Tags will be stored in database only'
                                           .format(self.url.path))
             return
-        self.length = self._taglibFile.length
+        self.length = length
         autoProcessingDone = False
-        for key, values in self._taglibFile.tags.items():
+        for key, values in rawTags.items():
             key = key.lower()
+            if key in autoReplaceTags:
+                autoProcessingDone = True
+                key = autoReplaceTags[key]
             if key in self.specialTagNames:
                 self.specialTags[key] = values
             elif key in config.options.tags.auto_delete:
                 autoProcessingDone = True
                 continue
-            elif key in autoReplaceTags:
-                autoProcessingDone = True
-                key = autoReplaceTags[key]
             elif tags.isValidTagName(key):
                 tag = tags.get(key)
                 validValues = []
@@ -214,6 +297,12 @@ class RealFile(urls.BackendFile):
             else:
                 logging.error(__name__, "Invalid tag name '{}' found : {}".format(key, self.url))
         if autoProcessingDone:
+            if self._taglibFile is None: # tags have been read by a different process
+                try:
+                    self._taglibFile = taglib.File(self.url.path)
+                except OSError:
+                    logging.error(__name__, 'TagLib failed to open "{}" for saving'.format(self.url.path))
+                    return
             self.saveTags()
 
     def rename(self, newUrl):
@@ -184,11 +184,21 @@ class LevelTreeModel(rootedtreemodel.RootedTreeModel):
         numFiles = sum(len(v) for v in files.values())
         from PyQt5 import QtWidgets
         progress = QtWidgets.QProgressDialog(self.tr("Importing {0} files...").format(numFiles),
-                                             self.tr("Cancel"), 0, numFiles)
+                                             self.tr("Cancel"), 0, 2*numFiles)
         progress.setMinimumDuration(1000)
         progress.setWindowModality(Qt.WindowModal)
         filesByFolder = collections.OrderedDict()
         elements = []
+        
+        # Read tags of new files in parallel before loading them one by one
+        def updateProgress(count):
+            progress.setValue(count)
+            return not progress.wasCanceled()
+        if not levels.real.loadNewUrls([file for filesInOneFolder in files.values()
+                                             for file in filesInOneFolder], updateProgress):
+            raise CancelledByUser()
+        progress.setValue(numFiles)
+        
         macro = self.level.stack.beginMacro(self.tr("import URLs"))
         try:
             # load files into editor level
@@ -101,12 +101,7 @@ class CreateStackDialog(QtWidgets.QDialog):
         from maestro.plugins.coverdesk.plugin import StackItem, CoverItem
         stack = StackItem(self.titleEdit.text())
         if self.allButton.isChecked():
-            toplevel = list(db.query("""
-                    SELECT id
-                    FROM {p}elements
-                    WHERE domain=? AND id NOT IN (SELECT element_id FROM {p}contents)
-                    ORDER BY id
-                    """, self.scene.domain.id).getSingleColumn())
+            toplevel = sorted(db.query(db.toplevel.subquery(self.scene.domain)).getSingleColumn())
             elements = levels.real.collect(toplevel)
             stack.items = [CoverItem(self.scene, el) for el in elements]
         elif self.searchButton.isChecked():
@@ -18,7 +18,7 @@
 
 from PyQt5 import QtCore
 
-from ... import config, database as db, utils
+from ... import config, database as db, utils, search
 from ...core import tags
 
 translate = QtCore.QCoreApplication.translate
@@ -65,6 +65,10 @@ class Check:
         """Fix the problem and delete cached data. After this method :meth:`getNumber` should return 0."""
         if self.getNumber() > 0:
             self._fix()
+            # fixes change the database without emitting events
+            search.cache.clear()
+            if search.index.get() is not None:
+                search.index.rebuild()
         self.number = None
         self.data = None
 
@@ -227,6 +231,8 @@ class SuperfluousTagValuesCheck(Check):
     def _fix(self):
         for type in tags.TYPES:
             db.query(self._query(type.name, False, True))
+        db.fulltext.deleteSuperfluous()
+        db.words.deleteSuperfluous()
 
 
 class ValueIdsCheck(Check):
@@ -387,6 +393,94 @@ class SearchValuesCheck(Check):
         if len(data):
             db.multiQuery("UPDATE {p}values_varchar SET search_value = ? WHERE id = ?", data)
 
+
+
+class ContentsClosureCheck(Check):
+    """Check whether the optional closure table of the contents hierarchy (see option
+    database.contents_closure) agrees with the contents table. Fixing this check rebuilds the closure table.
+    """
+    _name = translate("DBAnalyzerChecks", "Contents closure")
+    _columnHeaders = (translate("DBAnalyzerChecks", "Ancestor"),
+                      translate("DBAnalyzerChecks", "Descendant"),
+                      translate("DBAnalyzerChecks", "Depth in DB"),
+                      translate("DBAnalyzerChecks", "Real"))
+    
+    def check(self, data):
+        if not db.closure.enabled():
+            return [] if data else 0
+        result = db.closure.differences()
+        if data:
+            return result
+        else: return len(result)
+        
+    def _fix(self):
+        db.closure.rebuild()
+
+
+class FulltextIndexCheck(Check):
+    """Check whether the optional full-text index of tag values (see option database.fulltext_index)
+    agrees with the value tables. Fixing this check rebuilds the index.
+    """
+    _name = translate("DBAnalyzerChecks", "Full-text index")
+    _columnHeaders = (translate("DBAnalyzerChecks", "Value type"),
+                      translate("DBAnalyzerChecks", "ID"),
+                      translate("DBAnalyzerChecks", "Text in index"),
+                      translate("DBAnalyzerChecks", "Real"))
+    
+    def check(self, data):
+        if not db.fulltext.enabled():
+            return [] if data else 0
+        result = db.fulltext.differences()
+        if data:
+            return result
+        else: return len(result)
+        
+    def _fix(self):
+        db.fulltext.rebuild()
+
+
+class WordIndexCheck(Check):
+    """Check whether the optional word index of varchar values (see option database.word_index) agrees
+    with the values_varchar table. Fixing this check rebuilds the index.
+    """
+    _name = translate("DBAnalyzerChecks", "Word index")
+    _columnHeaders = (translate("DBAnalyzerChecks", "ID"),
+                      translate("DBAnalyzerChecks", "Words in index"),
+                      translate("DBAnalyzerChecks", "Real"))
+    
+    def check(self, data):
+        if not db.words.enabled():
+            return [] if data else 0
+        result = db.words.differences()
+        if data:
+            return result
+        else: return len(result)
+        
+    def _fix(self):
+        db.words.rebuild()
+
+
+
+class ToplevelCheck(Check):
+    """Check whether the optional table of toplevel elements (see option database.toplevel_index) agrees
+    with the contents table. Fixing this check rebuilds the table.
+    """
+    _name = translate("DBAnalyzerChecks", "Toplevel elements")
+    _columnHeaders = (translate("DBAnalyzerChecks", "ID"),
+                      translate("DBAnalyzerChecks", "Domain in table"),
+                      translate("DBAnalyzerChecks", "Real"))
+    
+    def check(self, data):
+        if not db.toplevel.enabled():
+            return [] if data else 0
+        result = db.toplevel.differences()
+        if data:
+            return result
+        else: return len(result)
+        
+    def _fix(self):
+        db.toplevel.rebuild()
+
         
 def getTitle(id):
     """Return a displayable title for the element with the given id."""
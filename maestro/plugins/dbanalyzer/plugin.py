@@ -273,6 +273,30 @@ class DBAnalyzer(widgets.Widget):
             (self.tr("Tracked new files"),db.query(
                     "SELECT COUNT(*) FROM {}newfiles"
                         .format(db.prefix)).getSingle()),
+            ] + self.getCacheStatistics() + self.getValueCacheStatistics()
+    
+    def getCacheStatistics(self):
+        """Gather statistics about the element cache of the real level (if it exists)."""
+        from maestro.core import levels
+        if levels.real is None:
+            return []
+        info = levels.real.cacheInfo()
+        requests = info.hits + info.misses
+        return [
+            (self.tr("Cached elements"), "{} / {}".format(info.size, info.budget)),
+            (self.tr("Cache hits"), "{} ({:.0%})".format(info.hits, info.hits / requests if requests else 0)),
+            (self.tr("Cache misses"), info.misses),
+            (self.tr("Cache evictions"), info.evictions),
+            ]
+            
+    def getValueCacheStatistics(self):
+        """Gather statistics about the cache of tag values."""
+        info = db.tags.cacheInfo()
+        requests = info.hits + info.misses
+        return [
+            (self.tr("Cached tag values"), "{} / {}".format(info.size, info.maxSize)),
+            (self.tr("Tag value cache hits"),
+                "{} ({:.0%})".format(info.hits, info.hits / requests if requests else 0)),
             ]
 
     def getTags(self):
@@ -17,14 +17,16 @@
 #
 
 """This plugin adds a central widget that allows the user to search and will display the search result
-table without any fancy grouping as the browser does (it will add titles, though)."""
+table without any fancy grouping as the browser does (it will add titles, though). Below the table it shows
+how the search was processed (see search.profiler): the time, statements and result size of each criterion.
+The profile can be exported as JSON."""
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtCore import Qt
 
 from maestro import search, config, application, database as db, utils, widgets
 from maestro.core import tags, domains
-from maestro.search import criteria
+from maestro.search import criteria, profiler
 from maestro.gui import dialogs, search as searchgui, widgets as guiwidgets
 from . import resources
 
@@ -48,10 +50,11 @@ class SearchAnalyzer(widgets.Widget):
     def __init__(self, state=None, **args):
         super().__init__(**args)
         self.criterion = None
+        self.profile = None
         self.domain = domains.domains[0]
 
         self.worker = utils.worker.Worker()
-        self.worker.done.connect(self.updateTable)
+        self.worker.done.connect(self._handleSearchFinished)
         self.worker.start()
 
         self.flagFilter = []
@@ -74,11 +77,28 @@ class SearchAnalyzer(widgets.Widget):
         self.domainBox.domainChanged.connect(self.setDomain)
         topLayout.addWidget(self.domainBox)
         
+        self.explainBox = QtWidgets.QCheckBox(self.tr("Explain queries"))
+        self.explainBox.setToolTip(self.tr("Store the query plan of each statement in the profile."))
+        self.explainBox.clicked.connect(self._handleCriterionChanged)
+        topLayout.addWidget(self.explainBox)
+        
         topLayout.addStretch(1)
+        
+        self.exportButton = QtWidgets.QPushButton(self.tr("Export profile..."))
+        self.exportButton.setEnabled(False)
+        self.exportButton.clicked.connect(self._exportProfile)
+        topLayout.addWidget(self.exportButton)
 
+        splitter = QtWidgets.QSplitter(Qt.Vertical)
+        layout.addWidget(splitter)
         self.table = QtWidgets.QTableWidget()
         self.table.horizontalHeader().hide()
-        layout.addWidget(self.table)
+        splitter.addWidget(self.table)
+        
+        self.profileTree = QtWidgets.QTreeWidget()
+        self.profileTree.setHeaderLabels([self.tr("Criterion / Statement"), self.tr("Time (ms)"),
+                                          self.tr("Rows"), self.tr("Result")])
+        splitter.addWidget(self.profileTree)
         
     def closeEvent(self, event):
         self.worker.quit()
@@ -118,6 +138,44 @@ class SearchAnalyzer(widgets.Widget):
                 self.table.setItem(i, j, item)
         self.table.resizeColumnsToContents()
         self.table.setEnabled(True)
+        
+    def updateProfile(self):
+        """Display the profile of the last search."""
+        self.profileTree.clear()
+        self.exportButton.setEnabled(self.profile is not None and self.profile.root is not None)
+        if self.profile is None or self.profile.root is None:
+            return
+        nodeItems = []
+        self.profileTree.addTopLevelItem(self._makeProfileItem(self.profile.root, nodeItems))
+        for item in nodeItems: # show all criteria, but not the query plans
+            item.setExpanded(True)
+        for column in range(1, self.profileTree.columnCount()):
+            self.profileTree.resizeColumnToContents(column)
+    
+    def _makeProfileItem(self, node, nodeItems):
+        """Create a tree item for the ProfileNode *node* with child items for its children and statements.
+        Append the items of *node* and its descendants to the list *nodeItems*."""
+        item = QtWidgets.QTreeWidgetItem([node.label, _formatTime(node.time), str(node.rows()),
+                                          str(node.resultSize) if node.resultSize is not None else ''])
+        for child in node.children:
+            item.addChild(self._makeProfileItem(child, nodeItems))
+        for statement in node.statements:
+            statementItem = QtWidgets.QTreeWidgetItem([statement.query, _formatTime(statement.time),
+                                            str(statement.rows) if statement.rows is not None else '', ''])
+            statementItem.setToolTip(0, statement.query)
+            for line in statement.plan or []:
+                statementItem.addChild(QtWidgets.QTreeWidgetItem([line]))
+            item.addChild(statementItem)
+        nodeItems.append(item)
+        return item
+    
+    def _exportProfile(self):
+        """Ask the user for a file name and save the profile as JSON."""
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, self.tr("Export profile"), 'profile.json',
+                                                        self.tr("JSON files (*.json)"))
+        if path:
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(self.profile.toJson())
 
     def _handleCriterionChanged(self):
         """Reload search criterion. If there is a search criterion, then start search. Otherwise clear the
@@ -129,10 +187,15 @@ class SearchAnalyzer(widgets.Widget):
         self.table.setEnabled(False)
         self.criterion = self.searchBox.criterion
         if self.criterion is not None:
-            task = search.SearchTask(self.criterion, self.domain)
+            # Don't use the cache, the profile should show how the search is processed
+            self.profile = profiler.Profile(explain=self.explainBox.isChecked())
+            task = search.SearchTask(self.criterion, self.domain, useCache=False, profile=self.profile)
             self.worker.submit(task)
         else:
+            self.profile = None
             self.updateTable()
+        self.profileTree.clear() # don't display the profile while the search is running
+        self.exportButton.setEnabled(False)
 
     def setFlags(self, flagTypes):
         """Set the flag filter. Only elements that have all flags in *flagTypes* will be displayed as search
@@ -140,3 +203,12 @@ class SearchAnalyzer(widgets.Widget):
         if set(flagTypes) != set(self.flagFilter):
             self.flagFilter = list(flagTypes)
             self._handleCriterionChanged()
+    
+    def _handleSearchFinished(self):
+        self.updateTable()
+        self.updateProfile()
+
+
+def _formatTime(seconds):
+    """Format a time for the profile view (in milliseconds)."""
+    return '{:.1f}'.format(seconds * 1000) if seconds is not None else ''
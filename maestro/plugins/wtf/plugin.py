@@ -196,6 +196,19 @@ class Dialog(QtWidgets.QDialog):
         dialog.exec_()
 
 
+def _loadHierarchy(ids, ancestors):
+    """Load the elements with the given ids, all their descendants and, if *ancestors* is True, all
+    ancestors of these elements into levels.real. When the closure table is available, this needs only one
+    query per direction instead of one query per level of the hierarchy."""
+    if not db.closure.enabled() or len(ids) == 0:
+        return
+    ids = set(ids)
+    ids.update(db.contents(ids, recursive=True))
+    if ancestors:
+        ids.update(db.parents(ids, recursive=True))
+    levels.real.collect(ids)
+    
+
 def buildFileTree(profile):
     if profile.criterion is not None:
         search.search(profile.criterion, profile.domain)
@@ -213,6 +226,7 @@ def buildFileTree(profile):
     exported = set()
     if profile.structure == STRUCTURE_FLAT or OPTION_DELETE in profile.options:
         exportedPaths = set()
+    _loadHierarchy(result, ancestors=OPTION_INCLUDE_WORK_TITLES in profile.options)
     toExport = levels.real.collect(result)
     while len(toExport) > 0:
         element = toExport.pop()
@@ -421,6 +435,7 @@ def export(profile):
     exported = set()
     if profile.structure == STRUCTURE_FLAT or profile.delete:
         exportedPaths = set()
+    _loadHierarchy(request.result, ancestors=False)
     toExport = levels.real.collect(request.result)
     while len(toExport) > 0:
         element = toExport.pop()
@@ -16,44 +16,114 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-from . import criteria
+import copy
+
+from . import criteria, planner, cache, index, executor, profiler
 from .. import database as db, config, utils
 from ..core import tags
 
 
-def search(searchCriterion, domain=None):
-    """Process the given search criterion. Store the results in the attribute 'result' of the criterion."""
-    SearchTask(searchCriterion, domain).processImmediately()
+def search(searchCriterion, domain=None, useCache=True, profile=None):
+    """Process the given search criterion. Store the results in the attribute 'result' of the criterion.
+    Unless *useCache* is False, results are taken from and stored in the search result cache. If *profile*
+    is a search.profiler.Profile, the processing is recorded in it."""
+    SearchTask(searchCriterion, domain, useCache, profile=profile).processImmediately()
 
 
 class SearchTask(utils.worker.Task):
-    def __init__(self, criterion, domain):
+    """Search the elements of *domain* matching *criterion* and store them in criterion.result.
+    
+    For search-as-you-type pass the task of the previous search as *previous*: If it has finished, its
+    result is still valid and *criterion* is a refinement of its criterion (e.g. "beetho" after "beeth",
+    see Criterion.isRefinementOf), only the elements in the previous result are searched.
+    
+    When the task is processed by a worker which is reset, the SQL statement running at that moment is
+    aborted (see interrupt).
+    
+    If *profile* is a search.profiler.Profile, the time, statements and result sizes of all criteria are
+    recorded in it.
+    
+    When several SharedWorkers submit SearchTasks with the same criterion and domain at the same time, the
+    search is processed only once (see utils.worker.WorkerPool).
+    """
+    def __init__(self, criterion, domain, useCache=True, previous=None, profile=None):
         self.criterion = criterion
         self.domain = domain
+        self.useCache = useCache
+        self.previous = previous
+        self.profile = profile
+        self.generation = None # generation of the search cache when the search started
+        self.finished = False
+        self._interrupter = None
         
     def process(self):
-        import time
-        start = time.perf_counter()
-        for criterion in self.criterion.getCriteriaDepthFirst():
-            if not isinstance(criterion, criteria.MultiCriterion):
-                generator = criterion.process(db.prefix+"elements", self.domain)
-                if generator is not None:
-                    yield from generator
-                else: yield
+        self.generation = cache.generation()
+        with profiler.start(self.profile, self.criterion):
+            if self.useCache and cache.get(self.criterion, self.domain):
+                if self.profile is not None:
+                    self.profile.cached = True
             else:
-                #TODO: implement MultiCriterions more efficiently
-                # If the first criterion in an AND-criterion returns only a small set,
-                # this could be used to make the second criterion faster.
-                if criterion.junction == 'AND':
-                    method = criterion.criteria[0].result.intersection
-                else: method = criterion.criteria[0].result.union
-                criterion.result = method(*[crit.result for crit in criterion.criteria[1:]])
-                if criterion.negate:
-                    if self.domain is not None:
-                        query = "SELECT id FROM {p}elements WHERE domain={}".format(self.domain.id)
-                    else: query = "SELECT id FROM {p}elements"
-                    allElements = set(db.query(query).getSingleColumn())
-                    criterion.result = allElements - criterion.result
-                yield
-        end = time.perf_counter()
-                
\ No newline at end of file
+                self._interrupter = db.Interrupter()
+                if self._canRefine():
+                    # The previous result has already been filtered by domain
+                    fromTable = db.stageIds(self.previous.criterion.result, 'search_refine')
+                    yield from self._search(fromTable, None)
+                else: yield from self._search(db.prefix+"elements", self.domain)
+                if self.useCache:
+                    cache.add(self.criterion, self.domain, self.generation)
+        self.previous = None # don't keep a chain of old results in memory
+        self._interrupter = None
+        self.finished = True
+    
+    def key(self):
+        # Profiled searches and searches without cache must really be processed. The generation of the
+        # cache changes with each relevant level change, so that searches submitted afterwards do not adopt
+        # the outdated result of a search which is still running.
+        generation = cache.generation()
+        if self.profile is not None or not self.useCache or generation is None:
+            return None
+        return 'search', generation, repr(self.criterion), self.domain.id if self.domain is not None else None
+    
+    def adopt(self, task):
+        # Like the search result cache, share results but copy matching tags (see ResultCache.get)
+        for criterion, other in zip(self.criterion.getCriteriaDepthFirst(),
+                                    task.criterion.getCriteriaDepthFirst()):
+            criterion.result = other.result
+            if 'matchingTags' in other.__dict__:
+                criterion.matchingTags = copy.copy(other.matchingTags)
+        self.generation = task.generation
+        self.previous = None
+        self.finished = task.finished
+        return self
+    
+    def interrupt(self):
+        interrupter = self._interrupter
+        if interrupter is not None:
+            interrupter.interrupt()
+        
+    def _canRefine(self):
+        """Return whether the search may be restricted to the result of the previous search."""
+        previous = self.previous
+        return previous is not None and previous.finished and previous.domain == self.domain \
+            and previous.generation is not None and previous.generation == self.generation \
+            and len(previous.criterion.result) <= planner.STAGE_LIMIT \
+            and self.criterion.isRefinementOf(previous.criterion)
+            
+    def _search(self, fromTable, domain):
+        if config.options.search.query_planner:
+            yield from planner.process(planner.makePlan(self.criterion), fromTable, domain)
+            return
+        # All leaf criteria are independent and may be processed in parallel
+        yield from executor.process([criterion for criterion in self.criterion.getCriteriaDepthFirst()
+                                     if not isinstance(criterion, criteria.MultiCriterion)],
+                                    fromTable, domain)
+        for criterion in self.criterion.getCriteriaDepthFirst():
+            if isinstance(criterion, criteria.MultiCriterion):
+                with profiler.measure(criterion):
+                    if criterion.junction == 'AND':
+                        method = criterion.criteria[0].result.intersection
+                    else: method = criterion.criteria[0].result.union
+                    criterion.result = method(*[crit.result for crit in criterion.criteria[1:]])
+                    if criterion.negate:
+                        criterion.result = planner.allIds(fromTable, domain) - criterion.result
+                    yield
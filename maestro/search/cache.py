@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# Maestro Music Manager  -  https://github.com/maestromusic/maestro
+# Copyright (C) 2009-2015 Martin Altmayer, Michael Helmling
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Process-wide cache of search results.
+
+The browser, the cover browser and similar widgets repeat the same searches whenever they are reset or
+their configuration changes. The cache stores the result of each search (and the matching tags of its
+criteria) keyed by the normalised criterion (its string representation) and the domain.
+
+An entry is removed when a LevelChangeEvent of the real level changes a tag, flag or sticker type that the
+criterion uses (see Criterion.isUsingTag etc.). All entries are removed when elements are added to or
+removed from the database and when tag types or flag types change. The cache uses at most
+search.cache_size MB; least recently used entries are discarded first.
+"""
+
+import collections
+import copy
+import threading
+
+from . import criteria
+from .idset import IdSet
+from .. import application, config
+from ..core import levels, tags, flags
+
+
+CacheInfo = collections.namedtuple('CacheInfo', 'hits misses size maxSize')
+
+class CacheEntry:
+    """A cached search result. Stores the result of *criterion*, the matching tags of its leaf criteria and
+    a copy of the criterion without results (to check whether a change affects this entry)."""
+    def __init__(self, criterion):
+        self.criterion = criterion.copy()
+        self.result = IdSet(criterion.result) # IdSets are immutable, so the result may be shared
+        self.matchingTags = [copy.copy(c.getMatchingTags()) for c in _leaves(criterion)]
+        self.size = self.result.memorySize()
+
+
+class ResultCache:
+    """Cache for search results which uses at most *maxSize* bytes (0 disables the cache). All methods may
+    be used from several threads.
+    """
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict() # key -> CacheEntry in LRU order
+        self._size = 0
+        self._hits = self._misses = 0
+        # Incremented whenever entries are invalidated. Searches which were started before cannot be sure
+        # that their result is up to date and must not be stored.
+        self.generation = 0
+
+    def get(self, criterion, domain):
+        """If the result of *criterion* in *domain* is cached, store it in criterion.result, restore the
+        matching tags of all criteria and return True. Otherwise return False.
+        """
+        with self._lock:
+            key = _key(criterion, domain)
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return False
+            self._hits += 1
+            self._entries.move_to_end(key)
+        for leaf, matchingTags in zip(_leaves(criterion), entry.matchingTags):
+            if matchingTags is not None:
+                leaf.matchingTags = copy.copy(matchingTags)
+        criterion.result = entry.result
+        return True
+
+    def add(self, criterion, domain, generation):
+        """Store the result of *criterion* (which has been processed in *domain*). Do nothing if entries have
+        been invalidated since *generation* was read from self.generation (i.e. since the search started).
+        """
+        if self.maxSize <= 0 or generation != self.generation:
+            return
+        entry = CacheEntry(criterion)
+        if entry.size > self.maxSize:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            key = _key(criterion, domain)
+            if key in self._entries:
+                self._size -= self._entries[key].size
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._size += entry.size
+            while self._size > self.maxSize:
+                _, oldEntry = self._entries.popitem(last=False)
+                self._size -= oldEntry.size
+
+    def invalidate(self, isAffected):
+        """Remove all entries for whose criterion the function *isAffected* returns True."""
+        with self._lock:
+            self.generation += 1
+            for key in [key for key, entry in self._entries.items() if isAffected(entry.criterion)]:
+                self._size -= self._entries.pop(key).size
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._size = 0
+
+    def info(self):
+        """Return a CacheInfo-tuple with the number of hits and misses, the current size and the maximum
+        size (both in bytes) of this cache."""
+        return CacheInfo(self._hits, self._misses, self._size, self.maxSize)
+
+
+_cache = None
+
+
+def init():
+    """Create the result cache and connect it to the events that invalidate it. This is called when the
+    levels have been initialized. Before, searches are not cached."""
+    global _cache
+    _cache = ResultCache(config.options.search.cache_size * 1024 * 1024)
+    levels.real.connect(_handleLevelChange)
+    application.dispatcher.connect(_handleDispatcher)
+
+
+def get(criterion, domain):
+    """Restore the cached result of *criterion* in *domain* and return True, or return False if it is not
+    cached (see ResultCache.get)."""
+    return _cache is not None and _cache.get(criterion, domain)
+
+
+def generation():
+    """Return the current generation of the cache. Read it before a search and pass it to add."""
+    return _cache.generation if _cache is not None else None
+
+
+def add(criterion, domain, generation):
+    """Store the result of *criterion* in the cache (see ResultCache.add)."""
+    if _cache is not None:
+        _cache.add(criterion, domain, generation)
+
+
+def clear():
+    """Remove all results from the cache. Call this after changing the database without emitting events,
+    e.g. after fixing errors in the database."""
+    if _cache is not None:
+        _cache.clear()
+
+
+def info():
+    """Return statistics about the cache, see ResultCache.info."""
+    return _cache.info() if _cache is not None else None
+
+
+def _handleLevelChange(event):
+    if len(event.dbAddedIds) > 0 or len(event.dbRemovedIds) > 0:
+        _cache.clear()
+    elif len(event.dataIds) > 0:
+        if event.changedTags is None or event.changedFlags is None or event.changedStickers is None:
+            _cache.clear()
+        else: _cache.invalidate(lambda criterion:
+                                    any(criterion.isUsingTag(tag) for tag in event.changedTags)
+                                    or any(criterion.isUsingFlag(flag) for flag in event.changedFlags)
+                                    or any(criterion.isUsingSticker(type) for type in event.changedStickers))
+
+
+def _handleDispatcher(event):
+    if isinstance(event, (tags.TagTypeChangeEvent, flags.FlagTypeChangeEvent)):
+        _cache.clear()
+        criteria.clearParseCache() # parsed criteria refer to tag and flag types
+
+
+def _key(criterion, domain):
+    """Return the key of *criterion* and *domain* in the cache."""
+    return repr(criterion), domain.id if domain is not None else None
+
+
+def _leaves(criterion):
+    """Return all criteria in *criterion* which are not MultiCriteria (in depth-first order)."""
+    return [c for c in criterion.getCriteriaDepthFirst() if not isinstance(c, criteria.MultiCriterion)]
@@ -16,11 +16,14 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import copy
+import functools
 import re
 import pyparsing
-from pyparsing import Optional, MatchFirst, Suppress, CharsNotIn, Word
-from pyparsing import Literal, Combine, ZeroOrMore, Group, Forward, OneOrMore
+from pyparsing import Optional, Suppress, CharsNotIn, Word
+from pyparsing import Combine, ZeroOrMore, Group, Forward, OneOrMore
 
+from .idset import IdSet
 from .. import database as db, utils
 from ..core import tags, flags
 
@@ -38,6 +41,7 @@ TAG_ABBREVIATIONS = {"t": "title",
                      }  
 
 MAX_MATCHING_TAGS = 20 # Maximum number of "matching tags" (feature is disabled if more tags match)
+PARSE_CACHE_SIZE = 500 # Number of search strings whose parsed criteria are cached (see parse)
 
 
 class ParseException(Exception):
@@ -46,12 +50,28 @@ class ParseException(Exception):
 
 
 def parse(string):
-    """Parse a string into a criterion. If the string is ill-formatted, raise a ParseException."""
-    words = parseToWords(string)
-    return parseWords(words)
+    """Parse a string into a criterion. If the string is ill-formatted, raise a ParseException.
+    
+    The criteria of the last PARSE_CACHE_SIZE search strings are cached (e.g. the browser and the cover
+    browser parse the same filter repeatedly). Each call returns a new copy (see Criterion.copy).
+    """
+    criterion = _parseCached(string.strip())
+    return criterion.copy() if criterion is not None else None
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parseCached(string):
+    """Parse *string* like parse. The result is shared by all callers and must not be modified."""
+    return parseWords(parseToWords(string))
+
+
+def clearParseCache():
+    """Remove all criteria from the cache used by parse. This must be called when tag types or flag types
+    change, because they are used to parse criteria."""
+    _parseCached.cache_clear()
     
     
-def _nestedExpr():
+def _buildGrammar():
     """Return a pyparsing.ParserElement that defines the main search string syntax."""
     ignoreExpr = pyparsing.dblQuotedString
     splitChars = '(){}|'+pyparsing.ParserElement.DEFAULT_WHITE_CHARS
@@ -65,13 +85,18 @@ def _nestedExpr():
     return Group(content)
 
 
+# Building the grammar takes as long as parsing a string with it, so it is built only once. Note that the
+# grammar must be built before any code changes pyparsing's default whitespace characters.
+_grammar = _buildGrammar()
+
+
 def parseToWords(string):
     """Split string into 'words', using nested lists to handle parentheses. Most 'words' will be parsed
     into a criterion later (e.g. 'search', '"white space"', '{flag=test}', etc.). The exceptions are the
     operators '|' and PREFIX_NEGATE.
     """
     try:
-        parsed = _nestedExpr().parseString(string, parseAll=True).asList()
+        parsed = _grammar.parseString(string, parseAll=True).asList()
     except pyparsing.ParseException as e:
         raise ParseException(str(e))
     while len(parsed) == 1 and isinstance(parsed[0], list):
@@ -113,8 +138,7 @@ def _negatingGenerator(aList):
     """Yield criteria from the items in *aList* (strings or lists). If an item is PREFIX_NEGATE, negate
     the next criterion."""
     it = iter(aList)
-    while True:
-        item = next(it) # this will eventually raise StopIteration and finish the generator
+    for item in it:
         if item == PREFIX_NEGATE:
             try:
                 item = next(it)
@@ -163,6 +187,18 @@ class Criterion:
         when stickers of this type are changed in some elements."""""
         return False
     
+    def isRefinementOf(self, other):
+        """Return whether every element matching this criterion also matches the criterion *other*, e.g.
+        because this criterion was created by typing more letters into the search box. Then the search may
+        be restricted to the result of *other*. This method may return False even if that is the case."""
+        if self == other:
+            return True
+        if isinstance(other, MultiCriterion) and not other.negate:
+            if other.junction == 'AND':
+                return all(self.isRefinementOf(criterion) for criterion in other.criteria)
+            else: return any(self.isRefinementOf(criterion) for criterion in other.criteria)
+        return False
+    
     def __and__(self, other):
         return MultiCriterion('AND', [self, other])
     
@@ -173,6 +209,21 @@ class Criterion:
         """Return all criteria contained in this one in depth-first manner."""
         yield self
         
+    def copy(self):
+        """Return a copy of this criterion without search results. Attributes which are not changed by
+        searches (e.g. tag lists) are shared with the copy."""
+        result = copy.copy(self)
+        if 'result' in result.__dict__:
+            del result.result
+        if 'matchingTags' in result.__dict__:
+            result.matchingTags = None
+        return result
+        
+    def estimate(self):
+        """Return a rough estimate of the fraction of all elements that match this criterion (a number
+        between 0 and 1). The search processes selective criteria first (see search.planner)."""
+        return _negEstimate(self, 0.5)
+        
     def process(self, fromTable, domain):
         """Process this criterion: Search all elements belonging to *domain* and whose id is in the 'id'
         column of *fromTable* (usually 'elements') and which match this criterion. Store the ids of those
@@ -223,13 +274,41 @@ class MultiCriterion(Criterion):
                 
     def __ne__(self, other):
         return not self.__eq__(other)
+
+    def isUsingTag(self, tag):
+        return any(criterion.isUsingTag(tag) for criterion in self.criteria)
     
+    def isRefinementOf(self, other):
+        if not self.negate:
+            if self.junction == 'AND' and any(c.isRefinementOf(other) for c in self.criteria):
+                return True
+            if self.junction == 'OR' and all(c.isRefinementOf(other) for c in self.criteria):
+                return True
+        return super().isRefinementOf(other)
+
+    def isUsingFlag(self, flag):
+        return any(criterion.isUsingFlag(flag) for criterion in self.criteria)
+
+    def isUsingSticker(self, stickerType):
+        return any(criterion.isUsingSticker(stickerType) for criterion in self.criteria)
+
     def getCriteriaDepthFirst(self):
         for criterion in self.criteria:
             for c in criterion.getCriteriaDepthFirst():
                 yield c
         yield self
         
+    def copy(self):
+        result = super().copy()
+        result.criteria = [criterion.copy() for criterion in self.criteria]
+        return result
+        
+    def estimate(self):
+        estimates = [criterion.estimate() for criterion in self.criteria]
+        if self.junction == 'AND':
+            return _negEstimate(self, min(estimates))
+        else: return _negEstimate(self, sum(estimates))
+        
     def getMatchingTags(self):
         if self.negate:
             return None # not implemented
@@ -269,7 +348,13 @@ class ElementTypeCriterion(Criterion):
     def __ne__(self, other):
         return not self.__eq__(other)
     
+    def estimate(self):
+        return _negEstimate(self, 0.9 if self.type == 'file' else 0.1)
+    
     def process(self, fromTable, domain):
+        from . import index
+        if index.process(self, fromTable, domain):
+            return
         value = self.type == 'file'
         if self.negate:
             value = not value
@@ -280,7 +365,7 @@ class ElementTypeCriterion(Criterion):
         query += " WHERE el.file={}".format(int(value))
         if domain is not None:
             query += " AND el.domain={}".format(domain.id)
-        self.result = set(db.query(query, table=fromTable).getSingleColumn())
+        self.result = IdSet(db.query(query, table=fromTable).getSingleColumn())
     
     @staticmethod
     def parse(string):
@@ -310,10 +395,10 @@ class IdCriterion(Criterion):
         
     def __repr__(self):
         if self.interval is not None:
-            return _negHelper('{id'+interval.toString(includeOperator=True)+'}')
+            return _negHelper(self, '{id'+self.interval.toString(includeOperator=True)+'}')
         else:
             ids = ','.join(str(id) for id in self.idList)
-            return _negHelper(self, '{id='+'ids'+'}')
+            return _negHelper(self, '{id='+ids+'}')
     
     def __eq__(self, other):
         return isinstance(other, IdCriterion) and other.interval == self.interval \
@@ -322,10 +407,17 @@ class IdCriterion(Criterion):
     def __ne__(self, other):
         return not self.__eq__(other)
     
+    def estimate(self):
+        if self.idList is not None:
+            return _negEstimate(self, 0.001)
+        elif self.interval.start is not None and self.interval.end is not None:
+            return _negEstimate(self, 0.1)
+        else: return _negEstimate(self, 0.5)
+    
     def process(self, fromTable, domain):
         if fromTable == db.prefix+"elements" or domain is None:
             query = "SELECT el.id FROM {table} AS el WHERE "
-        else: query = "SELECT el.id FROM {table} JOIN {p}elements AS el WHERE "
+        else: query = "SELECT el.id FROM {table} JOIN {p}elements AS el USING(id) WHERE "
         if domain is not None:
             query += "el.domain={} AND ".format(domain.id)
         if self.negate:
@@ -333,7 +425,7 @@ class IdCriterion(Criterion):
         if self.interval is not None:
             query += '(el.id {})'.format(self.interval.queryPart())
         else: query += 'el.id IN ({})'.format(db.csList(self.idList))
-        self.result = set(db.query(query, table=fromTable).getSingleColumn())
+        self.result = IdSet(db.query(query, table=fromTable).getSingleColumn())
     
     @staticmethod
     def parse(string):
@@ -373,15 +465,18 @@ class AnyCriterion(Criterion):
     def __ne__(self, other):
         return not self.__eq__(other)
     
-    def isUsingTag(self):
+    def isUsingTag(self, tag):
         return self.type == 'tag'
     
-    def isUsingFlag(self):
+    def isUsingFlag(self, flag):
         return self.type == 'flag'
     
-    def isUsingSticker(self):
+    def isUsingSticker(self, stickerType):
         return self.type == 'sticker'
     
+    def estimate(self):
+        return _negEstimate(self, 0.99 if self.type == 'tag' else 0.2)
+    
     def process(self, fromTable, domain):
         # fortunately there's only one common method to build a plural in English...
         joinTable = db.prefix + self.type + 's'
@@ -391,7 +486,7 @@ class AnyCriterion(Criterion):
                       "WHERE j.element_id IS NULL"
         if domain is not None:
             query += " AND el.domain={}".format(domain.id)
-        self.result = set(db.query(query, table=fromTable, join=joinTable).getSingleColumn())
+        self.result = IdSet(db.query(query, table=fromTable, join=joinTable).getSingleColumn())
     
     @staticmethod
     def parse(string):
@@ -413,15 +508,15 @@ class AnyTagCriterion(Criterion):
     def isUsingTag(self, tag):
         return tag in self.tagList
     
+    def estimate(self):
+        return _negEstimate(self, 0.5)
+    
     def __eq__(self, other):
         return type(other) is type(self) and other.tagList == self.tagList and other.negate == self.negate
     
     def __ne__(self, other):
         return not self.__eq__(other)
     
-    def __repr__(self):
-        return '{tag='+','.join(tag.name for tag in self.tagList)+'}'
-        
     def __repr__(self):
         tagNames = ','.join(tag.name for tag in self.tagList)
         return _negHelper(self, '{tag='+tagNames+'}')
@@ -434,7 +529,7 @@ class AnyTagCriterion(Criterion):
             query = "SELECT DISTINCT id FROM {table} AS el JOIN {join} WHERE {domain}"
         else: query = "SELECT id FROM {table} AS el LEFT JOIN {join}"\
                             " WHERE {domain} AND t.element_id IS NULL"
-        self.result = set(db.query(query, table=fromTable, join=joinClause, domain=domainWhereClause)
+        self.result = IdSet(db.query(query, table=fromTable, join=joinClause, domain=domainWhereClause)
                             .getSingleColumn())
 
     @staticmethod
@@ -464,11 +559,17 @@ class AbstractTagCriterion(Criterion):
     
     @classmethod
     def helpTableName(cls):
-        """Name of the temporary search table that is created in the search thread temporarily."""
-        return db.prefix + 'tmp_help'
+        """Name of the temporary search table that is created in the search thread temporarily. Threads
+        which process criteria in parallel use different names (see search.executor)."""
+        from . import executor
+        return db.prefix + 'tmp_help' + executor.helpTableSuffix()
 
     
     def process(self, fromTable, domain):
+        from . import index
+        if index.process(self, fromTable, domain):
+            return
+        
         # Prepare help table
         #===================
         if not db.engine.dialect.has_table(db.engine.connect(), self.helpTableName()):
@@ -477,7 +578,7 @@ class AbstractTagCriterion(Criterion):
             helpTable = Table(self.helpTableName(), metadata,
                 Column('value_id', Integer, nullable=False), 
                 Column('tag_id', Integer, nullable=False),     
-                Index('value_id', 'tag_id'),
+                Index(self.helpTableName()+'_idx', 'value_id', 'tag_id'),
                 prefixes=['TEMPORARY']  
             )
             helpTable.create()
@@ -507,7 +608,13 @@ class AbstractTagCriterion(Criterion):
                     continue
                 if self.binary:
                    value = self.value
-                else: value = utils.strings.removeDiacritics(self.value) 
+                else:
+                    value = utils.strings.removeDiacritics(self.value)
+                    # Restrict to candidates from the full-text index (which ignores case)
+                    match = db.fulltext.matchClause(valueType, value)
+                    if match is not None:
+                        whereClauses.append(match[0])
+                        args.append(match[1])
                 if db.type == 'mysql':
                     if not self.singleWord:
                         if self.binary:
@@ -534,12 +641,21 @@ class AbstractTagCriterion(Criterion):
                             whereClauses.append("value REGEXP ?")
                             args.append('\\b{}\\b'.format(re.escape(value)))
                         else:
+                            # Restrict to candidates containing the words of value
+                            match = db.words.matchClause(value)
+                            if match is not None:
+                                whereClauses.append(match[0])
+                                args.append(match[1])
                             whereClauses.append("COALESCE(search_value, value) REGEXP ?")
                             args.append('(?i)\\b{}\\b'.format(re.escape(value)))
                 
             elif valueType == tags.TYPE_TEXT:
                 if self.tagList is None:
                     continue # don't search for text tags unless explicitly specified
+                match = db.fulltext.matchClause(valueType, self.value)
+                if match is not None:
+                    whereClauses.append(match[0])
+                    args.append(match[1])
                 whereClauses.append("value LIKE ?")
                 args.append('%{}%'.format(self._escapeParameter(self.value)))
                 
@@ -547,7 +663,6 @@ class AbstractTagCriterion(Criterion):
                 if self.interval is None:
                     continue # can't search for dates without an interval
                 whereClauses.append("value " + self.interval.toDateSql().queryPart()) 
-            #perf = time.perf_counter()
             db.query("""
                     INSERT INTO {help} (value_id, tag_id)
                         SELECT id, tag_id
@@ -556,7 +671,6 @@ class AbstractTagCriterion(Criterion):
                     """, *args,
                     help=self.helpTableName(), table=valueType.table,
                     where=' AND '.join(whereClauses) if len(whereClauses) > 0 else '1')
-            #print("1: "+str(time.perf_counter()-perf))
             if pragmaNecessary:
                 db.query('PRAGMA case_sensitive_like = 0')
                 
@@ -572,17 +686,22 @@ class AbstractTagCriterion(Criterion):
         # Select elements which have these values (or not)
         #=================================================
         domainWhereClause = "el.domain={}".format(domain.id) if domain is not None else "1"
-        #perf = time.perf_counter()
         if not self.negate:
-            self.result = set(db.query("""
-                SELECT DISTINCT el.id
-                FROM {table} AS el
-                    JOIN {p}tags AS t ON el.id = t.element_id
-                    JOIN {help} AS h USING(tag_id, value_id)
-                    WHERE {where}
-                """, table=fromTable, help=self.helpTableName(), where=domainWhereClause).getSingleColumn())
+            if db.type == 'sqlite' and fromTable == db.prefix + 'elements':
+                # SQLite would scan all elements. Start with the matching values instead (CROSS JOIN fixes
+                # the join order in SQLite).
+                joins = """{help} AS h
+                           CROSS JOIN {p}tags AS t ON t.tag_id = h.tag_id AND t.value_id = h.value_id
+                           JOIN {table} AS el ON el.id = t.element_id"""
+            else:
+                joins = """{table} AS el
+                           JOIN {p}tags AS t ON el.id = t.element_id
+                           JOIN {help} AS h USING(tag_id, value_id)"""
+            self.result = IdSet(db.query("SELECT DISTINCT el.id FROM " + joins + " WHERE {where}",
+                                         table=fromTable, help=self.helpTableName(),
+                                         where=domainWhereClause).getSingleColumn())
         else: 
-            self.result = set(db.query("""
+            self.result = IdSet(db.query("""
                 SELECT el.id
                 FROM {table} AS el
                     JOIN {p}tags AS t ON el.id = t.element_id
@@ -591,7 +710,6 @@ class AbstractTagCriterion(Criterion):
                 GROUP BY el.id
                 HAVING COUNT(h.value_id) = 0
                 """, table=fromTable, help=self.helpTableName(), where=domainWhereClause).getSingleColumn())
-        #print("2: "+str(time.perf_counter()-perf))
     
     def _escapeParameter(self, parameter):
         """Escape parameter for use in LIKE expression."""
@@ -678,6 +796,32 @@ class TagCriterion(AbstractTagCriterion):
             return tag in self.tagList
         else: return tag.type == tags.TYPE_VARCHAR \
                         or (self.interval is not None and tag.type == tags.TYPE_DATE)
+    
+    def isRefinementOf(self, other):
+        if type(other) is type(self) and not self.negate and not other.negate \
+                and other.tagList == self.tagList and other.binary == self.binary \
+                and (self.singleWord or not other.singleWord):
+            value, otherValue = self._comparableValue(), other._comparableValue()
+            # A longer substring matches fewer values, a word matches only values containing it
+            if value == otherValue or (not other.singleWord and otherValue in value):
+                return True
+        return super().isRefinementOf(other)
+    
+    def _comparableValue(self):
+        """Return the value as it is compared to tag values. Only ASCII letters are compared
+        case-insensitively by all database backends."""
+        if self.binary:
+            return self.value
+        return ''.join(c.lower() if c.isascii() else c for c in utils.strings.removeDiacritics(self.value))
+    
+    def estimate(self):
+        # Each additional character makes a substring search more selective
+        estimate = max(0.5 ** len(self.value), 0.0001)
+        if self.singleWord:
+            estimate /= 2
+        if self.tagList is not None:
+            estimate /= 2
+        return _negEstimate(self, estimate)
             
     def __eq__(self, other):
         return type(other) is type(self) and other.value == self.value\
@@ -689,7 +833,7 @@ class TagCriterion(AbstractTagCriterion):
     
     def __repr__(self):
         if self.tagList is not None:
-            tagNames = ','.join(tag.name for name in self.tagList) + '='
+            tagNames = ','.join(tag.name for tag in self.tagList) + '='
         else: tagNames = ''
         value = _quoteIfNecessary(self.value)
         if self.singleWord:
@@ -719,7 +863,17 @@ class DateCriterion(AbstractTagCriterion):
     def isUsingTag(self, tag):
         if self.tagList is not None:
             return tag in self.tagList
-        else: return tag.type == tags.TYPE_DATE
+        else: return tag.type == tags.TYPE_DATE or (self.value is not None and tag.type == tags.TYPE_VARCHAR)
+    
+    def estimate(self):
+        if self.interval.start == self.interval.end:
+            estimate = 0.02
+        elif self.interval.start is not None and self.interval.end is not None:
+            estimate = 0.2
+        else: estimate = 0.5
+        if self.value is not None:
+            estimate += 0.5 ** len(self.value)
+        return _negEstimate(self, estimate)
             
     def __eq__(self, other):
         return type(other) is type(self) and other.interval == self.interval \
@@ -731,9 +885,9 @@ class DateCriterion(AbstractTagCriterion):
     
     def __repr__(self):
         if self.tagList is not None:
-            tagNames = '=' + ','.join(tag.name for name in self.tagList)
+            tagNames = ','.join(tag.name for tag in self.tagList)
         else: tagNames = ''
-        return _negHelper(self, '{tag'+tagNames+interval.toString(includeOperator=True)+'}')
+        return _negHelper(self, '{tag='+tagNames+self.interval.toString(includeOperator=True)+'}')
     
 
 class FlagCriterion(Criterion):
@@ -750,10 +904,18 @@ class FlagCriterion(Criterion):
     def isUsingFlag(self, flag):
         return flag in self.flags
     
+    def estimate(self):
+        if self.junction == 'AND':
+            return _negEstimate(self, 0.01)
+        else: return _negEstimate(self, 0.05 * len(self.flags))
+    
     def process(self, fromTable, domain):
+        from . import index
+        if index.process(self, fromTable, domain):
+            return
         domainClause = " AND el.domain={}".format(domain.id) if domain is not None else ''
         if self.junction == 'AND':
-            self.result = set(db.query("""
+            result = IdSet(db.query("""
                 SELECT el.id
                 FROM {table} AS el JOIN {p}flags AS fl ON el.id = fl.element_id
                 WHERE fl.flag_id IN ({flags}) {domain}
@@ -762,11 +924,15 @@ class FlagCriterion(Criterion):
                 """, table=fromTable, domain=domainClause,
                      flags=db.csIdList(self.flags), count=len(self.flags)).getSingleColumn())
         else: # use or
-            self.result = set(db.query("""
+            result = IdSet(db.query("""
                 SELECT DISTINCT el.id
                 FROM {table} AS el JOIN {p}flags AS fl ON el.id = fl.element_id
                 WHERE fl.flag_id IN ({flags}) {domain}
                 """, table=fromTable, domain=domainClause, flags=db.csIdList(self.flags)).getSingleColumn())
+        if self.negate:
+            from . import planner
+            result = planner.allIds(fromTable, domain) - result
+        self.result = result
 
     def __eq__(self, other):
         return isinstance(other, FlagCriterion) and self.flags == other.flags \
@@ -780,7 +946,7 @@ class FlagCriterion(Criterion):
             return _negHelper(self, '{flag='+flags.FLAG_SEPARATOR.join(flag.name for flag in self.flags)+'}')
         else:
             parts = ['{flag='+flag.name+'}' for flag in self.flags]
-            return _negHelper(self, '({})'+' '.join(parts))
+            return _negHelper(self, '('+' '.join(parts)+')')
     
     @staticmethod
     def parse(string):
@@ -815,6 +981,9 @@ class StickerCriterion(Criterion):
         
     def isUsingSticker(self, stickerType):
         return stickerType in self.types
+    
+    def estimate(self):
+        return _negEstimate(self, 0.05 * len(self.types))
         
     def __repr__(self):
         return _negHelper(self, '{sticker=' + ','.join(self.types) + '}')
@@ -836,7 +1005,7 @@ class StickerCriterion(Criterion):
         else: query = "SELECT id FROM {table} AS el LEFT JOIN {join} WHERE j.element_id IS NULL"
         if domain is not None:
             query += " AND el.domain={}".format(domain.id)
-        self.result = set(db.query(query, table=fromTable, join=joinClause).getSingleColumn())
+        self.result = IdSet(db.query(query, *self.types, table=fromTable, join=joinClause).getSingleColumn())
         
     @staticmethod
     def parse(string):
@@ -868,14 +1037,17 @@ class TagIdCriterion(Criterion):
         whereClause = " OR ".join("(t.tag_id = {} AND t.value_id = {})".format(*p) for p in self.tagPairs)
         if domain is not None:
             whereClause = "el.domain={} AND ({})".format(domain.id, whereClause)
-        self.result = set(db.query("""
+        self.result = IdSet(db.query("""
             SELECT DISTINCT el.id
             FROM {table} AS el JOIN {p}tags AS t ON el.id = t.element_id
             WHERE {where}
             """, table=fromTable, where=whereClause).getSingleColumn())
 
     def isUsingTag(self, tag):
-        return tag in self.valueIds
+        return any(tagId == tag.id for tagId, _ in self.tagPairs)
+    
+    def estimate(self):
+        return _negEstimate(self, 0.001 * len(self.tagPairs))
 
     def __eq__(self,other):
         return isinstance(other, TagIdCriterion) and other.tagPairs == self.tagPairs
@@ -884,7 +1056,7 @@ class TagIdCriterion(Criterion):
         return not self.__eq__(other)
 
     def __repr__(self):
-        return "<TagIdCriterion {}>".format(self.tagPairs)
+        return "<TagIdCriterion {}>".format(sorted(self.tagPairs))
     
         
 def _findOperator(string):
@@ -930,10 +1102,6 @@ class Interval:
     """An interval defined by a start integer and an end integer. One of them may be None, indicating that
     the interval stretches to infinity in this direction.
     """
-    DATE_CRITERION = Word(pyparsing.nums)
-    CRITERION1 = Optional(MatchFirst([Literal(s) for s in ['>=', '<=', '=', '>', '<']])) + DATE_CRITERION
-    CRITERION2 = DATE_CRITERION + Suppress('-') + DATE_CRITERION
-    
     def __init__(self, start, end):
         assert start is not None or end is not None
         self.start = start
@@ -952,13 +1120,9 @@ class Interval:
         will be considered.
         """
         string = string.strip()
-        if digits is not None:
-            number = Word(pyparsing.nums, exact=digits)
-        else: number = Word(pyparsing.nums)
+        number, parser = _intervalParsers(digits)
         try:
             if operator not in ('<=', '>=', '>', '<'):
-                # the ^ means xor. | does not work together with parseAll=True (bug in pyparsing?)
-                parser = number ^ (number + Suppress('-') + number)
                 result = parser.parseString(string, parseAll=True).asList()
                 result = [int(r) for r in result]
                 if len(result) == 1:
@@ -1020,6 +1184,18 @@ class Interval:
         return not self.__eq__(other)
 
 
+@functools.lru_cache(maxsize=None)
+def _intervalParsers(digits):
+    """Return two pyparsing.ParserElements for Interval.parse: One parses a number (having exactly *digits*
+    digits unless it is None), the other a number or a range like '1800-1900'. They are built only once for
+    each value of *digits*."""
+    if digits is not None:
+        number = Word(pyparsing.nums, exact=digits)
+    else: number = Word(pyparsing.nums)
+    # the ^ means xor. | does not work together with parseAll=True (bug in pyparsing?)
+    return number, number ^ (number + Suppress('-') + number)
+
+
 def _splitPrefixes(string):
     """Look whether any of the prefixes in *allowed* appear at the beginning of *string*. Return a tuple
     consisting of the prefixes as string (or the empty string) and the rest of the string. Multiple prefixes
@@ -1114,3 +1290,12 @@ def _negHelper(criterion, string):
     if criterion.negate:
         return PREFIX_NEGATE + string
     else: return string
+
+
+def _negEstimate(criterion, estimate):
+    """Helper function for the estimate functions of all criteria: Bound *estimate* by 1 and return the
+    estimate of the opposite set if *criterion* is negated."""
+    estimate = min(estimate, 1)
+    if criterion.negate:
+        return 1 - estimate
+    else: return estimate
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# Maestro Music Manager  -  https://github.com/maestromusic/maestro
+# Copyright (C) 2009-2015 Martin Altmayer, Michael Helmling
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Parallel processing of independent criteria.
+
+Sibling leaf criteria do not depend on each other if they search the same table, e.g. the parts of an
+OR-criterion, the remaining parts of an AND-criterion whose result is too large for staging (see
+search.planner) and all leaf criteria if the query planner is disabled. If the option search.parallelism
+is larger than 1, they are processed at the same time by a pool of that many threads. Each thread uses its
+own database connection (database connections are per thread) and its own help table (see
+AbstractTagCriterion.helpTableName). Python's database drivers release the GIL while a statement is
+executed, so this pays off with MySQL and with SQLite, which allows concurrent readers.
+
+Temporary tables belong to a single connection, so only searches in the elements table can be processed in
+parallel. SQLite in-memory databases (used by tests) are private to a connection, too; with them criteria
+are always processed one after another. Criteria which are processed by the search index (see
+search.index) run in the calling thread.
+"""
+
+import concurrent.futures
+import itertools
+import threading
+
+from . import index, profiler
+from .. import config, database as db
+
+
+# Interval in seconds in which process yields while it waits for the pool. This allows the worker which
+# executes the search to abort it.
+WAIT_INTERVAL = 0.05
+
+_executor = None
+_executorSize = None
+_lock = threading.Lock()
+_local = threading.local() # threads of the pool store the suffix of their help table name here
+_threadNumbers = itertools.count(1)
+
+
+def parallelism():
+    """Return the number of criteria which may be processed at the same time (1 if the database does not
+    allow parallel processing)."""
+    if db.type == 'sqlite' and config.options.database.sqlite_path.strip() == ':memory:':
+        return 1
+    return max(1, config.options.search.parallelism)
+
+
+def canProcess(criteria, fromTable):
+    """Return whether process would use the thread pool to process the list of leaf *criteria* in
+    *fromTable*."""
+    return parallelism() > 1 and fromTable == db.prefix + 'elements' \
+        and sum(1 for criterion in criteria if not index.canProcess(criterion)) >= 2
+
+
+def helpTableSuffix():
+    """Return a suffix which makes the names of help tables unique for the current thread."""
+    return getattr(_local, 'helpTableSuffix', '')
+
+
+def process(criteria, fromTable, domain):
+    """Process the given independent leaf criteria (no MultiCriteria) like Criterion.process, i.e. store the
+    elements in *fromTable* and *domain* matching each criterion in its 'result' attribute. Use the thread
+    pool if possible (see canProcess), otherwise process the criteria one after another. This is a
+    generator which yields between steps. If it is closed before it is finished, running statements are
+    aborted.
+    """
+    if not canProcess(criteria, fromTable):
+        for criterion in criteria:
+            yield from processCriterion(criterion, fromTable, domain)
+        return
+
+    jobs = [_Job(criterion, fromTable, domain) for criterion in criteria if not index.canProcess(criterion)]
+    pool = _getExecutor()
+    futures = [pool.submit(job.run) for job in jobs]
+    try:
+        for criterion in criteria:
+            if index.canProcess(criterion):
+                yield from processCriterion(criterion, fromTable, domain)
+        pending = futures
+        while len(pending) > 0:
+            done, pending = concurrent.futures.wait(pending, timeout=WAIT_INTERVAL,
+                                                    return_when=concurrent.futures.FIRST_EXCEPTION)
+            for future in done:
+                future.result() # raise exceptions of the job
+            yield
+    finally:
+        for job, future in zip(jobs, futures):
+            if not future.done():
+                job.cancel()
+
+
+def processCriterion(criterion, fromTable, domain):
+    """Process a single leaf criterion in the current thread (like Criterion.process, but always a
+    generator). If a profiled search is processed, record it in the profile (see search.profiler)."""
+    with profiler.measure(criterion):
+        generator = criterion.process(fromTable, domain)
+        if generator is not None:
+            yield from generator
+        else: yield
+
+
+def _getExecutor():
+    """Return the thread pool, creating it if necessary."""
+    global _executor, _executorSize
+    with _lock:
+        size = parallelism()
+        if _executor is None or _executorSize != size:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = concurrent.futures.ThreadPoolExecutor(size, thread_name_prefix='search')
+            _executorSize = size
+        return _executor
+
+
+class _Job:
+    """Processes a criterion in a thread of the pool."""
+    def __init__(self, criterion, fromTable, domain):
+        self.criterion = criterion
+        self.fromTable = fromTable
+        self.domain = domain
+        self.cancelled = False
+        self._interrupter = None
+        self._profileState = profiler.current() # record the criterion in the profile of the search
+
+    def run(self):
+        if not hasattr(_local, 'helpTableSuffix'):
+            _local.helpTableSuffix = '_{}'.format(next(_threadNumbers))
+        if self.cancelled:
+            return
+        self._interrupter = db.Interrupter()
+        try:
+            with profiler.resume(self._profileState):
+                for _ in processCriterion(self.criterion, self.fromTable, self.domain):
+                    if self.cancelled:
+                        return
+        except db.DBException:
+            if not self.cancelled: # an interrupted statement raises an exception
+                raise
+        finally:
+            self._interrupter = None
+
+    def cancel(self):
+        """Abort this job as soon as possible (from another thread)."""
+        self.cancelled = True
+        interrupter = self._interrupter
+        if interrupter is not None:
+            interrupter.interrupt()
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+# Maestro Music Manager  -  https://github.com/maestromusic/maestro
+# Copyright (C) 2009-2015 Martin Altmayer, Michael Helmling
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Compact set type for search results.
+
+A Python set needs about 60 bytes per element id. An IdSet uses one of two representations, whichever is
+smaller for its ids: Sparse sets store their ids in a sorted array with 4 bytes per id, dense sets store a
+bitmap with one bit per possible id (bit *i* is set if id *i* is contained). Thus a set never needs more
+than 4 bytes per id and a small set containing a large id does not need a large bitmap.
+
+Operations with a sparse operand take time proportional to the size of the sparse operand (e.g. an
+intersection checks the ids of the sparse set in the other set). Only operations on dense sets process the
+bitmaps: They convert them to integers and use the bitwise operators, which runs in C instead of looping
+over ids in Python. Counting and iterating the ids of a dense set use the binary representation of such an
+integer.
+"""
+
+import array
+import bisect
+import collections.abc
+import itertools
+import sys
+
+
+# A set whose number of ids multiplied by this factor exceeds its largest id is stored as bitmap. This is
+# the ratio of the size of an id in the array (4 bytes) to the size of an id in the bitmap (1 bit).
+DENSE_FACTOR = 32
+
+# Translate the digits of a binary string to bytes 0/1 and back (see _iterBits and IdSet.fromMap)
+_DIGITS_TO_BYTES = bytes.maketrans(b'01', b'\0\1')
+_BYTES_TO_DIGITS = bytes.maketrans(b'\0\1', b'01')
+
+
+class IdSet(collections.abc.Set):
+    """Immutable set of non-negative integers (element ids). It can be used like a frozenset, in particular
+    with the operators &, |, - and ^ and the methods intersection, union and difference. Other iterables of
+    ids are accepted as operands.
+    """
+    # Exactly one of _ids (sorted array of ids) and _bits (little-endian bitmap without trailing zero
+    # bytes) is not None. The representation only depends on the ids (see _fromSorted), so equal sets
+    # have equal representations.
+    __slots__ = ('_ids', '_bits', '_length')
+
+    def __init__(self, ids=()):
+        if isinstance(ids, IdSet):
+            self._ids, self._bits, self._length = ids._ids, ids._bits, ids._length
+        else: self._init(sorted(set(ids)))
+
+    def _init(self, ids):
+        """Store the given sorted list of distinct ids in the appropriate representation."""
+        self._length = len(ids)
+        if len(ids) > 0 and len(ids) * DENSE_FACTOR > ids[-1]:
+            bits = bytearray(ids[-1] // 8 + 1)
+            for id in ids:
+                bits[id >> 3] |= 1 << (id & 7)
+            self._ids, self._bits = None, bytes(bits)
+        else: self._ids, self._bits = array.array('I', ids), None
+
+    @classmethod
+    def _fromSorted(cls, ids):
+        """Create an IdSet from a sorted list of distinct ids."""
+        result = cls.__new__(cls)
+        result._init(ids)
+        return result
+
+    @classmethod
+    def _fromInt(cls, number):
+        """Create an IdSet from a non-negative integer whose bit *i* is set if id *i* is contained."""
+        result = cls.__new__(cls)
+        result._length = _bitCount(number)
+        if result._length > 0 and result._length * DENSE_FACTOR > number.bit_length() - 1:
+            result._ids, result._bits = None, number.to_bytes((number.bit_length() + 7) // 8, 'little')
+        else: result._ids, result._bits = array.array('I', _iterBits(number)), None
+        return result
+
+    @classmethod
+    def fromMap(cls, map):
+        """Create an IdSet from a bytes-like *map* that contains 1 at the positions of all ids and 0
+        elsewhere."""
+        digits = bytes(map).translate(_BYTES_TO_DIGITS)[::-1]
+        return cls._fromInt(int(digits, 2) if len(digits) > 0 else 0)
+
+    def _toInt(self):
+        """Return a non-negative integer whose bit *i* is set if id *i* is contained."""
+        if self._bits is not None:
+            return int.from_bytes(self._bits, 'little')
+        elif len(self._ids) == 0:
+            return 0
+        bits = bytearray(self._ids[-1] // 8 + 1)
+        for id in self._ids:
+            bits[id >> 3] |= 1 << (id & 7)
+        return int.from_bytes(bits, 'little')
+
+    def __len__(self):
+        return self._length
+
+    def __contains__(self, id):
+        if not isinstance(id, int) or id < 0:
+            return False
+        if self._bits is not None:
+            return id >> 3 < len(self._bits) and self._bits[id >> 3] & (1 << (id & 7)) != 0
+        i = bisect.bisect_left(self._ids, id)
+        return i < len(self._ids) and self._ids[i] == id
+
+    def __iter__(self):
+        if self._bits is not None:
+            return _iterBits(int.from_bytes(self._bits, 'little'))
+        else: return iter(self._ids)
+
+    def __eq__(self, other):
+        if isinstance(other, IdSet):
+            return self._ids == other._ids and self._bits == other._bits
+        return super().__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'IdSet({{{}}})'.format(', '.join(str(id) for id in self))
+
+    def __and__(self, other):
+        other = _toIdSet(other)
+        if self._ids is not None or other._ids is not None:
+            sparse, other = (self, other) if self._ids is not None else (other, self)
+            if other._ids is not None:
+                return IdSet._fromSorted(sorted(set(sparse._ids).intersection(other._ids)))
+            return IdSet._fromSorted([id for id in sparse._ids if id in other])
+        return IdSet._fromInt(self._toInt() & other._toInt())
+
+    def __or__(self, other):
+        other = _toIdSet(other)
+        if self._ids is not None and other._ids is not None:
+            return IdSet._fromSorted(sorted(set(self._ids).union(other._ids)))
+        return IdSet._fromInt(self._toInt() | other._toInt())
+
+    def __sub__(self, other):
+        other = _toIdSet(other)
+        if self._ids is not None:
+            if other._ids is not None:
+                return IdSet._fromSorted(sorted(set(self._ids).difference(other._ids)))
+            return IdSet._fromSorted([id for id in self._ids if id not in other])
+        elif other._ids is not None:
+            bits = bytearray(self._bits)
+            for id in other._ids:
+                if id >> 3 < len(bits):
+                    bits[id >> 3] &= ~(1 << (id & 7))
+            return IdSet._fromInt(int.from_bytes(bits, 'little'))
+        else:
+            a = self._toInt()
+            return IdSet._fromInt(a ^ (a & other._toInt()))
+
+    def __xor__(self, other):
+        other = _toIdSet(other)
+        if self._ids is not None and other._ids is not None:
+            return IdSet._fromSorted(sorted(set(self._ids).symmetric_difference(other._ids)))
+        return IdSet._fromInt(self._toInt() ^ other._toInt())
+
+    __rand__ = __and__
+    __ror__ = __or__
+    __rxor__ = __xor__
+
+    def __rsub__(self, other):
+        return _toIdSet(other) - self
+
+    def intersection(self, *others):
+        result = self
+        for other in others:
+            result = result & other
+        return result
+
+    def union(self, *others):
+        result = self
+        for other in others:
+            result = result | other
+        return result
+
+    def difference(self, *others):
+        result = self
+        for other in others:
+            result = result - other
+        return result
+
+    def issubset(self, other):
+        return len(self - other) == 0
+
+    def issuperset(self, other):
+        return len(_toIdSet(other) - self) == 0
+
+    def memorySize(self):
+        """Return the approximate number of bytes used by this set."""
+        return sys.getsizeof(self._bits if self._bits is not None else self._ids)
+
+    def copy(self):
+        return self # IdSets are immutable
+
+
+def _toIdSet(ids):
+    """Return *ids* as IdSet."""
+    return ids if isinstance(ids, IdSet) else IdSet(ids)
+
+
+def _bitCount(number):
+    """Return the number of set bits of the non-negative integer *number*."""
+    return bin(number).count('1')
+
+
+def _iterBits(number):
+    """Return an iterator over the positions of the set bits of the non-negative integer *number* in
+    ascending order."""
+    if number == 0:
+        return iter(())
+    digits = bin(number)[:1:-1] # least significant bit first, without '0b'
+    return itertools.compress(range(len(digits)), digits.encode('ascii').translate(_DIGITS_TO_BYTES))
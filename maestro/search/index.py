@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+# Maestro Music Manager  -  https://github.com/maestromusic/maestro
+# Copyright (C) 2009-2015 Martin Altmayer, Michael Helmling
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Optional in-memory index which answers common criteria without querying the database.
+
+The default search backend stores matching tag values in a temporary table and joins it with the tags
+table (see AbstractTagCriterion.process). If the option search.index is set, a SearchIndex is built in a
+background thread at startup. It contains
+    - the type and domain of each element (compact arrays indexed by element id),
+    - all varchar and date values, an index of the trigrams of the normalised varchar values and for each
+      value the ids of the elements having it (posting lists stored as integer arrays),
+    - the ids of the elements having each flag.
+It is kept up to date using the LevelChangeEvents of the real level. TagCriterion, DateCriterion,
+FlagCriterion and ElementTypeCriterion use the index when it is ready (see process); all other criteria and
+criteria on text tags are still processed in the database.
+"""
+
+import array
+import bisect
+import collections
+import itertools
+import re
+import threading
+
+from . import criteria
+from .idset import IdSet
+from .. import application, config, database as db, logging, utils
+from ..core import levels, tags, flags
+
+
+# Element kinds stored in SearchIndex._kinds. 0 means that the element does not exist.
+CONTAINER = 1
+FILE = 2
+
+# Tables for bytes.translate that map the kinds to 1 (selected) or 0
+_SELECT_CONTAINERS = bytes(1 if i == CONTAINER else 0 for i in range(256))
+_SELECT_FILES = bytes(1 if i == FILE else 0 for i in range(256))
+_SELECT_ALL = bytes(1 if i in (CONTAINER, FILE) else 0 for i in range(256))
+
+NGRAM_LENGTH = 3
+
+
+class SearchIndex:
+    """In-memory index of the elements, tag values and flags in the database. The index is filled by build
+    and can be used when *ready* is True. All methods may be used from several threads.
+
+    Values are referred to by their position in the value lists ("value index").
+    """
+    def __init__(self):
+        self.ready = False
+        self._lock = threading.RLock()
+        self._pending = set() # ids of elements that changed while the index was built
+        # Maps with one byte per element id, converted to IdSets by IdSet.fromMap
+        self._kinds = bytearray()
+        self._domains = array.array('H')
+        self._domainMaps = {} # domain id -> map of the elements in the domain
+        self._tagged = bytearray() # map of the elements with at least one tag
+        self._valueIndexes = {} # (tag id, value id) -> value index
+        self._valueKeys = [] # value index -> (tag id, value id)
+        self._values = [] # value index -> value (None for text tags)
+        self._searchValues = [] # value index -> normalised value (varchar tags only)
+        self._postings = [] # value index -> sorted array of element ids
+        self._tagValues = collections.defaultdict(list) # tag id -> list of value indexes
+        self._ngrams = collections.defaultdict(lambda: array.array('I')) # ngram -> array of value indexes
+        self._elementValues = {} # element id -> tuple of value indexes
+        # flag id -> sorted array of element ids
+        self._flags = collections.defaultdict(lambda: array.array('I'))
+        self._elementFlags = {} # element id -> tuple of flag ids (only elements with flags)
+
+    def build(self):
+        """Load the whole index from the database. Afterwards process changes that were reported with
+        update in the meantime and set self.ready."""
+        # The index is not used before it is ready, so the lock is only needed to synchronize the
+        # pending changes.
+        for id, domainId, file in db.query("SELECT id, domain, file FROM {p}elements"):
+            self._setElement(id, domainId, file)
+        for valueType in (tags.TYPE_VARCHAR, tags.TYPE_DATE):
+            for row in self._loadValues(valueType):
+                self._addValue(*row)
+        tagRows = db.query("SELECT element_id, tag_id, value_id FROM {p}tags ORDER BY element_id")
+        for elementId, rows in itertools.groupby(tagRows, key=lambda row: row[0]):
+            self._setElementValues(elementId, [(tagId, valueId) for _, tagId, valueId in rows])
+        elementFlags = collections.defaultdict(list)
+        for elementId, flagId in db.query("SELECT element_id, flag_id FROM {p}flags ORDER BY element_id"):
+            elementFlags[elementId].append(flagId)
+        for elementId, flagIds in elementFlags.items():
+            self._setElementFlags(elementId, flagIds)
+        while True:
+            with self._lock:
+                ids, self._pending = self._pending, set()
+                if len(ids) == 0:
+                    self.ready = True
+                    return
+            self._update(ids)
+
+    def update(self, elementIds):
+        """Reload type, domain, tags and flags of the given elements from the database. Elements which have
+        been removed from the database are removed from the index. If the index is not ready yet, the
+        elements are updated when it has been built."""
+        with self._lock:
+            if not self.ready:
+                self._pending.update(elementIds)
+                return
+        self._update(elementIds)
+
+    def _update(self, elementIds):
+        elementIds = set(elementIds)
+        with db.idSubquery(elementIds, 'index_ids') as ids:
+            elementRows = list(db.query("SELECT id, domain, file FROM {p}elements WHERE id IN ({ids})",
+                                        ids=ids))
+            tagRows = list(db.query("SELECT element_id, tag_id, value_id FROM {p}tags "
+                                    "WHERE element_id IN ({ids})", ids=ids))
+            flagRows = list(db.query("SELECT element_id, flag_id FROM {p}flags WHERE element_id IN ({ids})",
+                                     ids=ids))
+        with self._lock:
+            missing = set((tagId, valueId) for _, tagId, valueId in tagRows
+                          if (tagId, valueId) not in self._valueIndexes)
+        valueRows = []
+        for valueType in (tags.TYPE_VARCHAR, tags.TYPE_DATE):
+            valueIds = set(valueId for tagId, valueId in missing
+                           if tags.get(tagId).type == valueType)
+            if len(valueIds) > 0:
+                valueRows.extend(self._loadValues(valueType, valueIds))
+
+        with self._lock:
+            for row in valueRows:
+                self._addValue(*row)
+            for id in elementIds:
+                self._setElement(id, 0, None)
+                self._setElementValues(id, ())
+                self._setElementFlags(id, ())
+            for id, domainId, file in elementRows:
+                self._setElement(id, domainId, file)
+            elementValues = collections.defaultdict(list)
+            for elementId, tagId, valueId in tagRows:
+                elementValues[elementId].append((tagId, valueId))
+            for elementId, pairs in elementValues.items():
+                self._setElementValues(elementId, pairs)
+            elementFlags = collections.defaultdict(list)
+            for elementId, flagId in flagRows:
+                elementFlags[elementId].append(flagId)
+            for elementId, flagIds in elementFlags.items():
+                self._setElementFlags(elementId, flagIds)
+
+    def _loadValues(self, valueType, valueIds=None):
+        """Return a list of (tag id, value id, value, search value)-tuples for values of the given type. If
+        *valueIds* is given, return only these values."""
+        if valueType == tags.TYPE_VARCHAR:
+            columns = 'tag_id, id, value, COALESCE(search_value, value)'
+        else: columns = 'tag_id, id, value, NULL'
+        if valueIds is None:
+            return list(db.query("SELECT {} FROM {}".format(columns, valueType.table)))
+        with db.idSubquery(valueIds, 'index_values') as ids:
+            return list(db.query("SELECT {} FROM {} WHERE id IN ({})".format(columns, valueType.table, ids)))
+
+    def _addValue(self, tagId, valueId, value, searchValue=None):
+        """Add a value to the index (if it is not contained yet) and return its value index. Values of
+        text tags are not stored (*value* is None)."""
+        key = (tagId, valueId)
+        if key in self._valueIndexes:
+            return self._valueIndexes[key]
+        index = len(self._valueKeys)
+        self._valueIndexes[key] = index
+        self._valueKeys.append(key)
+        self._values.append(value)
+        self._postings.append(array.array('I'))
+        self._tagValues[tagId].append(index)
+        if searchValue is not None:
+            searchValue = searchValue.lower()
+            for ngram in set(_ngrams(searchValue)):
+                self._ngrams[ngram].append(index)
+        self._searchValues.append(searchValue)
+        return index
+
+    def _reserve(self, id):
+        """Make sure that the element maps can store *id*."""
+        if id >= len(self._kinds):
+            extension = bytes(max(id + 1, 2 * len(self._kinds)) - len(self._kinds))
+            for map in itertools.chain((self._kinds, self._tagged), self._domainMaps.values()):
+                map.extend(extension)
+            self._domains.extend(itertools.repeat(0, len(extension)))
+
+    def _setElement(self, id, domainId, file):
+        """Store the domain and kind of an element (the element is removed if *file* is None)."""
+        self._reserve(id)
+        if self._domains[id] != 0:
+            self._domainMaps[self._domains[id]][id] = 0
+        if file is None:
+            self._kinds[id] = 0
+            self._domains[id] = 0
+        else:
+            self._kinds[id] = FILE if file else CONTAINER
+            self._domains[id] = domainId
+            if domainId not in self._domainMaps:
+                self._domainMaps[domainId] = bytearray(len(self._kinds))
+            self._domainMaps[domainId][id] = 1
+
+    def _setElementValues(self, elementId, pairs):
+        """Set the (tag id, value id)-pairs of an element."""
+        self._reserve(elementId)
+        for index in self._elementValues.pop(elementId, ()):
+            _remove(self._postings[index], elementId)
+        self._tagged[elementId] = 0
+        if len(pairs) > 0:
+            indexes = tuple(self._addValue(tagId, valueId, None) for tagId, valueId in pairs)
+            for index in indexes:
+                _insert(self._postings[index], elementId)
+            self._elementValues[elementId] = indexes
+            self._tagged[elementId] = 1
+
+    def _setElementFlags(self, elementId, flagIds):
+        """Set the flags (given by their ids) of an element."""
+        for flagId in self._elementFlags.pop(elementId, ()):
+            _remove(self._flags[flagId], elementId)
+        if len(flagIds) > 0:
+            for flagId in flagIds:
+                _insert(self._flags[flagId], elementId)
+            self._elementFlags[elementId] = tuple(flagIds)
+
+    def canProcess(self, criterion):
+        """Return whether *criterion* can be processed using this index."""
+        if isinstance(criterion, (criteria.ElementTypeCriterion, criteria.FlagCriterion)):
+            return True
+        if isinstance(criterion, (criteria.TagCriterion, criteria.DateCriterion)):
+            # Values of text tags are not stored in the index
+            return criterion.tagList is None or all(tag.type != tags.TYPE_TEXT for tag in criterion.tagList)
+        return False
+
+    def process(self, criterion, domain):
+        """Process *criterion* (canProcess must return True for it) on all elements of *domain* (unless it
+        is None) and store the result (and matching tags) in the criterion."""
+        with self._lock:
+            if isinstance(criterion, criteria.ElementTypeCriterion):
+                result = self._ofKind(criterion.type == 'file', domain)
+                if criterion.negate:
+                    result = self.allIds(domain) - result
+            elif isinstance(criterion, criteria.FlagCriterion):
+                postings = [self._flags.get(flag.id, ()) for flag in criterion.flags]
+                if criterion.junction == 'AND':
+                    result = IdSet(postings[0]).intersection(*postings[1:])
+                else: result = IdSet(itertools.chain.from_iterable(postings))
+                result = self._filterDomain(result, domain)
+                if criterion.negate:
+                    result = self.allIds(domain) - result
+            else:
+                indexes = self._matchingValues(criterion)
+                if len(indexes) <= criteria.MAX_MATCHING_TAGS:
+                    criterion.matchingTags = set(self._valueKeys[index] for index in indexes)
+                result = IdSet(itertools.chain.from_iterable(self._postings[index] for index in indexes))
+                if criterion.negate:
+                    # Like the database search: only elements with at least one tag
+                    result = IdSet.fromMap(self._tagged) - result
+                result = self._filterDomain(result, domain)
+            criterion.result = result
+
+    def allIds(self, domain):
+        """Return the ids of all elements in *domain* (or of all elements if *domain* is None)."""
+        with self._lock:
+            return self._filterDomain(self._select(_SELECT_ALL), domain)
+
+    def _ofKind(self, file, domain):
+        """Return the ids of all files (*file* is True) or containers in *domain*."""
+        return self._filterDomain(self._select(_SELECT_FILES if file else _SELECT_CONTAINERS), domain)
+
+    def _select(self, table):
+        """Return the ids of elements whose kind is mapped to 1 by the translation table *table*."""
+        return IdSet.fromMap(self._kinds.translate(table))
+
+    def _filterDomain(self, ids, domain):
+        if domain is None:
+            return ids
+        return ids & IdSet.fromMap(self._domainMaps.get(domain.id, b''))
+
+    def _matchingValues(self, criterion):
+        """Return the value indexes of all values matching the TagCriterion or DateCriterion *criterion*."""
+        if criterion.tagList is not None:
+            tagList = criterion.tagList
+        else: tagList = [tag for tag in tags.tagList if tag.type in (tags.TYPE_VARCHAR, tags.TYPE_DATE)]
+        result = []
+
+        varcharIds = set(tag.id for tag in tagList if tag.type == tags.TYPE_VARCHAR)
+        if criterion.value is not None and len(varcharIds) > 0:
+            if criterion.binary:
+                needle, values = criterion.value, self._values
+            else: needle, values = utils.strings.removeDiacritics(criterion.value).lower(), self._searchValues
+            if criterion.singleWord:
+                match = re.compile(r'\b{}\b'.format(re.escape(needle))).search
+            else: match = lambda value: needle in value
+            candidates = self._candidates(utils.strings.removeDiacritics(criterion.value).lower())
+            if candidates is None:
+                candidates = itertools.chain.from_iterable(self._tagValues[id] for id in varcharIds)
+            valueKeys = self._valueKeys
+            result.extend(index for index in candidates
+                          if valueKeys[index][0] in varcharIds and values[index] is not None
+                          and match(values[index]))
+
+        if criterion.interval is not None:
+            interval = criterion.interval.toDateSql()
+            for tag in tagList:
+                if tag.type == tags.TYPE_DATE:
+                    result.extend(index for index in self._tagValues[tag.id]
+                                  if (interval.start is None or self._values[index] >= interval.start)
+                                  and (interval.end is None or self._values[index] <= interval.end))
+        return result
+
+    def _candidates(self, searchValue):
+        """Return the value indexes of varchar values which may contain *searchValue* (a normalised
+        string) according to the ngram index. Return None if the string is too short to use the index.
+        """
+        ngrams = set(_ngrams(searchValue))
+        if len(ngrams) == 0:
+            return None
+        postings = sorted((self._ngrams.get(ngram, ()) for ngram in ngrams), key=len)
+        result = set(postings[0])
+        for posting in postings[1:]:
+            if len(result) < 100:
+                break # checking the remaining candidates is cheaper than intersecting
+            result.intersection_update(posting)
+        return result
+
+
+def _ngrams(string):
+    """Return the ngrams of *string*."""
+    return (string[i:i+NGRAM_LENGTH] for i in range(len(string) - NGRAM_LENGTH + 1))
+
+
+def _insert(ids, id):
+    """Insert *id* into the sorted array *ids*. While the index is built, ids arrive in ascending order and
+    are simply appended."""
+    if len(ids) == 0 or ids[-1] < id:
+        ids.append(id)
+    else: ids.insert(bisect.bisect_left(ids, id), id)
+
+
+def _remove(ids, id):
+    """Remove *id* from the sorted array *ids*."""
+    i = bisect.bisect_left(ids, id)
+    if i < len(ids) and ids[i] == id:
+        del ids[i]
+
+
+_index = None
+
+
+def init():
+    """Build the index in a background thread if the option search.index is set and keep it up to date.
+    This is called when the levels have been initialized."""
+    if config.options.search.index:
+        levels.real.connect(_handleLevelChange)
+        application.dispatcher.connect(_handleDispatcher)
+        rebuild()
+
+
+def rebuild(background=True):
+    """Replace the index by a new one which is built from the database (in a background thread unless
+    *background* is False). Until it is ready, searches use the database."""
+    global _index
+    _index = SearchIndex()
+    if background:
+        threading.Thread(target=_build, args=(_index,), name='SearchIndexBuilder', daemon=True).start()
+    else: _index.build()
+
+
+def _build(index):
+    try:
+        index.build()
+    except Exception:
+        logging.exception(__name__, "Could not build the search index")
+
+
+def get():
+    """Return the search index if it is enabled and ready, otherwise None."""
+    if _index is not None and _index.ready:
+        return _index
+    else: return None
+
+
+def canProcess(criterion):
+    """Return whether *criterion* will be processed using the index."""
+    index = get()
+    return index is not None and index.canProcess(criterion)
+
+
+def process(criterion, fromTable, domain):
+    """If the index can process *criterion*, search all elements in *fromTable* (usually the elements table)
+    and *domain* which match it, store the result in criterion.result and return True. Otherwise return
+    False; the criterion must then be processed in the database.
+    """
+    index = get()
+    if index is None or not index.canProcess(criterion):
+        return False
+    index.process(criterion, domain)
+    if fromTable != db.prefix + 'elements':
+        criterion.result &= db.query("SELECT id FROM {table}", table=fromTable).getSingleColumn()
+    return True
+
+
+def _handleLevelChange(event):
+    ids = event.dbAddedIds | event.dbRemovedIds
+    if event.changedTags is None or event.changedFlags is None \
+            or len(event.changedTags) > 0 or len(event.changedFlags) > 0:
+        ids |= event.dataIds
+    if len(ids) > 0 and _index is not None:
+        _index.update(ids)
+
+
+def _handleDispatcher(event):
+    if isinstance(event, (tags.TagTypeChangeEvent, flags.FlagTypeChangeEvent)) \
+            and event.action != application.ChangeType.added:
+        rebuild()
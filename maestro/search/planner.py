@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# Maestro Music Manager  -  https://github.com/maestromusic/maestro
+# Copyright (C) 2009-2015 Martin Altmayer, Michael Helmling
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""The query planner decides in which order the criteria of a search are processed.
+
+The criteria of an AND-criterion are processed in the order of their estimated selectivity (see
+Criterion.estimate). The result of each criterion is staged in a temporary table and the next criterion
+only searches within this table. Thus a selective criterion like a long search word makes the following
+criteria cheap, no matter in which order the user typed them.
+
+Before processing, the criterion tree is simplified: A negated OR-criterion is rewritten using De Morgan's
+law (!(a | b) == !a !b), so that its parts may be merged into a surrounding AND-criterion and profit from
+the staging. Nested criteria with the same junction are merged.
+
+Independent leaf criteria (the parts of an OR-criterion and the remaining parts of an AND-criterion whose
+result is too large for staging) may be processed in parallel, see search.executor.
+
+The planner stores the result of the whole search and of all leaf criteria in their 'result' attribute.
+Note that the results of criteria within an AND-criterion are restricted to the results of the criteria
+processed before them.
+"""
+
+import copy
+
+from . import criteria, executor, index, profiler
+from .idset import IdSet
+from .. import database as db
+
+# Results larger than this are not staged. Instead the next criterion is processed on the original table
+# and the results are intersected in Python. Staging large results costs more than it saves.
+STAGE_LIMIT = 50000
+
+
+class PlanNode:
+    """A node in the tree of criteria that is actually processed. Leaf nodes contain a single (non-multi)
+    criterion. Other nodes combine the results of their *children* using *junction* ('AND' or 'OR') and
+    complement the result if *negate* is True. *criterion* is the original criterion whose result is
+    computed by this node (it may be None for nodes created by rewriting).
+    """
+    def __init__(self, criterion, junction=None, children=None, negate=False):
+        self.criterion = criterion
+        self.junction = junction
+        self.children = children
+        self.negate = negate
+        self.result = None
+
+    def isLeaf(self):
+        """Return whether this node contains a single criterion."""
+        return self.junction is None
+
+    def estimate(self):
+        """Estimate the fraction of elements matched by this node (see Criterion.estimate)."""
+        if self.isLeaf():
+            return self.criterion.estimate()
+        estimates = [child.estimate() for child in self.children]
+        if self.junction == 'AND':
+            result = min(estimates)
+        else: result = min(1, sum(estimates))
+        return 1 - result if self.negate else result
+
+    def __repr__(self):
+        if self.isLeaf():
+            return repr(self.criterion)
+        separator = ' ' if self.junction == 'AND' else ' | '
+        string = '(' + separator.join(repr(child) for child in self.children) + ')'
+        return criteria.PREFIX_NEGATE + string if self.negate else string
+
+
+def makePlan(criterion):
+    """Return the root PlanNode of a simplified tree for *criterion*. The criterion is not modified."""
+    if not isinstance(criterion, criteria.MultiCriterion):
+        return PlanNode(criterion)
+    if criterion.negate and criterion.junction == 'OR':
+        node = PlanNode(criterion, 'AND', [makePlan(_negated(c)) for c in criterion.criteria])
+    else:
+        node = PlanNode(criterion, criterion.junction, [makePlan(c) for c in criterion.criteria],
+                        criterion.negate)
+    children = []
+    for child in node.children:
+        if child.junction == node.junction and not child.negate:
+            children.extend(child.children)
+        else: children.append(child)
+    node.children = children
+    return node
+
+
+def _negated(criterion):
+    """Return a shallow copy of *criterion* with the opposite 'negate' attribute."""
+    criterion = copy.copy(criterion)
+    criterion.negate = not criterion.negate
+    return criterion
+
+
+def process(node, fromTable, domain, depth=0):
+    """Process the plan *node* like Criterion.process: Search the elements in *fromTable* that belong to
+    *domain* (unless it is None) and store the result in node.result and node.criterion.result. This is a
+    generator which yields between steps. *depth* is used to find unique names for the staging tables.
+    """
+    if node.isLeaf():
+        yield from executor.processCriterion(node.criterion, fromTable, domain)
+        node.result = node.criterion.result
+    else:
+        with profiler.measure(node):
+            yield from _processMulti(node, fromTable, domain, depth)
+
+
+def _processMulti(node, fromTable, domain, depth):
+    """Process a plan node which is not a leaf (see process)."""
+    if node.junction == 'AND':
+        children = sorted(node.children, key=PlanNode.estimate)
+        table, tableDomain = fromTable, domain
+        result = None
+        for i, child in enumerate(children):
+            yield from process(child, table, tableDomain, depth+1)
+            if result is None or table != fromTable:
+                result = child.result # the child only searched within the previous result
+            else: result = result.intersection(child.result)
+            if len(result) == 0 or i == len(children) - 1:
+                break
+            if all(_usesIndex(c) for c in children[i+1:]):
+                # The index searches all elements anyway, so intersect the results in Python
+                table, tableDomain = fromTable, domain
+            elif len(result) <= STAGE_LIMIT:
+                # The staged ids have already been filtered by domain
+                table = db.stageIds(result, 'search_{}'.format(depth))
+                tableDomain = None
+            elif all(c.isLeaf() for c in children[i+1:]) \
+                    and executor.canProcess([c.criterion for c in children[i+1:]], fromTable):
+                # Without staging the remaining criteria are independent and may be processed in parallel
+                yield from _processLeaves(children[i+1:], fromTable, domain)
+                result = result.intersection(*[c.result for c in children[i+1:]])
+                break
+            else: table, tableDomain = fromTable, domain
+        node.result = result
+    else:
+        # Leaves are independent and may be processed in parallel
+        yield from _processLeaves([child for child in node.children if child.isLeaf()], fromTable, domain)
+        for child in node.children:
+            if not child.isLeaf():
+                yield from process(child, fromTable, domain, depth+1)
+        node.result = IdSet().union(*[child.result for child in node.children])
+
+    if node.negate:
+        node.result = allIds(fromTable, domain) - node.result
+        yield
+    if node.criterion is not None and not node.isLeaf():
+        node.criterion.result = node.result
+
+
+def _processLeaves(nodes, fromTable, domain):
+    """Process the given leaf nodes, using the thread pool of the executor if possible."""
+    yield from executor.process([node.criterion for node in nodes], fromTable, domain)
+    for node in nodes:
+        node.result = node.criterion.result
+
+
+def _usesIndex(node):
+    """Return whether *node* is a leaf which will be processed by the search index."""
+    return node.isLeaf() and index.canProcess(node.criterion)
+
+
+def allIds(fromTable, domain):
+    """Return the set of all ids in *fromTable* that belong to *domain* (unless it is None)."""
+    if fromTable == db.prefix + 'elements' and index.get() is not None:
+        return index.get().allIds(domain)
+    if domain is None:
+        return IdSet(db.query("SELECT id FROM {table}", table=fromTable).getSingleColumn())
+    elif fromTable == db.prefix + 'elements':
+        return IdSet(db.query("SELECT id FROM {p}elements WHERE domain = ?", domain.id).getSingleColumn())
+    else:
+        return IdSet(db.query("SELECT id FROM {table} JOIN {p}elements USING(id) WHERE domain = ?",
+                            domain.id, table=fromTable).getSingleColumn())
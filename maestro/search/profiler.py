@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# Maestro Music Manager  -  https://github.com/maestromusic/maestro
+# Copyright (C) 2009-2015 Martin Altmayer, Michael Helmling
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Instrumentation of searches.
+
+Pass a Profile to SearchTask to record how a search is processed. The profile contains a tree of
+ProfileNodes: The root node stands for the whole search, the other nodes for the criteria and combinations
+of criteria in the order in which they were processed (if the query planner is enabled, this is the tree of
+PlanNodes, see search.planner). Each node stores its wall time, result size and the SQL statements it
+executed with their time, the number of rows they inserted or changed and optionally the query plan of the
+database. Profiles can be exported as JSON.
+
+Processing code marks the nodes using the context manager 'measure'. It does nothing unless a profiled
+search is processed in the current thread, so searches without profile do not pay for the instrumentation.
+"""
+
+import collections
+import contextlib
+import json
+import threading
+import time
+
+from .. import database as db
+
+
+# A statement executed by a criterion. *rows* is the number of rows inserted or changed by the statement
+# (None if the database does not report it, e.g. for SELECT in SQLite), *plan* is the output of db.explain
+# (None unless the profile was created with explain=True).
+Statement = collections.namedtuple('Statement', 'query time rows plan')
+
+_local = threading.local() # stores the tuple (profile, current node) while a profiled search is processed
+
+
+class ProfileNode:
+    """A node in the tree of a Profile. *label* describes the processed criterion (usually its string
+    representation). *source* is the criterion or PlanNode whose 'result' attribute holds the result."""
+    def __init__(self, label, source=None):
+        self.label = label
+        self.source = source
+        self.time = None
+        self.resultSize = None
+        self.statements = []
+        self.children = []
+
+    def rows(self):
+        """Return the number of rows inserted or changed by the statements of this node (not including
+        its children)."""
+        return sum(statement.rows for statement in self.statements if statement.rows is not None)
+
+    def toDict(self):
+        """Return a dict containing the data of this node and its children (e.g. for JSON)."""
+        return {'criterion': self.label,
+                'time': self.time,
+                'rows': self.rows(),
+                'resultSize': self.resultSize,
+                'statements': [statement._asdict() for statement in self.statements],
+                'children': [child.toDict() for child in self.children]}
+
+
+class Profile:
+    """Records the processing of a search. Pass it to SearchTask. If *explain* is True, the query plan of
+    each statement is stored as well (this requires an additional query per statement).
+    After the search, 'root' is the root ProfileNode and 'cached' is True if the result was taken from the
+    search result cache (then root has no children).
+    """
+    def __init__(self, explain=False):
+        self.explain = explain
+        self.root = None
+        self.cached = False
+        self._lock = threading.Lock() # nodes may be added by several threads (see search.executor)
+
+    def toDict(self):
+        """Return a dict containing all recorded data."""
+        return {'databaseType': db.type,
+                'explain': self.explain,
+                'cached': self.cached,
+                'root': self.root.toDict() if self.root is not None else None}
+
+    def toJson(self):
+        """Return all recorded data as JSON string."""
+        return json.dumps(self.toDict(), indent=2, ensure_ascii=False)
+
+    def _addStatement(self, node, queryString, args, result, duration):
+        rows = result.affectedRows()
+        if rows is not None and rows < 0:
+            rows = None
+        plan = None
+        if self.explain and queryString.lstrip()[:6].upper() in ('SELECT', 'INSERT', 'DELETE', 'UPDATE') \
+                and not any(isinstance(arg, (tuple, list)) for arg in args): # no multiQuery
+            try:
+                plan = db.explain(queryString, args)
+            except db.DBException as e:
+                plan = [str(e)]
+        node.statements.append(Statement(' '.join(queryString.split()), duration, rows, plan))
+
+
+def current():
+    """Return an object describing the profiled search processed in the current thread (None if there is
+    none). Pass it to resume to continue recording in another thread."""
+    return getattr(_local, 'state', None)
+
+
+@contextlib.contextmanager
+def start(profile, criterion):
+    """Record the processing of *criterion* within the with-block in the root node of *profile*. Do nothing
+    if *profile* is None."""
+    if profile is None:
+        yield
+        return
+    profile.root = ProfileNode(repr(criterion), criterion)
+    with _record(profile, profile.root):
+        yield
+
+
+@contextlib.contextmanager
+def resume(state):
+    """Continue recording the profiled search described by *state* (a return value of current) in the
+    current thread: Nodes created within the with-block become children of the node that was current when
+    *state* was obtained."""
+    if state is None:
+        yield
+        return
+    previous = current()
+    _local.state = state
+    try:
+        yield
+    finally:
+        _local.state = previous
+
+
+@contextlib.contextmanager
+def measure(source, label=None):
+    """Record the processing of *source* (a criterion or PlanNode) within the with-block in a new child of
+    the current node. *label* defaults to the string representation of *source*. Do nothing unless a
+    profiled search is processed in the current thread."""
+    state = current()
+    if state is None:
+        yield
+        return
+    profile, parent = state
+    node = ProfileNode(label if label is not None else repr(source), source)
+    with profile._lock:
+        parent.children.append(node)
+    with _record(profile, node):
+        yield
+
+
+@contextlib.contextmanager
+def _record(profile, node):
+    """Make *node* the current node, record the statements and the time of the with-block in it and store
+    the result size of its source afterwards."""
+    previous = current()
+    _local.state = (profile, node)
+    startTime = time.perf_counter()
+    try:
+        with db.observeQueries(lambda *args: profile._addStatement(node, *args)):
+            yield
+    finally:
+        node.time = time.perf_counter() - startTime
+        _local.state = previous
+    result = getattr(node.source, 'result', None)
+    if result is not None:
+        node.resultSize = len(result)
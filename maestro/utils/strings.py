@@ -18,7 +18,7 @@
 
 """This module just contains several useful string functions."""
 
-import re, unicodedata, string
+import functools, locale, re, unicodedata, string
 
 from PyQt5 import QtCore
 translate = QtCore.QCoreApplication.translate
@@ -28,6 +28,8 @@ translate = QtCore.QCoreApplication.translate
 # (usually you'll want to split the tag into one tag for each value)
 SEPARATORS = ('/', " / ", ' - ', ", ", ' & ')
 
+SORT_KEY_CACHE_SIZE = 100000 # Number of strings whose collation keys are cached (see sortKey)
+
 
 def replace(text, dict):
     """Replace multiple pairs at a single blow. To be exact: The keys of *dict* are replaced by the
@@ -237,3 +239,11 @@ def romanToArabic(roman):
 def removeDiacritics(s):
     """Return *s* with all diacritics removed: Replace 'ä' -> 'a', 'é' -> 'e' etc."""  
     return ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.combining(c) == 0)
+
+
+@functools.lru_cache(maxsize=SORT_KEY_CACHE_SIZE)
+def sortKey(s):
+    """Return a key to sort *s* according to the current locale (see locale.strxfrm). Keys are cached, so
+    that sorting the same values repeatedly (e.g. each time the browser is built) computes each key only
+    once. Call sortKey.cache_clear if the locale changes."""
+    return locale.strxfrm(s)
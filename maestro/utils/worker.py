@@ -17,6 +17,7 @@
 #
 
 import enum
+import itertools
 import threading
 
 from PyQt5 import QtCore, QtGui
@@ -51,15 +52,54 @@ class Task:
         """
         generator = self.process()
         if generator is not None:
-            for n in self.process():
+            for n in generator:
                 pass
     
+    def interrupt(self):
+        """Called from another thread when the worker is reset or quit while it processes this task.
+        Tasks which may spend a long time in a single step (e.g. a long SQL statement) can implement this
+        to abort that step, usually by making it raise an exception in the worker thread. The worker ignores
+        exceptions of tasks that have been interrupted.
+        """
+        pass
+    
+    def key(self):
+        """Return a hashable key which identifies the result of this task, or None if the result must not
+        be shared (the default). When a task is submitted to a WorkerPool while a task with the same key is
+        waiting or being processed, the new task is not processed itself. Instead it takes over the result
+        of the other task using adopt. Tasks with a key are processed at most once at a time and should not
+        depend on the state of the submitting object.
+        """
+        return None
+    
+    def adopt(self, result):
+        """Take over *result*, which is either a PartialResult yielded by a task with the same key (see key)
+        or that task itself when it has finished. Return the object which is passed to the done-signal
+        instead, usually self or a PartialResult of this task. This is called in the worker thread before
+        the other task's result is passed to anyone. Tasks which define key must implement it.
+        """
+        raise NotImplementedError()
+    
     #TODO: This is not used anymore; maybe use Python's built-in queue instead
     def merge(self, other):
         """Try to merge the task *other* in this task and return whether it was successful. The worker queue
         will try to merge new tasks into older tasks instead of putting them into the queue."""
         return False   
         
+
+class PartialResult(Task):
+    """Tasks may yield a PartialResult to deliver a part of their result before they are finished (e.g. the
+    first nodes of a long list). The worker emits its done-signal with the PartialResult just like with
+    finished tasks, so a receiver must check the type of the signal's argument. *task* is the task which
+    produced the partial result and *result* may be anything.
+    """
+    def __init__(self, task, result):
+        self.task = task
+        self.result = result
+        
+    def process(self):
+        raise RuntimeError("PartialResults cannot be submitted.")
+    
     
 class Queue:
     """A simple FIFO-queue for inter-thread communication. Contrary to Python's queue.Queue it supports
@@ -106,6 +146,10 @@ class Worker(QtCore.QObject):
     """A worker thread that processes tasks. Tasks should be added with the 'submit' method. When a task
     is finished, the done-signal is emitted with the task as argument. The signal is emitted from the 
     thread, that created the worker, so it is usually not necessary to use a queued connection.
+    
+    A task may deliver parts of its result before it is finished by yielding PartialResults. The done-signal
+    is emitted for each of them. When the worker is reset, the interrupt-method of the current task is
+    called and neither the task nor its pending PartialResults will be passed to the done-signal.
     """
     done = QtCore.pyqtSignal(Task)
     _done = QtCore.pyqtSignal(Task)
@@ -116,6 +160,7 @@ class Worker(QtCore.QObject):
         self._resetCount = 0
         self._done.connect(self._handleDone, Qt.QueuedConnection)
         self._queue = Queue()
+        self._currentTask = None
         self._emptyEvent = threading.Event()
         self._thread = threading.Thread(target=self.run)
         self._thread.daemon = True
@@ -140,12 +185,20 @@ class Worker(QtCore.QObject):
         if self.state != State.Quit:
             self._resetCount += 1
             self._queue.put(None)  # wake up worker if it is blocking in queue.get
+            self._interruptCurrentTask()
     
     def quit(self):
         """Quit the worker thread."""
         self.state = State.Quit
         self._resetCount += 1  # don't handle tasks anymore
         self._queue.put(None)  # wake up worker if it is blocking in queue.get
+        self._interruptCurrentTask()
+    
+    def _interruptCurrentTask(self):
+        """Interrupt the task which is processed at the moment (if any)."""
+        task = self._currentTask
+        if task is not None and task._resetCount != self._resetCount:
+            task.interrupt()
         
     def join(self, timeout=None):
         """Block until all tasks have been processed (or *timeout* has elapsed)."""
@@ -164,21 +217,32 @@ class Worker(QtCore.QObject):
         self.runInit()
         try:
             while True:
+                task = generator = None
                 try:
                     if self._queue.isEmpty():
                         self._emptyEvent.set()
                     task = self._queue.get()
                     if task is None or task._resetCount != self._resetCount:
                         raise ResetException() # None is inserted to wake up the thread in reset/quit
+                    self._currentTask = task
                     generator = task.process()
-                    i = 1
                     if generator is not None: # tasks yields None between each major step...
                         for n in generator:   # ...to give us the chance to abort in between.
-                            i += 1
                             if task._resetCount != self._resetCount:
                                 raise ResetException()
+                            if isinstance(n, PartialResult):
+                                n._resetCount = task._resetCount
+                                self._done.emit(n)
+                    self._currentTask = None
                     self._done.emit(task)
-                except ResetException:
+                except Exception as e:
+                    self._currentTask = None
+                    if generator is not None:
+                        generator.close() # execute finally-blocks of the task now and in this thread
+                    # Exceptions of interrupted tasks (see Task.interrupt) are expected
+                    if not isinstance(e, ResetException) \
+                            and (task is None or task._resetCount == self._resetCount):
+                        raise
                     if self.state == State.Quit:
                         break
         finally:
@@ -193,6 +257,235 @@ class Worker(QtCore.QObject):
             self.done.emit(task)
 
 
+# Priorities of SharedWorkers. Widgets should use PRIORITY_VISIBLE while they are visible.
+PRIORITY_HIDDEN = 0
+PRIORITY_VISIBLE = 1
+
+_sharedPool = None
+
+
+def sharedPool():
+    """Return the WorkerPool which is shared by all browsers, cover browsers and similar widgets (its size
+    is set by the option search.workers). It is created when it is used for the first time."""
+    global _sharedPool
+    if _sharedPool is None:
+        from maestro import config
+        _sharedPool = WorkerPool(config.options.search.workers)
+    return _sharedPool
+
+
+class _Job:
+    """A task waiting in or processed by a WorkerPool together with its subscribers, i.e. a list of tuples
+    (SharedWorker, task, reset count of the worker when the task was submitted). The first subscriber
+    submitted the processed task, the others adopt its result (see Task.adopt). Subscribers are removed
+    when their worker is reset.
+    """
+    def __init__(self, task, key, worker):
+        self.task = task
+        self.key = key
+        self.subscribers = [(worker, task, worker._resetCount)]
+        self.sequence = None # position in the order of submission
+        self.running = False
+        self.partial = False # whether PartialResults have already been delivered
+        self.cancelled = False
+        
+    def priority(self):
+        """Return the priority of this job: the highest priority of its subscribers."""
+        return max(worker.priority for worker, _, _ in self.subscribers)
+    
+    def deliver(self, result, subscribers):
+        """Return a list of (worker, object, reset count) for the given *subscribers*, where object is
+        *result* (the processed task or a PartialResult of it) or what the subscriber's task returns when
+        it adopts *result*. Call this in the pool thread without holding the pool's lock."""
+        return [(worker, result if task is self.task else task.adopt(result), resetCount)
+                for worker, task, resetCount in subscribers]
+
+
+class WorkerPool(QtCore.QObject):
+    """A bounded pool of *threadCount* threads which process the tasks of several SharedWorkers. Waiting tasks
+    are processed in the order of their priority (the priority of the SharedWorker which submitted them) and
+    in the order of submission among equal priorities.
+    
+    Identical requests are processed only once: When a task is submitted while a task with the same key
+    (see Task.key) is waiting or being processed, it subscribes to the other task and adopts its result.
+    This includes PartialResults, unless the other task has already delivered some of them (then the new
+    task is processed on its own). A task is only interrupted when all workers which wait for its result
+    have been reset.
+    """
+    _done = QtCore.pyqtSignal(object)
+    
+    def __init__(self, threadCount):
+        super().__init__()
+        self._done.connect(self._handleDone, Qt.QueuedConnection)
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._waiting = [] # list of _Jobs
+        self._running = []
+        self._sequence = 0
+        self._threads = [threading.Thread(target=self._run, daemon=True) for _ in range(max(1, threadCount))]
+        for thread in self._threads:
+            thread.start()
+            
+    def _submit(self, worker, task):
+        """Submit *task* for the SharedWorker *worker*."""
+        with self._lock:
+            key = task.key()
+            if key is not None:
+                for job in itertools.chain(self._waiting, self._running):
+                    if job.key == key and not job.partial and not job.cancelled:
+                        job.subscribers.append((worker, task, worker._resetCount))
+                        worker._pending += 1
+                        return
+            job = _Job(task, key, worker)
+            job.sequence = self._sequence
+            self._sequence += 1
+            self._waiting.append(job)
+            worker._pending += 1
+            self._condition.notify()
+        
+    def _reset(self, worker):
+        """Remove all subscriptions of *worker* (its reset count must have been increased before). Remove
+        waiting tasks and interrupt running tasks which have no subscribers anymore."""
+        interrupt = []
+        with self._lock:
+            for job in self._waiting + self._running:
+                count = len(job.subscribers)
+                job.subscribers = [s for s in job.subscribers if s[0] is not worker]
+                worker._pending -= count - len(job.subscribers)
+                if len(job.subscribers) == 0:
+                    job.cancelled = True
+                    if job.running:
+                        interrupt.append(job.task)
+            self._waiting = [job for job in self._waiting if not job.cancelled]
+            self._condition.notify_all()
+        for task in interrupt:
+            task.interrupt()
+    
+    def _join(self, worker, timeout):
+        """Block until all tasks of *worker* have been processed (or *timeout* has elapsed)."""
+        with self._lock:
+            self._condition.wait_for(lambda: worker._pending == 0, timeout)
+    
+    def _next(self):
+        """Remove the waiting job with the highest priority from the queue and return it. Block until
+        there is one."""
+        with self._lock:
+            while len(self._waiting) == 0:
+                self._condition.wait()
+            job = max(self._waiting, key=lambda job: (job.priority(), -job.sequence))
+            self._waiting.remove(job)
+            self._running.append(job)
+            job.running = True
+            return job
+        
+    def _run(self):
+        while True:
+            job = self._next()
+            generator = None
+            subscribers = results = []
+            try:
+                generator = job.task.process()
+                if generator is not None:
+                    for n in generator:
+                        if job.cancelled:
+                            raise ResetException()
+                        if isinstance(n, PartialResult):
+                            with self._lock:
+                                job.partial = True
+                                current = list(job.subscribers)
+                            self._done.emit(job.deliver(n, current))
+                # No new subscribers from now on. Adopt the result in this thread, so that join returns only
+                # afterwards.
+                subscribers = self._close(job)
+                results = job.deliver(job.task, subscribers)
+            except Exception as e:
+                if job in self._running: # otherwise subscribers have been determined above
+                    subscribers = self._close(job)
+                if generator is not None:
+                    generator.close() # execute finally-blocks of the task now and in this thread
+                # Exceptions of interrupted tasks (see Task.interrupt) are expected
+                if not isinstance(e, ResetException) and not job.cancelled:
+                    from maestro import logging
+                    logging.exception(__name__, "Error in task {}".format(job.task))
+            finally:
+                with self._lock:
+                    for worker, _, _ in subscribers:
+                        worker._pending -= 1
+                    self._condition.notify_all()
+            if len(results) > 0:
+                self._done.emit(results)
+    
+    def _close(self, job):
+        """Remove *job* from the running jobs (if it has not been removed yet) and return the list of its
+        subscribers."""
+        with self._lock:
+            if job in self._running:
+                self._running.remove(job)
+                return list(job.subscribers)
+            else: return []
+    
+    def _handleDone(self, results):
+        """Pass results to the done-signals of their workers unless the workers have been reset meanwhile."""
+        # This method is executed in the main thread
+        for worker, result, resetCount in results:
+            if resetCount == worker._resetCount:
+                worker.done.emit(result)
+        
+
+class SharedWorker(QtCore.QObject):
+    """A client of a WorkerPool (by default the shared pool, see sharedPool) which can be used like a Worker:
+    Submit tasks with 'submit' and receive the finished tasks and their PartialResults with the done-signal.
+    Contrary to a Worker, the tasks of a SharedWorker may be processed at the same time in different threads
+    and may finish in any order.
+    
+    Waiting tasks of workers with higher *priority* are processed first. Widgets should use
+    PRIORITY_VISIBLE while they are visible and PRIORITY_HIDDEN otherwise.
+    """
+    done = QtCore.pyqtSignal(Task)
+    
+    def __init__(self, pool=None, priority=PRIORITY_HIDDEN):
+        super().__init__()
+        self.pool = pool if pool is not None else sharedPool()
+        self.priority = priority
+        self.state = State.Running
+        self._resetCount = 0
+        self._pending = 0 # number of submitted tasks which have not been processed (guarded by pool._lock)
+        
+    def start(self):
+        """Do nothing. This method exists for compatibility with Worker."""
+        pass
+    
+    def setPriority(self, priority):
+        """Set the priority of this worker's tasks (including tasks which have already been submitted)."""
+        self.priority = priority
+        
+    def submit(self, task):
+        """Submit a task to be processed by the pool."""
+        if self.state != State.Quit:
+            self.pool._submit(self, task)
+            
+    def submitMany(self, tasks):
+        """Submit a list of tasks to be processed by the pool."""
+        for task in tasks:
+            self.submit(task)
+            
+    def reset(self):
+        """Remove all submitted tasks. Their results will not be passed to the done-signal."""
+        if self.state != State.Quit:
+            self._resetCount += 1
+            self.pool._reset(self)
+        
+    def quit(self):
+        """Remove all submitted tasks and do not accept new ones."""
+        self.state = State.Quit
+        self._resetCount += 1
+        self.pool._reset(self)
+    
+    def join(self, timeout=None):
+        """Block until all submitted tasks have been processed (or *timeout* has elapsed)."""
+        self.pool._join(self, timeout)
+
+
 class LoadImageTask(Task):
     """A task that loads an image from *path* and optionally resizes it to *size* (a QSize). When the 
     image has been loaded, the attribute 'loaded' will be set to True and 'pixmap' can be used to retrieve
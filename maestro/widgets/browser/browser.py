@@ -365,6 +365,14 @@ class BrowserTreeView(treeview.TreeView):
         # might perform a search, Expanders work asynchronously.
         self.expander = VisibleLevelsExpander(self)
     
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.model().setVisible(True)
+        
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.model().setVisible(False)
+    
     def _handleNodeLoaded(self, node):
         """When a node has loaded in the model, allow the expander to expand it or load another node."""
         # Call the current expander so that it can decide what nodes should be loaded (or even expanded)
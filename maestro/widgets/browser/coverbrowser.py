@@ -88,9 +88,9 @@ class CoverBrowser(widgets.Widget):
                 except search.criteria.ParseException:
                     logging.exception(__name__, "Could not parse the cover browser's filter criterion.")
         
-        self.worker = utils.worker.Worker()
+        self._lastSearch = None # the last finished search, the next search may refine it
+        self.worker = utils.worker.SharedWorker()
         self.worker.done.connect(self._loaded)
-        self.worker.start()
         
         layout = QtWidgets.QVBoxLayout(self)
         layout.setContentsMargins(0, 0, 0, 0)
@@ -138,6 +138,14 @@ class CoverBrowser(widgets.Widget):
         super().closeEvent(event)
         self.worker.quit()
         
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.worker.setPriority(utils.worker.PRIORITY_VISIBLE)
+        
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.worker.setPriority(utils.worker.PRIORITY_HIDDEN)
+        
     def saveState(self):
         state = {'domain': self.domain.id,
                  'display': self._display,
@@ -243,7 +251,7 @@ class CoverBrowser(widgets.Widget):
         
         self.worker.reset()
         if criterion is not None:
-            self.worker.submit(search.SearchTask(criterion, domain=self.domain))
+            self.worker.submit(search.SearchTask(criterion, domain=self.domain, previous=self._lastSearch))
         else: self._loaded(None)
             
     def _loaded(self, task):
@@ -252,6 +260,7 @@ class CoverBrowser(widgets.Widget):
         if task is not None:
             if not isinstance(task, search.SearchTask): # subclasses might submit over tasks
                 return
+            self._lastSearch = task
             elids = task.criterion.result
             if len(elids):
                 filterClause = " AND el.id IN ({})".format(db.csList(elids))
@@ -16,7 +16,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import itertools, collections, functools, locale
+import itertools, collections, functools, heapq, operator
 
 from PyQt5 import QtCore, QtWidgets
 from PyQt5.QtCore import Qt
@@ -30,6 +30,13 @@ from maestro.gui import selection, dialogs
 from maestro.widgets.browser import nodes as bnodes
 
 
+# Number of nodes which are delivered at once when contents are loaded in chunks (see Layer.buildChunks)
+CHUNK_SIZE = 1000
+
+# Number of toplevel nodes which are loaded at once when the browser displays all elements of its domain
+# (see Pager)
+PAGE_SIZE = 500
+
 # Registered layer classes. Maps names -> (title, class)
 layerClasses = collections.OrderedDict()
 
@@ -66,7 +73,14 @@ class BrowserModel(rootedtreemodel.RootedTreeModel):
            determine the set of elements below the node. Also the layer of the node is determined (usually
            one layer after the parent node's layer). Then the layer is asked to group the elements.
            
-    All these steps are performed in a separate worker thread.
+    All these steps are performed by the worker pool shared with other widgets (see utils.worker.WorkerPool);
+    models with the same filter and layers share searches and nodes. Layers deliver the contents of a node
+    in chunks (see Layer.buildChunks), which are inserted as soon as they arrive. When the model is reset,
+    loading stops immediately, even in the middle of an SQL statement.
+    
+    Without filter, large domains are loaded page by page instead (see Pager): The root node only contains
+    the first PAGE_SIZE nodes. When the view is scrolled to the end, it requests the next page using
+    canFetchMore and fetchMore.
     """
     nodeLoaded = QtCore.pyqtSignal(Node)
     hasContentsChanged = QtCore.pyqtSignal(bool)
@@ -77,14 +91,20 @@ class BrowserModel(rootedtreemodel.RootedTreeModel):
         self.level = levels.real  # this is used by the selection-module
         self.layers = layers
         self.filter = filter
-        self.worker = utils.worker.Worker()
+        self._lastSearch = None # the search of the root node, subsequent searches may refine it
+        self._pager = None # loads further pages of the root node's contents
+        self._fetching = False # whether a page is being loaded
+        self.worker = utils.worker.SharedWorker()
         self.worker.done.connect(self._loaded)
-        self.worker.start()
         self._startLoading(self.root)
     
     def shutdown(self):
-        """Stop the internal worker thread."""
+        """Stop loading. The model must not be used afterwards."""
         self.worker.quit()
+    
+    def setVisible(self, visible):
+        """Tell the model whether it is displayed. Visible models load their contents first."""
+        self.worker.setPriority(utils.worker.PRIORITY_VISIBLE if visible else utils.worker.PRIORITY_HIDDEN)
         
     def getDomain(self):
         """Return the domain whose elements are displayed."""
@@ -149,8 +169,19 @@ class BrowserModel(rootedtreemodel.RootedTreeModel):
         """Reset and reload the browser completely."""
         self.beginResetModel()
         self.worker.reset()
+        self._pager = None
+        self._fetching = False
         self.endResetModel()
         self._startLoading(self.root)
+    
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self._pager is not None and not self._pager.finished \
+            and not self._fetching
+    
+    def fetchMore(self, parent):
+        if self.canFetchMore(parent):
+            self._fetching = True
+            self.worker.submit(FetchTask(self._pager))
             
     def flags(self, index):
         defaultFlags = rootedtreemodel.RootedTreeModel.flags(self, index)
@@ -186,7 +217,7 @@ class BrowserModel(rootedtreemodel.RootedTreeModel):
         if hasattr(node, 'getElids'):
             elids = node.getElids()
             if elids is not None:
-                task = LoadTask(node, layerIndex, layer, self.domain, elids=elids)
+                task = LoadTask(node, layerIndex, layer, self.domain, elids=elids, streaming=not block)
         if task is None:
             criteria = []
             if self.filter is not None:
@@ -195,7 +226,9 @@ class BrowserModel(rootedtreemodel.RootedTreeModel):
                 criteria.extend(p.getCriterion() for p in node.getParents(includeSelf=True)
                                                  if isinstance(p, bnodes.CriterionNode))
             criterion = search.criteria.combine('AND', criteria)
-            task = LoadTask(node, layerIndex, layer, self.domain, criterion=criterion)
+            task = LoadTask(node, layerIndex, layer, self.domain, criterion=criterion,
+                            previousSearch=self._lastSearch, streaming=not block,
+                            paged=node is self.root and self.filter is None)
         self.worker.submit(task)
         if block:
             self.worker.join()
@@ -205,8 +238,19 @@ class BrowserModel(rootedtreemodel.RootedTreeModel):
             self._loaded(task)
     
     def _loaded(self, task):
-        """This is called (in the main thread) when a task has been processed. It will insert the loaded
-        contents into the node."""
+        """This is called (in the main thread) when a task has been processed or has delivered a part of the
+        contents (a PartialResult). It will insert the loaded contents into the node."""
+        if isinstance(task, utils.worker.PartialResult):
+            self._insertChunk(task.task, *task.result)
+            return
+        if isinstance(task, FetchTask):
+            self._fetching = False
+            if task.pager is self._pager and len(task.contents) > 0:
+                start = len(self.root.contents)
+                self.beginInsertRows(QtCore.QModelIndex(), start, start + len(task.contents) - 1)
+                self.root.insertContents(start, task.contents)
+                self.endInsertRows()
+            return
         # If _startLoading is called with block=True, _loaded is called twice for the corresponding task.
         # After the first time we set .node to None.
         if task.node is None:
@@ -216,8 +260,10 @@ class BrowserModel(rootedtreemodel.RootedTreeModel):
         task.node = None
         
         if node is self.root:
-            hadContents = self.hasContents()
-            if len(contents) == 0: 
+            self._lastSearch = task.searchTask
+            self._pager = task.pager
+        if task.sortKeys is None: # otherwise the contents have been inserted chunk by chunk
+            if node is self.root and len(contents) == 0:
                 if self.filter is None:
                     text = self.tr("Your database is empty or there is no element in domain '{}'."
                                    " Drag files from the filesystembrowser into the editor,"
@@ -225,7 +271,46 @@ class BrowserModel(rootedtreemodel.RootedTreeModel):
                 else:
                     text = self.tr("No elements found.")
                 contents = [TextNode(text, wordWrap=True)]
+            self._setContents(node, contents)
+        
+        self.nodeLoaded.emit(node)
+    
+    def _insertChunk(self, task, keys, contents):
+        """Insert a chunk of the contents loaded by *task* (see Layer.buildChunks): *contents* is a list of
+        nodes sorted by the corresponding *keys*. The first chunk replaces the old contents of the node,
+        later chunks are merged into the contents according to their keys."""
+        node = task.node
+        if node is None: # the task has already been handled (see _loaded)
+            return
+        if task.sortKeys is None:
+            task.sortKeys = list(keys)
+            self._setContents(node, list(contents))
+            return
+        # Append the chunk and sort the contents (inserting each node at its position would emit a signal
+        # for almost every node, because the nodes of different chunks are usually interleaved).
+        parentIndex = self.getIndex(node)
+        start = len(node.contents)
+        self.beginInsertRows(parentIndex, start, start + len(contents) - 1)
+        node.insertContents(start, contents)
+        task.sortKeys.extend(keys)
+        self.endInsertRows()
         
+        self.layoutAboutToBeChanged.emit([QtCore.QPersistentModelIndex(parentIndex)],
+                                         QtCore.QAbstractItemModel.VerticalSortHint)
+        order = sorted(range(len(task.sortKeys)), key=task.sortKeys.__getitem__)
+        node.contents[:] = [node.contents[i] for i in order]
+        task.sortKeys[:] = [task.sortKeys[i] for i in order]
+        rows = {id(child): row for row, child in enumerate(node.contents)}
+        oldIndexes = [index for index in self.persistentIndexList() if index.internalPointer().parent is node]
+        self.changePersistentIndexList(oldIndexes, [self.createIndex(rows[id(index.internalPointer())],
+                                                                     index.column(), index.internalPointer())
+                                                    for index in oldIndexes])
+        self.layoutChanged.emit([QtCore.QPersistentModelIndex(parentIndex)],
+                                QtCore.QAbstractItemModel.VerticalSortHint)
+    
+    def _setContents(self, node, contents):
+        """Replace the contents of *node* by *contents*."""
+        hadContents = self.hasContents()
         if node.contents is not None:
             # Only use beginRemoveRows and friends if there are already contents. If we add contents for
             # the first time, we must not call those methods or Qt will try to access the contents...
@@ -239,8 +324,6 @@ class BrowserModel(rootedtreemodel.RootedTreeModel):
         else:
             node.setContents(contents)
         
-        self.nodeLoaded.emit(node)
-        
         if node is self.root and self.hasContents() != hadContents:
             self.hasContentsChanged.emit(self.hasContents())
 
@@ -248,9 +331,17 @@ class BrowserModel(rootedtreemodel.RootedTreeModel):
 class LoadTask(utils.worker.Task):
     """When a node (either root node or CriterionNode) must load its contents, the browser submits a LoadTask
     to its worker thread. *layer* is the layer to which the node's contents belong. *criterion* is the
-    filter that specifies which elements to load as contents.
+    filter that specifies which elements to load as contents. *previousSearch* is passed to the SearchTask
+    (see search.SearchTask).
+    
+    If *streaming* is True, the contents are delivered in chunks as PartialResults (see Layer.buildChunks)
+    and the attribute 'contents' of the finished task is an empty list.
+    
+    If *paged* is True and the node should display all elements of the domain, the task may create a
+    Pager (stored in the attribute 'pager') and load only its first page.
     """ 
-    def __init__(self, node, layerIndex, layer, domain, elids=None, criterion=None):
+    def __init__(self, node, layerIndex, layer, domain, elids=None, criterion=None, previousSearch=None,
+                 streaming=False, paged=False):
         # Note to self: If layer and criterion were not immutable,
         # they should be copied here to avoid concurrent access.
         self.node = node
@@ -259,31 +350,106 @@ class LoadTask(utils.worker.Task):
         self.domain = domain
         self.elids = elids
         self.criterion = criterion
+        self.previousSearch = previousSearch
+        self.streaming = streaming
+        self.paged = paged
+        self.pager = None
+        self.searchTask = None
         self.contents = None
+        self.sortKeys = None # keys of the inserted contents (used by the model in the main thread)
+        self._interrupter = None
         
     def merge(self, node):
         return node == self.node
     
     def process(self):
+        self._interrupter = db.Interrupter()
         if self.elids is not None:
             elids = self.elids
         elif self.criterion is not None:
-            yield from search.SearchTask(self.criterion, self.domain).process()
+            self.searchTask = search.SearchTask(self.criterion, self.domain, previous=self.previousSearch)
+            self.previousSearch = None
+            yield from self.searchTask.process()
             elids = self.criterion.result
         else:
             elids = None  # display all nodes
         matchingTags = self.criterion.getMatchingTags() if self.criterion is not None else []
         if matchingTags is None:
             matchingTags = []
+        if elids is None and self.paged:
+            if self.layer is not None:
+                self.pager = self.layer.pager(self.layerIndex, self.domain)
+            else: self.pager = _WrapperPager.create(self.domain)
+            if self.pager is not None:
+                self.contents = self.pager.fetch(PAGE_SIZE)
+                self._interrupter = None
+                return
         if self.layer is not None:
-            self.contents = self.layer.build(self.layerIndex, self.domain, elids, matchingTags)
+            chunks = self.layer.buildChunks(self.layerIndex, self.domain, elids, matchingTags)
         else:
-            self.contents = _buildContainerTree(self.domain, elids)
+            chunks = _containerTreeChunks(self.domain, elids)
+        if self.streaming:
+            for chunk in chunks:
+                yield utils.worker.PartialResult(self, chunk)
+            self.contents = []
+        else: self.contents = _mergeChunks(chunks)
+        self._interrupter = None
+        
+    def interrupt(self):
+        # Abort the search or build query which is running at the moment
+        interrupter = self._interrupter
+        if interrupter is not None:
+            interrupter.interrupt()
+    
+    def key(self):
+        # Browsers with the same filter and layers share the search and the nodes. Nodes with stored element
+        # ids and pagers belong to a single model. As in SearchTask.key, the generation of the search cache
+        # keeps browsers which reload after a level change from adopting outdated nodes.
+        generation = search.cache.generation()
+        if self.elids is not None or self.criterion is None or self.paged or generation is None:
+            return None
+        return ('load', generation, repr(self.criterion), self.domain.id, repr(self.layer), self.layerIndex,
+                self.streaming)
+    
+    def adopt(self, result):
+        # A node can only be contained in one model, so copy all nodes
+        if isinstance(result, utils.worker.PartialResult):
+            keys, nodes = result.result
+            return utils.worker.PartialResult(self, (keys, [_copyNode(node) for node in nodes]))
+        self.searchTask = result.searchTask
+        self.contents = [_copyNode(node) for node in result.contents]
+        return self
     
     def __repr__(self):
         return '<TASK: Load {} with {}'.format(self.node, self.criterion if self.criterion is not None else self.elids)
 
 
+class FetchTask(utils.worker.Task):
+    """Load the next page of nodes from *pager* (see BrowserModel.fetchMore). The nodes are stored in the
+    attribute 'contents'."""
+    def __init__(self, pager):
+        self.pager = pager
+        self.contents = None
+        
+    def process(self):
+        self.contents = self.pager.fetch(PAGE_SIZE)
+
+
+class Pager:
+    """Loads the nodes which group all elements of a domain page by page, so that large domains can be
+    displayed without creating nodes and loading elements for all of them. The order of the nodes is
+    determined in SQL when the pager is created. Pagers are created and used in the worker thread of the
+    browser. Subclasses must implement fetch.
+    """
+    def __init__(self):
+        self.finished = False # whether all nodes have been fetched
+        
+    def fetch(self, count):
+        """Return a list of the next *count* nodes (or more, if the last page contains special nodes like
+        the VariousNode). Set self.finished to True when the last page has been fetched."""
+        raise NotImplementedError()
+
+
 class Layer:
     def text(self):
         """Return a text representing this layer, e.g. for configuration dialogs."""
@@ -305,7 +471,24 @@ class Layer:
               query (see search.criteria.Criterion.getMatchingTags). Layers may use this to draw
               corresponding TagNodes in bold.
         """
-        raise NotImplementedError()        
+        raise NotImplementedError()
+    
+    def buildChunks(self, layerIndex, domain, elids, matchingTags):
+        """Generator version of build, which allows the browser to display the first nodes before all nodes
+        have been created. Yield tuples (keys, nodes) where *nodes* is a list of nodes and *keys* a list of
+        their sort keys, both sorted by key. The result of build consists of the nodes of all chunks sorted
+        by their keys. The arguments are the same as in build. The default implementation yields the
+        result of build as a single chunk.
+        """
+        nodes = self.build(layerIndex, domain, elids, matchingTags)
+        yield list(range(len(nodes))), nodes
+        
+    def pager(self, layerIndex, domain):
+        """Return a Pager which loads the nodes grouping all elements of *domain* page by page, or None if
+        the nodes should be built at once. This is used for the first layer if the browser has no filter.
+        The default implementation returns None.
+        """
+        return None
         
         
 class TagLayer(Layer):
@@ -320,6 +503,10 @@ class TagLayer(Layer):
           VariousNode (if a container has no artist-tag the reason is most likely that its children have
           different artists).
     """
+    # TagNodes are only optimized (merged or removed if they are contained in others, see _removeSubNodes)
+    # if there are at most this many of them. Otherwise they are delivered in chunks as soon as possible.
+    OPTIMIZE_LIMIT = 10000
+    
     def __init__(self, tagList=None, state=None):
         if tagList is None:
             assert state is not None
@@ -341,36 +528,37 @@ class TagLayer(Layer):
         return "<TagLayer: {}>".format(', '.join(tag.name for tag in self.tagList))
         
     def build(self, layerIndex, domain, elids, matchingTags):
+        return _mergeChunks(self.buildChunks(layerIndex, domain, elids, matchingTags))
+    
+    def buildChunks(self, layerIndex, domain, elids, matchingTags):
         # 1. Get toplevel nodes.
         if elids is None:
-            toplevel = set(db.query("""
-                    SELECT id
-                    FROM {p}elements
-                    WHERE domain=? AND id NOT IN (SELECT element_id FROM {p}contents)
-                    """, domain.id).getSingleColumn())
+            toplevel = set(db.query(db.toplevel.subquery(domain)).getSingleColumn())
             if len(toplevel) == 0:
-                return []
+                return
         elif len(elids) > 0:
             toplevel = set(elids)
             toplevel.difference_update(db.query(
                      "SELECT element_id FROM {p}contents WHERE container_id IN ({elids})",
                      elids=db.csList(elids)).getSingleColumn())
         else:
-            return []
+            return
         
         # Shortcut: For very small result sets simply use a container tree
         if len(toplevel) <= 5:
-            return _buildContainerTree(domain, elids)
+            yield from _containerTreeChunks(domain, elids)
+            return
         
         # 2. Check whether a VariousNode is necessary.
         # (that is, some toplevel nodes don't have a tag from self.tagList)
         # We do this so early because 'toplevel' will be enlarged in the next step.
         tagFilter = db.csIdList(self.tagList)
         idFilter = db.csList(toplevel)
+        # The unary plus makes SQLite use the index on element_id (see _WrapperPager.create)
         variousNodeElements = list(db.query("""
             SELECT el.id
             FROM {p}elements AS el LEFT JOIN {p}tags AS t
-                                ON el.id = t.element_id AND t.tag_id IN ({tagFilter})
+                                ON el.id = t.element_id AND +t.tag_id IN ({tagFilter})
             WHERE domain={domain} AND el.id IN ({idFilter}) AND t.value_id IS NULL
             LIMIT 1
             """, tagFilter=tagFilter, idFilter=idFilter, domain=domain.id).getSingleColumn())
@@ -378,42 +566,65 @@ class TagLayer(Layer):
         # 3. Add contents of permeable nodes to 'toplevel', as long as they are in the search result.
         # Tag values in these nodes should get a TagNode even if
         # they don't appear in an actual toplevel node.
-        new = toplevel
-        while len(new):
-            new = set(db.query("""
-                SELECT c.element_id
-                FROM {p}contents AS c JOIN {p}elements AS el ON c.container_id = el.id
-                WHERE el.type IN ({collection},{container}) AND el.id IN ({parents})""",
-                    collection=elements.ContainerType.Collection.value,
-                    container=elements.ContainerType.Container.value,
-                    parents=db.csList(new)).getSingleColumn())
-            # Restrict to search result. If the node's value only appears in contents of a permeable
-            # node in the search result and these contents are not in the result themselves,
-            # we would create an empty TagNode.
-            if elids is not None:
-                new.intersection_update(elids)
-            toplevel.update(new)
+        # Restrict to search result. If the node's value only appears in contents of a permeable
+        # node in the search result and these contents are not in the result themselves,
+        # we would create an empty TagNode.
+        if db.hasRecursiveQueries():
+            toplevel.update(self._permeableContents(toplevel, elids))
+        else:
+            new = toplevel
+            while len(new):
+                new = set(db.query("""
+                    SELECT c.element_id
+                    FROM {p}contents AS c JOIN {p}elements AS el ON c.container_id = el.id
+                    WHERE el.type IN ({collection},{container}) AND el.id IN ({parents})""",
+                        collection=elements.ContainerType.Collection.value,
+                        container=elements.ContainerType.Container.value,
+                        parents=db.csList(new)).getSingleColumn())
+                if elids is not None:
+                    new.intersection_update(elids)
+                toplevel.update(new)
 
         # 4. Create a TagNode for each tag value that appears in 'toplevel'
-        # Make sure to use as single TagNode for equal values in different tags 
-        nodes = collections.defaultdict(functools.partial(bnodes.TagNode, layerIndex))
+        # Make sure to use as single TagNode for equal values in different tags. Rows are sorted by value, so
+        # a TagNode is complete when the next value appears. As soon as there are too many TagNodes to
+        # optimize them in step 5, complete TagNodes are delivered in chunks.
+        # This requires that equal values are adjacent. MySQL's default collation treats values that differ
+        # in case or trailing spaces as equal and may interleave them, so sort the bytes instead.
+        nodes = {}
+        complete = [] # complete TagNodes which have not been delivered yet
+        hiddenNodes = []
+        current = None
         idFilter = db.csList(toplevel)
         result = db.query("""
             SELECT DISTINCT t.tag_id, v.id, v.value, v.hide, v.sort_value
             FROM {p}tags AS t JOIN {p}values_varchar AS v ON t.tag_id = v.tag_id AND t.value_id = v.id
             WHERE t.tag_id IN ({tagFilter}) AND t.element_id IN ({idFilter})
-            """, tagFilter=tagFilter, idFilter=idFilter)
+            ORDER BY {order}
+            """, tagFilter=tagFilter, idFilter=idFilter,
+                 order='BINARY v.value' if db.type == 'mysql' else 'v.value')
         for tagId, valueId, value, hide, sortValue in result:
+            node = nodes.get(value)
+            if node is None:
+                if current is not None:
+                    complete.append(current)
+                    if len(nodes) > self.OPTIMIZE_LIMIT and len(complete) >= CHUNK_SIZE:
+                        yield _tagNodeChunk(complete, hiddenNodes)
+                        complete = []
+                node = current = nodes[value] = bnodes.TagNode(layerIndex)
             matching = (tagId, valueId) in matchingTags
-            nodes[value].addTagValue(tagId, valueId, value, hide, sortValue, matching)
+            node.addTagValue(tagId, valueId, value, hide, sortValue, matching)
+        if current is not None:
+            complete.append(current)
             
-        # 5. Optimize TagNodes (if there are only few of them)
-        if len(nodes) <= 20:
-            # Above we had to use values as keys, here ids are more useful
-            nodes = {tagTuple: node for node in nodes.values() for tagTuple in node.tagIds}
+        # 5. Optimize TagNodes (unless there are so many of them that they have already been delivered)
+        if len(nodes) <= self.OPTIMIZE_LIMIT:
+            # Above we had to use values as keys, here ids are more useful. A node with several values
+            # appears several times in this dict.
+            byTagId = {tagTuple: node for node in complete for tagTuple in node.tagIds}
             # The first task is to find all contents of each TagNode. Note that the last query (to find
             # TagNodes) only considered toplevel elements. 
-            for node in nodes.values():
+            for node in complete:
                 node.elids = set()
             if elids is not None:
                 idFilter = "t.element_id IN ({})".format(db.csList(elids))
@@ -426,64 +637,78 @@ class TagLayer(Layer):
                 """, tagFilter=tagFilter, idFilter=idFilter)
             withinMatchingTags = set()
             for tagId, valueId, elementId in result:
-                if (tagId, valueId) in nodes:
-                    node = nodes[(tagId, valueId)]
+                if (tagId, valueId) in byTagId:
+                    node = byTagId[(tagId, valueId)]
                 else:
                     continue # this means that this value does not appear in a 'toplevel' node
                 node.elids.add(elementId)
                 if (tagId, valueId) in matchingTags:
                     withinMatchingTags.add(elementId)
-                    
-            def checkSuperNode(node, superNode):
-                """Given two nodes where the second contains all contents of the first, return whether
-                the first node may be deleted. As a sideeffect this method may merge *node* into *superNode*.
-                """
-                # If *node* is completely contained in superNode, delete it.
-                if len(node.elids) < len(superNode.elids):
-                    # However, matching nodes must not be deleted in favor of not matching ones.
-                    # and visible nodes must not be deleted in favor of a hidden superNode.
-                    return not ((node.matching and not superNode.matching)
-                                or (not node.hide and superNode.hide)) 
-                else:
-                    if node.hide == superNode.hide:
-                        superNode.merge(node)
-                        return True
-                    else:
-                        return node.hide
-                
-            for k in list(nodes.keys()):
-                node = nodes[k]
-                # Delete nodes whose contents are covered by nodes matching the search query.
-                if not node.matching and node.elids <= withinMatchingTags:
-                    del nodes[k]
-                    continue
-                # Try to delete (or merge) TagNodes whose contents are contained in (or equal to) another
-                # TagNode
-                for node2 in nodes.values():
-                    if node2 is not node and node.elids <= node2.elids: # node2 is a superNode:
-                        if checkSuperNode(node, node2):
-                            del nodes[k]
-                            break
+            complete = _removeSubNodes(complete, withinMatchingTags)
         
-        # 6. Create final list of nodes
-        visibleNodes = [node for node in nodes.values() if not node.hide]
-        hiddenNodes = [node for node in nodes.values() if node.hide]       
-        visibleNodes.sort(key=lambda node: locale.strxfrm(node.sortValues[0][0]))
-        hiddenNodes.sort(key=lambda node: locale.strxfrm(node.sortValues[0][0]))
-        
-        if len(variousNodeElements) > 0:
-            node = bnodes.VariousNode(layerIndex, self.tagList)
+        # 6. Deliver the remaining nodes together with a VariousNode and a node containing all hidden nodes
+        keys, visibleNodes = _tagNodeChunk(complete, hiddenNodes)
+        for key, node in self._specialNodes(layerIndex, len(variousNodeElements) > 0, hiddenNodes):
+            keys.append(key)
             visibleNodes.append(node)
-            
+        yield keys, visibleNodes
+    
+    def _specialNodes(self, layerIndex, various, hiddenNodes):
+        """Return a list of (key, node)-tuples containing a VariousNode if *various* is True and a
+        HiddenValuesNode if there are *hiddenNodes*. These are displayed after all TagNodes."""
+        result = []
+        if various:
+            result.append(((1,), bnodes.VariousNode(layerIndex, self.tagList)))
         if len(hiddenNodes) > 0:
             # If hidden nodes are present this layer needs two actual levels in the tree structure
             # Since this interferes with the algorithm to determine the layer of a node, we have to store
             # that layer index. See BrowserModel._getLayerIndex
+            hiddenNodes.sort(key=lambda node: utils.strings.sortKey(node.sortValues[0][0]))
             for node in hiddenNodes:
                 node.layer = self
-            visibleNodes.append(bnodes.HiddenValuesNode(hiddenNodes))
-        
-        return visibleNodes
+            result.append(((2,), bnodes.HiddenValuesNode(hiddenNodes)))
+        return result
+    
+    def pager(self, layerIndex, domain):
+        # Paging requires a recursive query to find the elements below permeable containers (see step 3 in
+        # buildChunks). If there are only few TagNodes, build them at once, so that they are optimized.
+        if not db.hasRecursiveQueries():
+            return None
+        # The number of distinct values in the domain is an upper bound for the number of TagNodes. It is
+        # much cheaper to compute than the pager, which would be discarded in the common case.
+        valueCount = db.query("""
+            SELECT COUNT(DISTINCT v.value)
+            FROM {p}elements AS el JOIN {p}tags AS t ON el.id = t.element_id
+                                   JOIN {p}values_varchar AS v ON t.tag_id = v.tag_id AND t.value_id = v.id
+            WHERE el.domain = {domain} AND t.tag_id IN ({tagFilter})
+            """, domain=domain.id, tagFilter=db.csIdList(self.tagList)).getSingle()
+        if valueCount <= self.OPTIMIZE_LIMIT:
+            return None
+        pager = _TagNodePager(self, layerIndex, domain)
+        return pager if pager.nodeCount() > self.OPTIMIZE_LIMIT else None
+    
+    @staticmethod
+    def _permeableContents(toplevel, elids):
+        """Return the ids of all elements below permeable containers in *toplevel* that can be reached
+        without leaving permeable containers and *elids* (unless that is None). Use a single recursive
+        query (see db.hasRecursiveQueries)."""
+        with db.idSubquery(toplevel, 'walk_ids') as ids:
+            if elids is None:
+                restriction = ''
+            else: restriction = 'AND c.element_id IN ({})'.format(db.csList(elids))
+            return set(db.query("""
+                WITH RECURSIVE walk(id) AS (
+                    SELECT id FROM {p}elements WHERE id IN ({ids})
+                    UNION
+                    SELECT c.element_id
+                    FROM walk JOIN {p}elements AS el ON walk.id = el.id
+                              JOIN {p}contents AS c ON c.container_id = el.id
+                    WHERE el.type IN ({collection},{container}) {restriction}
+                )
+                SELECT id FROM walk
+                """, ids=ids, restriction=restriction,
+                     collection=elements.ContainerType.Collection.value,
+                     container=elements.ContainerType.Container.value).getSingleColumn())
     
     @staticmethod
     def defaultTagList():
@@ -518,32 +743,187 @@ class TagLayer(Layer):
 addLayerClass('taglayer', translate("BrowserModel", "Tag layer"), TagLayer)
 
 
-def _buildContainerTree(domain, elids):
+class _TagNodePager(Pager):
+    """Pager for a TagLayer displaying all elements of *domain*. Like TagLayer.buildChunks it creates a
+    TagNode for each value that appears in toplevel elements or below permeable toplevel containers, but
+    it does not optimize TagNodes (step 5). Like TagLayer.buildChunks it sorts nodes by the locale-aware
+    key of their first sort value (or value). The last page contains the VariousNode and the
+    HiddenValuesNode.
+    """
+    def __init__(self, layer, layerIndex, domain):
+        super().__init__()
+        self.layer = layer
+        self.layerIndex = layerIndex
+        tagFilter = db.csIdList(layer.tagList)
+        # Rows for each value
+        groups = collections.OrderedDict()
+        result = db.query("""
+            WITH RECURSIVE walk(id) AS (
+                {toplevel}
+                UNION
+                SELECT c.element_id
+                FROM walk JOIN {p}elements AS el ON walk.id = el.id
+                          JOIN {p}contents AS c ON c.container_id = el.id
+                WHERE el.type IN ({collection},{container})
+            )
+            SELECT DISTINCT t.tag_id, v.id, v.value, v.hide, v.sort_value
+            FROM walk JOIN {p}tags AS t ON t.element_id = walk.id
+                      JOIN {p}values_varchar AS v ON t.tag_id = v.tag_id AND t.value_id = v.id
+            WHERE +t.tag_id IN ({tagFilter})
+            ORDER BY v.value
+            """, toplevel=db.toplevel.subquery(domain), tagFilter=tagFilter,
+                 collection=elements.ContainerType.Collection.value,
+                 container=elements.ContainerType.Container.value)
+        for row in result:
+            groups.setdefault(row[2], []).append(row)
+        # Sort like _tagNodeChunk: by the smallest sort value of each group (see TagNode.addTagValue)
+        self._groups = sorted(groups.values(), key=lambda rows: utils.strings.sortKey(
+                                min(sortValue if sortValue is not None else value
+                                    for _, _, value, _, sortValue in rows)))
+        self._position = 0
+        self._hiddenNodes = []
+        # Check whether a VariousNode is necessary (see TagLayer.buildChunks). As in _WrapperPager.create
+        # the unary plus makes SQLite use the index on element_id.
+        self._various = len(list(db.query("""
+            SELECT el.id
+            FROM {p}elements AS el
+            WHERE el.id IN ({toplevel})
+                AND NOT EXISTS (SELECT 1 FROM {p}tags AS t
+                                WHERE t.element_id = el.id AND +t.tag_id IN ({tagFilter}))
+            LIMIT 1
+            """, toplevel=db.toplevel.subquery(domain), tagFilter=tagFilter))) > 0
+    
+    def nodeCount(self):
+        """Return the number of TagNodes (including hidden ones)."""
+        return len(self._groups)
+    
+    def fetch(self, count):
+        nodes = []
+        while len(nodes) < count and self._position < len(self._groups):
+            node = bnodes.TagNode(self.layerIndex)
+            for tagId, valueId, value, hide, sortValue in self._groups[self._position]:
+                node.addTagValue(tagId, valueId, value, hide, sortValue, False)
+            self._position += 1
+            if node.hide:
+                self._hiddenNodes.append(node)
+            else: nodes.append(node)
+        if self._position == len(self._groups):
+            nodes.extend(node for key, node in
+                         self.layer._specialNodes(self.layerIndex, self._various, self._hiddenNodes))
+            self._groups = []
+            self._position = 0
+            self.finished = True
+        return nodes
+
+
+def _tagNodeChunk(nodes, hiddenNodes):
+    """Return a chunk (keys, nodes) as yielded by Layer.buildChunks containing the visible TagNodes from
+    *nodes*. Append hidden TagNodes to the list *hiddenNodes*."""
+    hiddenNodes.extend(node for node in nodes if node.hide)
+    chunk = sorted((((0, utils.strings.sortKey(node.sortValues[0][0])), node) for node in nodes if not node.hide),
+                   key=operator.itemgetter(0))
+    return [key for key, node in chunk], [node for key, node in chunk]
+    
+
+def _removeSubNodes(nodes, withinMatchingTags):
+    """Return the list of TagNodes from *nodes* which remain when nodes whose contents (node.elids) are
+    contained in other nodes are removed or merged into those nodes (see _checkSuperNode). Nodes which do
+    not match the search criterion are also removed if their contents are covered by matching tags
+    (*withinMatchingTags* is the set of these elements).
+    
+    Nodes are processed in the given order. A node can only be contained in nodes which contain its rarest
+    element, so only those are compared to it. As long as each element has few tag values, this takes
+    linear time in the number of (element, node)-pairs.
+    """
+    containing = collections.defaultdict(list) # element id -> nodes containing it, in the order of nodes
+    for node in nodes:
+        for elid in node.elids:
+            containing[elid].append(node)
+    removed = set() # ids of removed nodes
+    for node in nodes:
+        # Delete nodes whose contents are covered by nodes matching the search query.
+        if not node.matching and node.elids <= withinMatchingTags:
+            removed.add(id(node))
+            continue
+        # Try to delete (or merge) TagNodes whose contents are contained in (or equal to) another TagNode
+        if len(node.elids) > 0:
+            candidates = min((containing[elid] for elid in node.elids), key=len)
+        else: candidates = nodes
+        for superNode in candidates:
+            if superNode is not node and id(superNode) not in removed and node.elids <= superNode.elids:
+                if _checkSuperNode(node, superNode):
+                    removed.add(id(node))
+                    break
+    return [node for node in nodes if id(node) not in removed]
+
+
+def _checkSuperNode(node, superNode):
+    """Given two TagNodes where the second contains all contents of the first, return whether the first
+    node may be deleted. As a sideeffect this method may merge *node* into *superNode*.
+    """
+    # If *node* is completely contained in superNode, delete it.
+    if len(node.elids) < len(superNode.elids):
+        # However, matching nodes must not be deleted in favor of not matching ones.
+        # and visible nodes must not be deleted in favor of a hidden superNode.
+        return not ((node.matching and not superNode.matching)
+                    or (not node.hide and superNode.hide)) 
+    else:
+        if node.hide == superNode.hide:
+            superNode.merge(node)
+            return True
+        else:
+            return node.hide
+
+
+def _mergeChunks(chunks):
+    """Return the list of all nodes in *chunks* (an iterable of (keys, nodes)-tuples, see
+    Layer.buildChunks) sorted by their keys."""
+    return [node for key, node in heapq.merge(*(zip(keys, nodes) for keys, nodes in chunks),
+                                              key=operator.itemgetter(0))]
+
+
+def _containerTreeChunks(domain, elids):
     """Create a wrapper tree including all elements from *elids* (or all elements with the given domain,
-    if *elids* is None). The tree will organize wrappers according to the natural tree structure.
+    if *elids* is None). The tree will organize wrappers according to the natural tree structure. Yield the
+    toplevel wrappers in chunks as specified in Layer.buildChunks.
     """
     if elids is None:
-        toplevel = list(db.query("""
-                SELECT id
-                FROM {p}elements
-                WHERE domain=? AND id NOT IN (SELECT element_id FROM {p}contents)
-                """, domain.id).getSingleColumn())
+        toplevel = set(db.query(db.toplevel.subquery(domain)).getSingleColumn())
+        withParents = set()
     elif len(elids) > 0:
         toplevel = set(elids)
         toplevel.difference_update(db.query(
                  "SELECT element_id FROM {}contents WHERE container_id IN ({})"
                 .format(db.prefix, db.csList(elids))).getSingleColumn())
+        withParents = set(db.query("SELECT DISTINCT element_id FROM {p}contents WHERE element_id IN ({ids})",
+                                   ids=db.csList(toplevel)).getSingleColumn())
     else:
-        return []
-        
+        return
+    
+    # Toplevel elements without parents simply get a wrapper. They are delivered in chunks, so that the
+    # browser can display the first wrappers before all elements have been loaded.
+    roots = sorted(toplevel - withParents)
+    for i in range(0, len(roots), CHUNK_SIZE):
+        ids = roots[i:i+CHUNK_SIZE]
+        levels.real.collect(ids)
+        yield _wrapperChunk([_createWrapper(id, {}) for id in ids])
+    if len(withParents) == 0:
+        return
+    
+    # Elements whose parents are not in elids may need to be displayed below a major ancestor.
+    toplevel = withParents
+
     # Load all toplevel elements and all of their ancestors
-    newIds = toplevel
-    while len(newIds) > 0:
-        levels.real.collect(newIds)
-        nextIds = []
-        for id in newIds:
-            nextIds.extend(levels.real[id].parents)
-        newIds = nextIds
+    if db.closure.enabled() or db.hasRecursiveQueries():
+        levels.real.collect(set(toplevel).union(db.parents(toplevel, recursive=True)))
+    else:
+        newIds = toplevel
+        while len(newIds) > 0:
+            levels.real.collect(newIds)
+            nextIds = []
+            for id in newIds:
+                nextIds.extend(levels.real[id].parents)
+            newIds = nextIds
 
     # Collect all parents in cDict (mapping parent id -> list of children ids)
     # Parents contained as key in this dict, will only contain part of their element's contants in
@@ -579,33 +959,138 @@ def _buildContainerTree(domain, elids):
     for id in list(toplevel): # copy!
         processNode(id)
     
-    def createWrapper(id):
-        """Create a wrapper to be inserted in the browser. If the wrapper should contain all of its
-        element's contents, create a BrowserWrapper, that will load the contents """
-        element = levels.real[id]
-        if id in cDict: # wrapper should contain only a part of its element's contents
-            wrapper = Wrapper(element)
-            wrapper.setContents([createWrapper(cid) for cid in cDict[id]])
-            return wrapper
-        elif element.isFile() or len(element.contents) == 0:
-            return Wrapper(element)
-        else:
-            return bnodes.BrowserWrapper(element) # a wrapper that will load all its contents when needed
-    
-    contents = [createWrapper(id) for id in toplevel]
+    yield _wrapperChunk([_createWrapper(id, cDict) for id in toplevel])
+
+
+class _WrapperPager(Pager):
+    """Pager for a wrapper tree of all toplevel elements of a domain (i.e. the browser has no filter and no
+    layers). Elements are only loaded when their page is fetched. Nodes are sorted like in _wrapperChunk,
+    but the titles and dates are read from the database. Use create to create a pager.
+    """
+    def __init__(self, ids):
+        super().__init__()
+        self._ids = ids
+        self._position = 0
+        
+    @staticmethod
+    def create(domain):
+        """Return a pager for the toplevel elements of *domain* or None if there are so few of them that
+        they should be loaded at once."""
+        # Use a correlated subquery to get the date of each element. The unary plus keeps SQLite from using
+        # the index on (tag_id, value_id) instead of the one on element_id.
+        dateTag = tags.get("date")
+        if dateTag.isInDb() and dateTag.type == tags.TYPE_DATE:
+            dateColumn = """CASE WHEN el.type = {album} THEN -COALESCE((
+                                SELECT MIN(vd.value)
+                                FROM {p}tags AS td JOIN {p}values_date AS vd
+                                     ON vd.tag_id = td.tag_id AND vd.id = td.value_id
+                                WHERE td.element_id = el.id AND +td.tag_id = {date}), 0)
+                            ELSE 0 END
+                         """.format(p=db.prefix, album=elements.ContainerType.Album.value, date=dateTag.id)
+        else: dateColumn = '0'
+        toplevel = db.toplevel.subquery(domain)
+        titles = collections.defaultdict(list)
+        for id, title in db.query("""
+                SELECT tt.element_id, COALESCE(vt.sort_value, vt.value)
+                FROM {p}tags AS tt JOIN {p}values_varchar AS vt
+                                   ON vt.tag_id = tt.tag_id AND vt.id = tt.value_id
+                WHERE tt.tag_id = {title} AND tt.element_id IN ({toplevel})
+                """, toplevel=toplevel, title=tags.TITLE.id):
+            titles[id].append(title)
+        # Elements without title are sorted by the title that Element.getTitle returns
+        result = db.query("""
+            SELECT el.id, {dateColumn}, f.url
+            FROM {p}elements AS el LEFT JOIN {p}files AS f ON f.element_id = el.id
+            WHERE el.id IN ({toplevel})
+            """, toplevel=toplevel, dateColumn=dateColumn)
+        noTitle = translate('Element', '<No title>')
+        rows = sorted((date, _titleKey(titles.get(id), url if url is not None else noTitle), id)
+                      for id, date, url in result)
+        ids = [id for _, _, id in rows]
+        return _WrapperPager(ids) if len(ids) > PAGE_SIZE else None
     
-    def sortFunction(wrapper):
-        """Intelligent sort: sort albums by their date, everything else by name."""
+    def fetch(self, count):
+        ids = self._ids[self._position:self._position+count]
+        self._position += len(ids)
+        if self._position >= len(self._ids):
+            self._ids = []
+            self.finished = True
+        levels.real.collect(ids)
+        return [_createWrapper(id, {}) for id in ids]
+
+
+def _copyNode(node):
+    """Return a copy of a node created by a layer or by _createWrapper, which has not been inserted into a
+    model yet. Contents which are loaded on demand are not copied."""
+    if isinstance(node, bnodes.CriterionNode):
+        if isinstance(node, bnodes.TagNode):
+            copy = bnodes.TagNode(node.layerIndex)
+            copy.tagIds = set(node.tagIds)
+            copy.values = [list(pair) for pair in node.values]
+            copy.sortValues = [list(pair) for pair in node.sortValues]
+            copy.hide = node.hide
+            copy.matching = node.matching
+        else: copy = bnodes.VariousNode(node.layerIndex, node.tagSet)
+        for attr in ('elids', 'layer'):
+            if hasattr(node, attr):
+                setattr(copy, attr, getattr(node, attr))
+        return copy
+    elif isinstance(node, bnodes.HiddenValuesNode):
+        return bnodes.HiddenValuesNode([_copyNode(child) for child in node.contents])
+    elif isinstance(node, bnodes.BrowserWrapper):
+        return bnodes.BrowserWrapper(node.element, node.position)
+    else:
+        copy = Wrapper(node.element, position=node.position)
+        if node.isContainer():
+            copy.setContents([_copyNode(child) for child in node.contents])
+        return copy
+
+
+def _createWrapper(id, cDict):
+    """Create a wrapper to be inserted in the browser. If the wrapper should contain all of its
+    element's contents, create a BrowserWrapper, that will load the contents. *cDict* maps the ids of
+    elements which should contain only a part of their contents to the list of these contents.
+    """
+    element = levels.real[id]
+    if id in cDict: # wrapper should contain only a part of its element's contents
+        wrapper = Wrapper(element)
+        wrapper.setContents([_createWrapper(cid, cDict) for cid in cDict[id]])
+        return wrapper
+    elif element.isFile() or len(element.contents) == 0:
+        return Wrapper(element)
+    else:
+        return bnodes.BrowserWrapper(element) # a wrapper that will load all its contents when needed
+
+
+def _wrapperChunk(wrappers):
+    """Return a chunk (keys, nodes) as yielded by Layer.buildChunks containing *wrappers*.
+    Intelligent sort: albums by descending date precede all other elements, which are sorted by title (see
+    _titleKey). Ties are broken by id. _WrapperPager uses the same order."""
+    dateTag = tags.get("date")
+    sortValues = db.tags.sortValues(tags.TITLE)
+    chunk = []
+    for wrapper in wrappers:
         element = wrapper.element
         date = 0
         if element.isContainer() and element.type == elements.ContainerType.Album:
-            dateTag = tags.get("date")
             if dateTag.type == tags.TYPE_DATE and dateTag in element.tags: 
-                date = -element.tags[dateTag][0].toSql() # minus leads to descending sort
-        return (date, element.getTitle(neverShowIds=True))
-    
-    contents.sort(key=sortFunction)
-    return contents
+                # minus leads to descending sort
+                date = -min(value.toSql() for value in element.tags[dateTag])
+        if tags.TITLE in element.tags:
+            titles = [sortValues.get(title, title) for title in element.tags[tags.TITLE]]
+        else: titles = None
+        chunk.append(((date, _titleKey(titles, element.getTitle(neverShowIds=True)), element.id), wrapper))
+    chunk.sort(key=operator.itemgetter(0))
+    return [key for key, wrapper in chunk], [wrapper for key, wrapper in chunk]
+
+
+def _titleKey(titles, fallback):
+    """Return a key to sort an element by title according to the current locale: the smallest key of the
+    sort values (or values) *titles* of its titles (see utils.strings.sortKey). Elements without title
+    (*titles* is None or empty) are sorted by *fallback*, usually the result of Element.getTitle."""
+    if titles:
+        return min(utils.strings.sortKey(title) for title in titles)
+    else: return utils.strings.sortKey(fallback)
         
 
 class BrowserMimeData(selection.MimeData):
@@ -98,6 +98,12 @@ class SequenceDict(dict):
                 else: break
             self.toplevelIds.add(last.element.id)
                 
+        if db.closure.enabled():
+            # Load all ancestors with one query. Otherwise _addIndexToParents would need one query per level
+            # of the hierarchy.
+            ids = [file.id for file in elements if file.isInDb()]
+            if len(ids) > 0:
+                level.fetch(list(db.parents(ids, recursive=True)))
         for i, file in enumerate(elements):
             self._addIndexToParents(i, file.id)
             
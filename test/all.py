@@ -28,20 +28,26 @@ def load_tests(loader, standard_tests, pattern):
 #    from . import sql
 #    suite.addTests(loader.loadTestsFromModule(sql))
 #    
-#    from . import tagflagtypes
-#    suite.addTests(loader.loadTestsFromModule(tagflagtypes))
-#    
-#    from . import levels
-#    suite.addTests(loader.loadTestsFromModule(levels))
-#    
 #    from . import realfiles
 #    suite.addTests(loader.loadTestsFromModule(realfiles))
 #    
 #    from . import playlistmodel
 #    suite.addTests(loader.loadTestsFromModule(playlistmodel))
+    from . import tagflagtypes
+    suite.addTests(loader.loadTestsFromModule(tagflagtypes))
+    
+    from . import levels
+    suite.addTests(loader.loadTestsFromModule(levels))
+    
     from . import criteria
     suite.addTests(loader.loadTestsFromModule(criteria))
     
+    from . import worker
+    suite.addTests(loader.loadTestsFromModule(worker))
+    
+    from . import browsermodel
+    suite.addTests(loader.loadTestsFromModule(browsermodel))
+    
     return suite
 
 if __name__ == "__main__":
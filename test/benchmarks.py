@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+# Maestro Music Manager  -  https://github.com/maestromusic/maestro
+# Copyright (C) 2009-2015 Martin Altmayer, Michael Helmling
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Benchmarks for database heavy operations. These are not part of all.py because they take a while. Run
+them like the other tests, e.g. with "python3 setup.py test -s test.benchmarks". The number of elements
+may be changed via the environment variable MAESTRO_BENCHMARK_SIZE, the sizes used by benchmarks that
+test several sizes via MAESTRO_BENCHMARK_SIZES (comma-separated). Benchmarks run against the database
+configured for tests, so use a MySQL test configuration to benchmark MySQL."""
+
+import os, time, unittest
+
+from maestro import config, database as db, search
+from maestro.core import tags, levels, domains, elements, urls
+from maestro.search import criteria
+from maestro.search.idset import IdSet
+
+SIZE = int(os.environ.get('MAESTRO_BENCHMARK_SIZE', 100000))
+SIZES = [int(size) for size in os.environ.get('MAESTRO_BENCHMARK_SIZES', '10000,100000,1000000').split(',')]
+SEARCH_SIZE = int(os.environ.get('MAESTRO_BENCHMARK_SEARCH_SIZE', 500000))
+ALBUM_SIZE = 10
+
+
+class Benchmark(unittest.TestCase):
+    """Base class for benchmarks. Subclasses implement runTest and may use *timed* to measure the time
+    spent in a phase. All timings are printed when the benchmark has finished."""
+    def __init__(self, size=SIZE):
+        super().__init__()
+        self.size = size
+
+    def setUp(self):
+        self.timings = []
+
+    def tearDown(self):
+        print("\n{} ({} elements):".format(type(self).__name__, self.size))
+        for name, seconds in self.timings:
+            print("  {:<45} {:8.3f}s".format(name, seconds))
+
+    def timed(self, name, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.timings.append((name, time.perf_counter() - start))
+        return result
+
+    def clearDatabase(self):
+        for table in ('elements', 'values_varchar'):
+            db.query("DELETE FROM {}{}".format(db.prefix, table))
+        from maestro.core import reallevel
+        reallevel._dbIds = set()
+        db.tags._cache.clear()
+        search.cache.clear()
+
+    def createElements(self):
+        """Insert *self.size* elements into the database directly: Albums of ALBUM_SIZE files each with
+        artist and title tags. Return the list of ids."""
+        self.clearDatabase()
+        domain = domains.default().id
+        fileCount = self.size * ALBUM_SIZE // (ALBUM_SIZE+1)
+        albumCount = self.size - fileCount
+        firstAlbum = fileCount + 1
+        with db.transaction():
+            db.multiQuery("INSERT INTO {p}elements (id, domain, file, type, elements) VALUES (?,?,?,?,?)",
+                          [(id, domain, True, elements.ContainerType.Container.value, 0)
+                           for id in range(1, fileCount+1)]
+                          + [(id, domain, False, elements.ContainerType.Album.value, ALBUM_SIZE)
+                             for id in range(firstAlbum, self.size+1)])
+            db.multiQuery("INSERT INTO {p}files (element_id, url, hash, verified, length) VALUES (?,?,?,?,?)",
+                          [(id, 'file:///benchmark/{}.mp3'.format(id), '', 0, 180)
+                           for id in range(1, fileCount+1)])
+            db.multiQuery("INSERT INTO {p}contents (container_id, position, element_id) VALUES (?,?,?)",
+                          [(firstAlbum + (id-1) // ALBUM_SIZE, (id-1) % ALBUM_SIZE + 1, id)
+                           for id in range(1, min(fileCount, albumCount*ALBUM_SIZE)+1)])
+        artist, title = tags.get('artist'), tags.get('title')
+        artistIds = [db.tags.id(artist, 'Artist {}'.format(i), insert=True) for i in range(100)]
+        titleIds = [db.tags.id(title, 'Title {}'.format(i), insert=True) for i in range(1000)]
+        with db.transaction():
+            db.multiQuery("INSERT INTO {p}tags (element_id, tag_id, value_id) VALUES (?,?,?)",
+                          [(id, artist.id, artistIds[id % len(artistIds)]) for id in range(1, self.size+1)]
+                          + [(id, title.id, titleIds[id % len(titleIds)]) for id in range(1, self.size+1)])
+        if db.toplevel.enabled(): # the elements have been inserted without the real level
+            db.toplevel.rebuild()
+        return list(range(1, self.size+1))
+
+
+class LoadFromDbBenchmark(Benchmark):
+    """Load all elements from the database into the real level and time each phase of loadFromDb."""
+    def runTest(self):
+        ids = self.timed('insert', self.createElements)
+        real = levels.real
+        real.elements = {}
+        with db.idSubquery(ids, 'load_ids') as idSql:
+            for phase in real._loadPhases:
+                self.timed(phase.__name__, phase, real, real, idSql)
+        self.assertEqual(len(real.elements), self.size)
+
+        real.elements = {}
+        self.timed('loadFromDb', real.loadFromDb, ids)
+        self.assertEqual(len(real.elements), self.size)
+        real.elements = {}
+        self.clearDatabase()
+
+
+
+class AddToDbBenchmark(Benchmark):
+    """Commit new files with artist, album and title tags to the database (RealLevel._addToDb)."""
+    def runTest(self):
+        self.clearDatabase()
+        real = levels.real
+        real.elements = {}
+        artist, album, title = tags.get('artist'), tags.get('album'), tags.get('title')
+        files = []
+        for i, id in enumerate(db.nextIds(self.size)):
+            fileTags = tags.Storage({artist: ['Artist {}'.format(i % 1000)],
+                                     album: ['Album {}'.format(i // ALBUM_SIZE)],
+                                     title: ['Title {}'.format(i)]})
+            files.append(elements.File(domains.default(), real, id,
+                                       url=urls.URL('file:///benchmark/{}.mp3'.format(id)),
+                                       length=180, tags=fileTags))
+        real.elements = {file.id: file for file in files}
+        self.timed('_addToDb', real._addToDb, files)
+        self.assertEqual(db.query("SELECT COUNT(*) FROM {p}tags").getSingle(), 3*self.size)
+        real.elements = {}
+        self.clearDatabase()
+
+
+
+class HierarchyBenchmark(Benchmark):
+    """Walk a deep synthetic hierarchy (e.g. box set > work > movement > ... > file) with db.contents
+    and db.parents: level by level, with recursive queries and with the closure table."""
+    DEPTH = 30
+    
+    def createHierarchy(self):
+        """Create self.size containers as a chain of DEPTH levels per tree, each container having one file
+        besides its subcontainer. Return the ids of the roots and the deepest files."""
+        self.clearDatabase()
+        domain = domains.default().id
+        roots, leaves = [], []
+        elementData, contentData = [], []
+        ids = iter(range(1, 2*self.size+1))
+        for _ in range(max(1, self.size // self.DEPTH)):
+            parent = None
+            for depth in range(self.DEPTH):
+                container, file = next(ids), next(ids)
+                elementData.append((container, domain, False, elements.ContainerType.Work.value, 2))
+                elementData.append((file, domain, True, elements.ContainerType.Container.value, 0))
+                contentData.append((container, 1, file))
+                if parent is None:
+                    roots.append(container)
+                else: contentData.append((parent, 2, container))
+                parent = container
+            leaves.append(file)
+        with db.transaction():
+            db.multiQuery("INSERT INTO {p}elements (id, domain, file, type, elements) VALUES (?,?,?,?,?)",
+                          elementData)
+            db.multiQuery("INSERT INTO {p}contents (container_id, position, element_id) VALUES (?,?,?)",
+                          contentData)
+        return roots, leaves
+        
+    def runTest(self):
+        roots, leaves = self.timed('insert', self.createHierarchy)
+        supported = db.hasRecursiveQueries()
+        db._recursiveQueries = False
+        try:
+            descendants = self.timed('contents (loop)', db.contents, roots, recursive=True)
+            ancestors = self.timed('parents (loop)', db.parents, leaves, recursive=True)
+        finally:
+            db._recursiveQueries = None
+        if supported:
+            self.assertEqual(self.timed('contents (CTE)', db.contents, roots, recursive=True), descendants)
+            self.assertEqual(self.timed('parents (CTE)', db.parents, leaves, recursive=True), ancestors)
+        if not db.closure.exists():
+            db.closure.create()
+        db.closure._enabled = True
+        try:
+            self.timed('closure rebuild', db.closure.rebuild)
+            self.assertEqual(self.timed('contents (closure)', db.contents, roots, recursive=True),
+                             descendants)
+            self.assertEqual(self.timed('parents (closure)', db.parents, leaves, recursive=True),
+                             ancestors)
+        finally:
+            db.closure.init()
+        self.clearDatabase()
+
+class SearchBenchmark(Benchmark):
+    """Process multi-word searches with and without the query planner (see search.planner), from the
+    search cache and with the in-memory index (see search.index) and check that all give the same
+    results. Finally compare set operations on Python sets and on IdSets."""
+    SEARCHES = ['title 123',
+                'artist title 123',
+                'title 5 artist 42',
+                'title 99 !artist 1',
+                '{container} artist 7 title',
+                'title 77 !(artist 1 | artist 2)']
+    # Successive criteria while typing a search, each one refines the previous one
+    TYPING = ['ar', 'arti', 'artist', 'artist 4', 'artist 42', 'artist 42 ti', 'artist 42 title 5']
+    
+    def runTest(self):
+        self.timed('insert', self.createElements)
+        option = config.options.search.query_planner
+        allResults = []
+        try:
+            for string in self.SEARCHES:
+                results = []
+                for usePlanner in (False, True):
+                    config.options.search.query_planner = usePlanner
+                    criterion = criteria.parse(string)
+                    name = '{} ({})'.format(string, 'planner' if usePlanner else 'naive')
+                    self.timed(name, search.search, criterion, useCache=False)
+                    results.append(criterion.result)
+                self.assertEqual(results[0], results[1])
+                allResults.append(results[0])
+                search.search(criteria.parse(string)) # fill the search cache
+                criterion = criteria.parse(string)
+                self.timed('{} (cached)'.format(string), search.search, criterion)
+                self.assertEqual(criterion.result, results[0])
+            results = self.timed('typing', self.typeSearch, refine=False)
+            self.assertEqual(self.timed('typing (refined)', self.typeSearch, refine=True), results)
+            self.timed('index build', search.index.rebuild, background=False)
+            for string, result in zip(self.SEARCHES, allResults):
+                criterion = criteria.parse(string)
+                self.timed('{} (index)'.format(string), search.search, criterion, useCache=False)
+                self.assertEqual(criterion.result, result)
+            allIds = set(db.query("SELECT id FROM {p}elements").getSingleColumn())
+            someIds = set(id for id in allIds if id % 3 == 0)
+            self.timed('set operations (set)', self.setOperations, allIds, someIds)
+            self.timed('set operations (IdSet)', self.setOperations, IdSet(allIds), IdSet(someIds))
+        finally:
+            config.options.search.query_planner = option
+            search.index._index = None
+        self.clearDatabase()
+        
+    def typeSearch(self, refine):
+        """Search each criterion in TYPING, restricting the search to the previous result if *refine* is
+        True, and return the list of results."""
+        previous = None
+        results = []
+        for string in self.TYPING:
+            task = search.SearchTask(criteria.parse(string), None, useCache=False,
+                                     previous=previous if refine else None)
+            task.processImmediately()
+            results.append(task.criterion.result)
+            previous = task
+        return results
+        
+    def setOperations(self, a, b):
+        """Combine *a* and *b* like the planner does for AND, OR and NOT."""
+        for i in range(10):
+            result = len((a & b) | (a - b))
+        return result
+        
+
+class FulltextBenchmark(Benchmark):
+    """Search substrings and words in a distinct album value per element by scanning values_varchar and
+    with the full-text index (see database.fulltext) and check that both give the same results."""
+    WORDS = ['Sonata', 'Symphony', 'Concerto', 'Quartet', 'Étude', 'Nocturne', 'Prelude']
+    SEARCHES = ['"No. 4711 of"', '"opus 1234"', 'sonata 1234', 'etude', '#quartet', '#noct', 'album=lude',
+                'of']
+    
+    def runTest(self):
+        ids = self.timed('insert', self.createElements)
+        album = tags.get('album')
+        values = ['{} No. {} of Opus {}'.format(self.WORDS[id % len(self.WORDS)], id, id // 7) for id in ids]
+        valueIds = self.timed('insert values', db.tags.ids, album, values, insert=True)
+        with db.transaction():
+            db.multiQuery("INSERT INTO {p}tags (element_id, tag_id, value_id) VALUES (?,?,?)",
+                          [(id, album.id, valueIds[value]) for id, value in zip(ids, values)])
+        if not db.fulltext.exists():
+            db.fulltext.create()
+        try:
+            db.fulltext._enabled = True
+            self.timed('index rebuild', db.fulltext.rebuild)
+            for string in self.SEARCHES:
+                results = []
+                for enabled in (False, True):
+                    db.fulltext._enabled = enabled
+                    criterion = criteria.parse(string)
+                    name = '{} ({})'.format(string, 'index' if enabled else 'scan')
+                    self.timed(name, search.search, criterion, useCache=False)
+                    results.append(criterion.result)
+                self.assertEqual(results[0], results[1])
+        finally:
+            db.fulltext.init()
+        self.clearDatabase()
+
+
+class WordIndexBenchmark(Benchmark):
+    """Search words in a distinct album value per element by evaluating REGEXP for all values and with the
+    word index (see database.words) and check that both give the same results."""
+    WORDS = FulltextBenchmark.WORDS
+    SEARCHES = ['#quartet', '#etude', '#noct', '#"No. 4711"', '#opus', '#of']
+    
+    def runTest(self):
+        ids = self.timed('insert', self.createElements)
+        album = tags.get('album')
+        values = ['{} No. {} of Opus {}'.format(self.WORDS[id % len(self.WORDS)], id, id // 7) for id in ids]
+        valueIds = self.timed('insert values', db.tags.ids, album, values, insert=True)
+        with db.transaction():
+            db.multiQuery("INSERT INTO {p}tags (element_id, tag_id, value_id) VALUES (?,?,?)",
+                          [(id, album.id, valueIds[value]) for id, value in zip(ids, values)])
+        if not db.words.exists():
+            db.words.create()
+        try:
+            db.words._enabled = True
+            self.timed('index rebuild', db.words.rebuild)
+            for string in self.SEARCHES:
+                results = []
+                for enabled in (False, True):
+                    db.words._enabled = enabled
+                    criterion = criteria.parse(string)
+                    name = '{} ({})'.format(string, 'index' if enabled else 'scan')
+                    self.timed(name, search.search, criterion, useCache=False)
+                    results.append(criterion.result)
+                self.assertEqual(results[0], results[1])
+        finally:
+            db.words.init()
+        self.clearDatabase()
+
+
+
+class TagNodeMergeBenchmark(Benchmark):
+    """Remove and merge the TagNodes of a browser tag layer with artist, composer and performer tags (step 5
+    of TagLayer.build, see browser.model._removeSubNodes). Values follow a Zipf-like distribution: Few
+    composers and performers appear on many albums, most appear on one album only. Compare the result with
+    the quadratic algorithm which was used before (for the nodes of the first albums)."""
+    REFERENCE_SIZE = 20000 # number of elements used for the comparison
+    
+    def runTest(self):
+        import random
+        from maestro.widgets.browser import model
+        # Each algorithm modifies the nodes, so each one gets its own copy of the same nodes
+        nodes, withinMatchingTags = self.timed('create nodes', self.createNodes, self.REFERENCE_SIZE,
+                                               random.Random(4711))
+        expected = self.timed('quadratic algorithm ({} nodes)'.format(len(nodes)),
+                              self.quadratic, nodes, withinMatchingTags)
+        nodes, withinMatchingTags = self.createNodes(self.REFERENCE_SIZE, random.Random(4711))
+        result = self.timed('new algorithm ({} nodes)'.format(len(nodes)),
+                            model._removeSubNodes, nodes, withinMatchingTags)
+        self.assertEqual([self.describe(node) for node in result], [self.describe(node) for node in expected])
+        nodes, withinMatchingTags = self.createNodes(self.size, random.Random(4711))
+        result = self.timed('new algorithm ({} nodes)'.format(len(nodes)),
+                            model._removeSubNodes, nodes, withinMatchingTags)
+        self.assertLess(len(result), len(nodes))
+    
+    def createNodes(self, size, random):
+        """Create TagNodes (with elids) for *size* elements (albums of ALBUM_SIZE tracks). Return them and
+        the set of elements covered by matching tags (the search matched every 50th composer)."""
+        from maestro.widgets.browser import nodes as bnodes
+        nodes = {}
+        withinMatchingTags = set()
+        def add(tagId, valueId, elids):
+            if (tagId, valueId) not in nodes:
+                node = nodes[(tagId, valueId)] = bnodes.TagNode(0)
+                matching = tagId == 2 and valueId % 50 == 0
+                node.addTagValue(tagId, valueId, '{}-{}'.format(tagId, valueId), valueId % 97 == 0, None,
+                                 matching)
+                node.elids = set()
+            node = nodes[(tagId, valueId)]
+            node.elids.update(elids)
+            if node.matching:
+                withinMatchingTags.update(elids)
+        zipf = lambda count: int(count ** random.random()) # value ids 1..count, small ones are frequent
+        for album in range(0, size, ALBUM_SIZE+1):
+            tracks = range(album + 1, album + ALBUM_SIZE + 1)
+            add(1, zipf(size // 20), [album] + list(tracks)) # artist
+            composer = zipf(size // 50)
+            for track in tracks:
+                add(2, composer if random.random() < 0.8 else zipf(size // 50), [track, album]) # composer
+                for _ in range(random.randint(1, 3)):
+                    add(3, zipf(size // 10), [track, album]) # performer
+        return list(nodes.values()), withinMatchingTags
+        
+    def quadratic(self, nodes, withinMatchingTags):
+        """The algorithm that was used before _removeSubNodes (without the duplicates that were caused by
+        nodes with several values)."""
+        from maestro.widgets.browser import model
+        nodes = list(nodes)
+        for node in list(nodes):
+            if not node.matching and node.elids <= withinMatchingTags:
+                nodes.remove(node)
+                continue
+            for node2 in nodes:
+                if node2 is not node and node.elids <= node2.elids:
+                    if model._checkSuperNode(node, node2):
+                        nodes.remove(node)
+                        break
+        return nodes
+    
+    def describe(self, node):
+        return node.getValues(), sorted(node.elids), node.hide, node.matching
+        
+
+def load_tests(loader, standard_tests, pattern):
+    suite = unittest.TestSuite()
+    suite.addTest(LoadFromDbBenchmark())
+    for size in SIZES:
+        suite.addTest(AddToDbBenchmark(size))
+    suite.addTest(HierarchyBenchmark())
+    suite.addTest(SearchBenchmark(SEARCH_SIZE))
+    suite.addTest(FulltextBenchmark(SEARCH_SIZE))
+    suite.addTest(WordIndexBenchmark(SEARCH_SIZE))
+    suite.addTest(TagNodeMergeBenchmark())
+    return suite
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Maestro Music Manager  -  https://github.com/maestromusic/maestro
+# Copyright (C) 2009-2015 Martin Altmayer, Michael Helmling
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Unittests for the BrowserModel."""
+
+import unittest
+
+from maestro import database as db
+from maestro.core import domains, elements, tags
+
+
+class WrapperOrderTest(unittest.TestCase):
+    """Check that toplevel wrappers are sorted in the same order by _wrapperChunk and by _WrapperPager,
+    which reads the sort keys from the database. Elements without title are sorted by their URL or
+    placeholder title (see Element.getTitle)."""
+    def runTest(self):
+        from maestro.widgets.browser import model
+        title = tags.get('title')
+        names = ['alpha', 'zulu', 'Mike', None, None] # the untitled elements are a file and a container
+        url = 'file:///music/kilo.mp3'
+        ids = list(db.nextIds(len(names)))
+        pageSize = model.PAGE_SIZE
+        try:
+            db.multiQuery("INSERT INTO {p}elements (id, domain, file, type, elements) VALUES (?,?,?,?,0)",
+                          [(id, domains.default().id, int(i < 4), elements.ContainerType.Container.value)
+                           for i, id in enumerate(ids)])
+            db.multiQuery("INSERT INTO {p}files (element_id, url, verified, length) VALUES (?,?,0,0)",
+                          [(id, url if names[i] is None else 'file:///music/{}.mp3'.format(i))
+                           for i, id in enumerate(ids[:4])])
+            valueIds = db.tags.ids(title, names[:3], insert=True)
+            db.multiQuery("INSERT INTO {p}tags (element_id, tag_id, value_id) VALUES (?,?,?)",
+                          [(id, title.id, valueIds[name]) for id, name in zip(ids, names[:3])])
+            db.toplevel.update(ids)
+            def orders():
+                chunkOrder = [wrapper.element.id for _, wrappers in model._containerTreeChunks(None, ids)
+                              for wrapper in wrappers]
+                model.PAGE_SIZE = 0 # always create a pager
+                pagerOrder = [id for id in model._WrapperPager.create(domains.default())._ids if id in ids]
+                self.assertEqual(chunkOrder, pagerOrder)
+                return chunkOrder
+
+            order = orders()
+            self.assertEqual(set(order), set(ids))
+            self.assertLess(order.index(ids[0]), order.index(ids[3])) # 'alpha' < 'file:///music/kilo.mp3'
+            self.assertLess(order.index(ids[3]), order.index(ids[1])) # 'file:///music/kilo.mp3' < 'zulu'
+
+            # Sorting loaded elements needs no queries (sort values are cached, see db.tags.sortValues)
+            wrappers = [model._createWrapper(id, {}) for id in ids]
+            queries = []
+            with db.observeQueries(lambda *args: queries.append(args)):
+                keys, nodes = model._wrapperChunk(wrappers)
+            self.assertEqual(queries, [])
+            self.assertEqual([wrapper.element.id for wrapper in nodes], order)
+            
+            db.tags.setSortValue(title, valueIds['zulu'], 'aardvark')
+            order = orders()
+            self.assertLess(order.index(ids[1]), order.index(ids[0]))
+        finally:
+            model.PAGE_SIZE = pageSize
+            db.query("DELETE FROM {p}elements WHERE id IN ({ids})", ids=db.csList(ids))
+            db.tags.deleteSuperfluousValues()
@@ -130,6 +130,8 @@ class ParseWordsTest(unittest.TestCase):
     def runTest(self):
         for string, result in TEST_WORDS:
             self.assertEqual(criteria.parseWords(string), result)
+            # The string representation is used as key in the search cache and must be parsable
+            self.assertEqual(criteria.parseWords(repr(result)), result)
             result.negate = not result.negate
             self.assertEqual(criteria.parseWords(criteria.PREFIX_NEGATE + string), result)
         
@@ -145,4 +147,373 @@ class ParseTest(unittest.TestCase):
             self.assertEqual(criteria.parse(string), result)
             result.negate = not result.negate
             self.assertEqual(criteria.parse(criteria.PREFIX_NEGATE + string), result)
-        
\ No newline at end of file
+        
+
+class PlannerTest(unittest.TestCase):
+    """Test the simplification of criteria in search.planner."""
+    def runTest(self):
+        from maestro.search import planner
+        criterion = criteria.parse("one !(two | three) (four five)")
+        plan = planner.makePlan(criterion)
+        # The negated OR is rewritten as AND and merged into the toplevel AND like "(four five)"
+        self.assertEqual(plan.junction, 'AND')
+        self.assertTrue(all(child.isLeaf() for child in plan.children))
+        self.assertEqual([repr(child) for child in plan.children],
+                         ['{tag=one}', '!{tag=two}', '!{tag=three}', '{tag=four}', '{tag=five}'])
+        # The original criterion is not modified
+        self.assertEqual(criterion, criteria.parse("one !(two | three) (four five)"))
+        
+        plan = planner.makePlan(criteria.parse("!(one two) | three"))
+        self.assertEqual(plan.junction, 'OR')
+        self.assertTrue(plan.children[0].negate)
+        
+        # Long words are more selective than short ones, negated criteria are processed last
+        self.assertLess(TagCriterion('beethoven').estimate(), TagCriterion('bach').estimate())
+        self.assertGreater(criteria.parse('!beethoven').estimate(), TagCriterion('a').estimate())
+        
+
+class RefinementTest(unittest.TestCase):
+    """Test Criterion.isRefinementOf which is used for search-as-you-type."""
+    def runTest(self):
+        for string, previous in [("beetho", "beeth"), ("Beéth", "beeth"), ("#beeth", "beeth"),
+                                 ("beeth moon", "beeth"), ("beeth moon", "bee mo"), ("beeth", "beeth | bach"),
+                                 ("beeth {file}", "beeth"), ("beeth | beetho", "beeth"),
+                                 ("artist=beeth", "artist=bee"), ("!bach", "!bach")]:
+            self.assertTrue(criteria.parse(string).isRefinementOf(criteria.parse(previous)), string)
+        for string, previous in [("beeth", "beetho"), ("beeth", "#beeth"), ("!beeth", "!bee"),
+                                 ("_beeth", "beeth"), ("_Beeth", "_beeth"), ("artist=beeth", "bee"),
+                                 ("beeth | bach", "beeth"), ("bee", "bee moon")]:
+            self.assertFalse(criteria.parse(string).isRefinementOf(criteria.parse(previous)), string)
+        
+
+class IdSetTest(unittest.TestCase):
+    def runTest(self):
+        import operator
+        from maestro.search.idset import IdSet
+        a, b = {1, 5, 7, 200}, {0, 5, 200, 300}
+        idA, idB = IdSet(a), IdSet(b)
+        self.assertEqual(len(idA), 4)
+        self.assertEqual(list(idA), sorted(a))
+        self.assertIn(200, idA)
+        self.assertNotIn(2, idA)
+        self.assertNotIn(1000, idA)
+        self.assertEqual(IdSet(), set())
+        self.assertEqual(IdSet([3]), IdSet.fromMap(b'\0\0\0\1\0\0'))
+        for op in (operator.and_, operator.or_, operator.sub, operator.xor):
+            expected = op(a, b)
+            self.assertEqual(op(idA, idB), expected)
+            self.assertEqual(op(idA, b), expected) # other operands are converted
+            self.assertEqual(op(a, idB), expected) # reflected operators
+        self.assertEqual(idA.intersection(b, [5, 7]), {5})
+        self.assertEqual(idA.union(b, [9]), a | b | {9})
+        self.assertEqual(idA.difference([1], [7]), {5, 200})
+        self.assertTrue(IdSet([5, 200]) <= idA)
+        self.assertTrue(idA.issuperset([1, 7]))
+        
+        # Sparse sets store their ids in an array, dense sets use one bit per id
+        sparse, dense = IdSet([3, 1000000]), IdSet(range(0, 20000, 2))
+        self.assertLess(sparse.memorySize(), 100)
+        self.assertLess(dense.memorySize(), 3000)
+        self.assertEqual(IdSet(range(2, 10000, 4)) | [3, 1000000], set(range(2, 10000, 4)) | {3, 1000000})
+        for op in (operator.and_, operator.or_, operator.sub, operator.xor):
+            for x, y in [(sparse, dense), (dense, sparse), (dense, IdSet(range(10000, 30000, 3)))]:
+                self.assertEqual(op(x, y), op(set(x), set(y)))
+        # Equal sets are equal regardless of how they were computed
+        self.assertEqual(dense - dense, IdSet())
+        self.assertEqual(IdSet.fromMap(b'\1' * 100) & sparse, IdSet([3]))
+        
+        
+class CacheTest(unittest.TestCase):
+    """Test the search result cache and its invalidation by LevelChangeEvents."""
+    def runTest(self):
+        from maestro.core import levels
+        from maestro.search import cache
+        resultCache = cache.ResultCache(1024*1024)
+        for string, result in [('artist=Harry', {1, 2, 3}), ('title=Potter {file}', {2})]:
+            criterion = criteria.parse(string)
+            criterion.result = result
+            resultCache.add(criterion, None, resultCache.generation)
+        criterion = criteria.parse('{tag=artist=Harry}')
+        self.assertTrue(resultCache.get(criterion, None))
+        self.assertEqual(criterion.result, {1, 2, 3})
+        
+        # Results of searches that started before an invalidation are not stored
+        generation = resultCache.generation
+        resultCache.invalidate(lambda criterion: False)
+        criterion = criteria.parse('{flag}')
+        criterion.result = {4}
+        resultCache.add(criterion, None, generation)
+        self.assertFalse(resultCache.get(criterion, None))
+        
+        event = levels.LevelChangeEvent(dataIds=[2], changedTags=[tags.get('title')],
+                                        changedFlags=(), changedStickers=())
+        self.assertTrue(event.merge(levels.LevelChangeEvent(contentIds=[5])))
+        oldCache, cache._cache = cache._cache, resultCache
+        try:
+            from maestro import search
+            key = search.SearchTask(criteria.parse('artist=Harry'), None).key()
+            cache._handleLevelChange(event)
+            # Searches submitted after a level change must not adopt the result of earlier ones (see Task.key)
+            self.assertNotEqual(search.SearchTask(criteria.parse('artist=Harry'), None).key(), key)
+            self.assertTrue(resultCache.get(criteria.parse('artist=Harry'), None))
+            self.assertFalse(resultCache.get(criteria.parse('title=Potter {file}'), None))
+            # A year is also searched as text in all varchar tags (see DateCriterion)
+            criterion = criteria.parse('1999')
+            self.assertIsInstance(criterion, criteria.DateCriterion)
+            criterion.result = set()
+            resultCache.add(criterion, None, resultCache.generation)
+            cache._handleLevelChange(levels.LevelChangeEvent(dataIds=[1], changedTags=[tags.get('title')],
+                                                             changedFlags=(), changedStickers=()))
+            self.assertFalse(resultCache.get(criteria.parse('1999'), None))
+            # Unknown changes (e.g. events emitted by plugins) invalidate everything
+            cache._handleLevelChange(levels.LevelChangeEvent(dataIds=[2]))
+            self.assertFalse(resultCache.get(criteria.parse('artist=Harry'), None))
+        finally:
+            cache._cache = oldCache
+            
+        # The least recently used results are discarded when the cache is full
+        resultCache = cache.ResultCache(1000)
+        for i in range(3):
+            criterion = criteria.parse('title={}'.format(i))
+            criterion.result = set(range(0, 100000, 1000)) # about 460 bytes
+            resultCache.add(criterion, None, resultCache.generation)
+        self.assertFalse(resultCache.get(criteria.parse('title=0'), None))
+        self.assertTrue(resultCache.get(criteria.parse('title=2'), None))
+        self.assertLessEqual(resultCache.info().size, resultCache.maxSize)
+
+
+class FulltextTest(unittest.TestCase):
+    """Check that searches using the full-text index (see database.fulltext) find the same elements as
+    searches scanning the value tables."""
+    def runTest(self):
+        from maestro import config, database as db, search
+        from maestro.core import domains
+        values = ['Beethoven', 'Moonlight Sonata', 'Sonate «Mondschein»', 'Für Elise', 'FUR', 'ab',
+                  'Sonatina']
+        config.options.database.fulltext_index = True
+        db.fulltext.init()
+        try:
+            self.assertTrue(db.fulltext.enabled())
+            title = tags.get('title')
+            valueIds = db.tags.ids(title, values[:-1], insert=True)
+            valueIds[values[-1]] = db.tags.id(title, values[-1], insert=True)
+            ids = list(db.nextIds(len(values)))
+            db.multiQuery("INSERT INTO {p}elements (id, domain, file, type, elements) VALUES (?,?,1,0,0)",
+                          [(id, domains.default().id) for id in ids])
+            db.multiQuery("INSERT INTO {p}tags (element_id, tag_id, value_id) VALUES (?,?,?)",
+                          [(id, title.id, valueIds[value]) for id, value in zip(ids, values)])
+            self.assertEqual(db.fulltext.differences(), [])
+            found = {}
+            for string in ['sonat', 'ONAT', 'fur', 'für', '#sonata', '#sonat', 'ab', '!sonat', 'light son',
+                           'title=eethov', '_Sonat', '_sonat']:
+                results = []
+                for enabled in (True, False):
+                    db.fulltext._enabled = enabled
+                    criterion = criteria.parse(string)
+                    search.search(criterion, useCache=False)
+                    results.append(criterion.result & set(ids))
+                self.assertEqual(results[0], results[1], string)
+                found[string] = results[0]
+            self.assertEqual(len(found['sonat']), 3)
+            self.assertEqual(len(found['fur']), 2)
+            self.assertEqual(len(found['#sonata']), 1)
+            db.fulltext._enabled = True
+            
+            db.query("DELETE FROM {p}elements WHERE id = ?", ids[0])
+            db.tags.deleteSuperfluousValues()
+            self.assertEqual(db.fulltext.differences(), [])
+        finally:
+            db.query("DELETE FROM {p}elements WHERE id IN ({ids})", ids=db.csList(ids))
+            db.tags.deleteSuperfluousValues()
+            config.options.database.fulltext_index = False
+            db.fulltext.init()
+        self.assertFalse(db.fulltext.exists())
+
+
+class WordIndexTest(unittest.TestCase):
+    """Check that #word searches using the word index (see database.words) find the same elements as
+    searches evaluating REGEXP for all values."""
+    def runTest(self):
+        from maestro import config, database as db, search
+        from maestro.core import domains
+        values = ['Moonlight Sonata', 'Sonate «Mondschein»', 'Für Elise', 'FUR', 'Sonatina', 'No. 5-a',
+                  'Piano Sonata No. 14']
+        config.options.database.word_index = True
+        db.words.init()
+        try:
+            self.assertTrue(db.words.enabled())
+            title = tags.get('title')
+            valueIds = db.tags.ids(title, values[:-1], insert=True)
+            valueIds[values[-1]] = db.tags.id(title, values[-1], insert=True)
+            ids = list(db.nextIds(len(values)))
+            db.multiQuery("INSERT INTO {p}elements (id, domain, file, type, elements) VALUES (?,?,1,0,0)",
+                          [(id, domains.default().id) for id in ids])
+            db.multiQuery("INSERT INTO {p}tags (element_id, tag_id, value_id) VALUES (?,?,?)",
+                          [(id, title.id, valueIds[value]) for id, value in zip(ids, values)])
+            self.assertEqual(db.words.differences(), [])
+            found = {}
+            for string in ['#sonata', '#SONATA', '#sonat', '#fur', '#für', '#"5-a"', '#"sonata no"',
+                           '#"no."', '#mondschein', '!#sonata']:
+                results = []
+                for enabled in (True, False):
+                    db.words._enabled = enabled
+                    criterion = criteria.parse(string)
+                    search.search(criterion, useCache=False)
+                    results.append(criterion.result & set(ids))
+                self.assertEqual(results[0], results[1], string)
+                found[string] = results[0]
+            self.assertEqual(len(found['#sonata']), 2)
+            self.assertEqual(len(found['#sonat']), 0)
+            self.assertEqual(len(found['#fur']), 2)
+            self.assertEqual(len(found['#"sonata no"']), 1)
+            db.words._enabled = True
+            
+            db.query("DELETE FROM {p}elements WHERE id = ?", ids[0])
+            db.tags.deleteSuperfluousValues()
+            self.assertEqual(db.words.differences(), [])
+        finally:
+            db.query("DELETE FROM {p}elements WHERE id IN ({ids})", ids=db.csList(ids))
+            db.tags.deleteSuperfluousValues()
+            config.options.database.word_index = False
+            db.words.init()
+        self.assertFalse(db.words.exists())
+
+
+class ProfileTest(unittest.TestCase):
+    """Check that a profiled search (see search.profiler) records the tree of processed criteria, their
+    statements and result sizes and can be exported as JSON."""
+    def runTest(self):
+        import json
+        from maestro import config, search
+        from maestro.search import profiler
+        for planner in (True, False):
+            config.options.search.query_planner = planner
+            try:
+                criterion = criteria.parse('a (b | !c) #d')
+                profile = profiler.Profile(explain=True)
+                search.search(criterion, useCache=False, profile=profile)
+            finally:
+                config.options.search.query_planner = True
+            self.assertFalse(profile.cached)
+            self.assertEqual(profile.root.resultSize, len(criterion.result))
+            nodes = []
+            def collect(node):
+                nodes.append(node)
+                for child in node.children:
+                    collect(child)
+            collect(profile.root)
+            leaves = {node.label for node in nodes if isinstance(node.source, criteria.Criterion)
+                      and not isinstance(node.source, criteria.MultiCriterion)} - {profile.root.label}
+            if planner: # the planner stops after the first empty result
+                self.assertTrue(len(leaves) > 0)
+            else: self.assertEqual(leaves, {'{tag=a}', '{tag=b}', '!{tag=c}', '{tag=#d}'})
+            self.assertTrue(all(node.time is not None for node in nodes))
+            statements = [statement for node in nodes for statement in node.statements]
+            self.assertTrue(len(statements) > 0)
+            self.assertTrue(any(statement.plan for statement in statements))
+            data = json.loads(profile.toJson())
+            self.assertEqual(data['root']['criterion'], repr(criterion))
+            self.assertEqual(data['root']['resultSize'], len(criterion.result))
+        
+        profile = profiler.Profile()
+        search.search(criterion, profile=profile)
+        search.search(criterion, profile=profile)
+        self.assertTrue(profile.cached)
+        self.assertEqual(profile.root.children, [])
+
+
+class ParallelTest(unittest.TestCase):
+    """Check that searches processed by the thread pool of search.executor find the same elements as
+    sequential searches. In-memory databases cannot be shared between threads, so the test database is
+    copied to a file."""
+    def runTest(self):
+        import os, sqlite3, tempfile, threading
+        from maestro import config, database as db, search
+        from maestro.core import domains
+        from maestro.search import executor, planner
+        tagValues = {name: ['{} {}'.format(name, i) for i in range(count)]
+                     for name, count in [('title', 30), ('artist', 5), ('genre', 3)]}
+        ids = list(db.nextIds(30))
+        db.multiQuery("INSERT INTO {p}elements (id, domain, file, type, elements) VALUES (?,?,1,0,0)",
+                      [(id, domains.default().id) for id in ids])
+        for name, values in tagValues.items():
+            valueIds = db.tags.ids(tags.get(name), values, insert=True)
+            db.multiQuery("INSERT INTO {p}tags (element_id, tag_id, value_id) VALUES (?,?,?)",
+                          [(id, tags.get(name).id, valueIds[values[i % len(values)]])
+                           for i, id in enumerate(ids)])
+        
+        directory = tempfile.TemporaryDirectory()
+        path = os.path.join(directory.name, 'test.db')
+        connection = sqlite3.connect(path)
+        db.engine.raw_connection().connection.backup(connection)
+        connection.close()
+        oldEngine, oldPath, oldRun = db.engine, config.options.database.sqlite_path, executor._Job.run
+        oldParallelism, oldStageLimit = config.options.search.parallelism, planner.STAGE_LIMIT
+        threads = [] # names of the threads which processed criteria in the pool
+        def run(job):
+            threads.append(threading.current_thread().name)
+            oldRun(job)
+        try:
+            db.engine = db.createEngine(type='sqlite', path=path)
+            config.options.database.sqlite_path = path
+            executor._Job.run = run
+            # The OR-criterion's leaves are processed in parallel. The AND-criterion's first result is not
+            # staged, so its remaining leaves are processed in parallel.
+            planner.STAGE_LIMIT = 0
+            for string, jobs in [('title=1 | artist=2 | genre=0', 3), ('title=1 artist=artist genre=0', 2)]:
+                results = []
+                for parallelism in (1, 3):
+                    config.options.search.parallelism = parallelism
+                    del threads[:]
+                    criterion = criteria.parse(string)
+                    search.search(criterion, useCache=False)
+                    results.append(criterion.result)
+                    self.assertEqual(len(threads), jobs if parallelism > 1 else 0, string)
+                    self.assertTrue(all(name.startswith('search') for name in threads))
+                self.assertEqual(results[0], results[1], string)
+                self.assertTrue(len(results[0]) > 0, string)
+        finally:
+            db.engine = oldEngine
+            config.options.database.sqlite_path = oldPath
+            config.options.search.parallelism = oldParallelism
+            executor._Job.run = oldRun
+            planner.STAGE_LIMIT = oldStageLimit
+            directory.cleanup()
+            db.query("DELETE FROM {p}elements WHERE id IN ({ids})", ids=db.csList(ids))
+            db.tags.deleteSuperfluousValues()
+
+
+class ParseBenchmark(unittest.TestCase):
+    """Micro-benchmark for criteria.parse: Time building the grammar (which was done for each search string
+    before it was built only once), parsing with the prebuilt grammar and parsing cached search strings.
+    Check that cached criteria are not affected by changes to the returned copies."""
+    STRINGS = ['beethoven', 'beethoven moonlight', '#sonata !_Moon', 'artist=bach (fugue | prelude)',
+               '>=1800 {tag=date=1850}', '1850-1870 {file}', '"two words" | !(a b)', 'g=jazz t,album=blue']
+    REPETITIONS = 20
+    
+    def runTest(self):
+        import time
+        timings = []
+        def timed(name, function):
+            start = time.perf_counter()
+            for i in range(self.REPETITIONS):
+                for string in self.STRINGS:
+                    function(string)
+            timings.append((name, time.perf_counter() - start))
+        
+        criteria.clearParseCache()
+        timed('grammar build', lambda string: criteria._buildGrammar())
+        timed('parse (uncached)', criteria._parseCached.__wrapped__)
+        timed('parse (cached)', criteria.parse)
+        print("\nParseBenchmark ({} strings):".format(self.REPETITIONS * len(self.STRINGS)))
+        for name, seconds in timings:
+            print("  {:<45} {:8.3f}s".format(name, seconds))
+            
+        for string in self.STRINGS:
+            criterion = criteria.parse(string)
+            self.assertEqual(criterion, criteria._parseCached.__wrapped__(string))
+            for c in criterion.getCriteriaDepthFirst():
+                c.negate = not c.negate
+                c.result = {1}
+            self.assertEqual(criteria.parse(string), criteria._parseCached.__wrapped__(string))
+            self.assertIsNot(criteria.parse(string), criteria.parse(string))
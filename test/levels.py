@@ -21,20 +21,21 @@
 import unittest
 
 from maestro import application, config, database as db, utils
-from maestro.core import tags, levels, elements
-from maestro.filebackends import BackendFile, BackendURL, urlTypes
+from maestro.core import tags, levels, elements, domains, urls
 from . import testcase
 from .testlevel import *
 
-class TestFile(BackendFile):
-    @staticmethod
-    def tryLoad(url):
-        assert url.scheme == 'test'
-        return TestFile(url)
+class TestFile(urls.BackendFile):
+    """Fake files with URLs like 'test:///artist - title'."""
+    scheme = 'test'
     
+    def __init__(self, url):
+        super().__init__(url)
+        self.length = 180
+        
     def readTags(self):
         self.tags = tags.Storage()
-        artist,title = self.url.parsedUrl.path[1:].split(' - ') # skip leading /
+        artist,title = self.url.path[1:].split(' - ') # skip leading /
         self.tags.add(tags.TITLE, title)
         self.tags.add(tags.get('artist'), artist)
     
@@ -42,7 +43,7 @@ class TestFile(BackendFile):
         # writing tags to filesystem is not checked by this unittest
         return []
     
-    length = 180
+urls.fileBackends.append(TestFile)
 
 class LevelTestCase(testcase.UndoableTestCase):
     """Base test case for level related test cases."""
@@ -65,13 +66,13 @@ class CreationTestCase(LevelTestCase):
     def runTest(self):
         if not self.real:
             self.assertEqual(self.level.elements, {}) # this is important on undo
-        self.f1 = self.level.collect(TestUrl('test://band 1 - song'))
+        self.f1 = self.level.collect(urls.URL('test:///band 1 - song'))
         # due to the fixed url->id mapping, these id is the same on real and editor
         self.assertEqual(self.f1.id, 1)
         self.assertIn(self.f1.id, self.level)
-        self.f2 = self.level.collect(TestUrl('test://band 2 - a song'))
-        self.f3 = self.level.collect(TestUrl('test://band 3 - another song'))
-        self.f4 = self.level.collect(TestUrl('test://band 4 - no song'))
+        self.f2 = self.level.collect(urls.URL('test:///band 2 - a song'))
+        self.f3 = self.level.collect(urls.URL('test:///band 3 - another song'))
+        self.f4 = self.level.collect(urls.URL('test:///band 4 - no song'))
         containerTags = tags.Storage({tags.TITLE: ['Weird album']})
         if self.real: # On real level createContainer does not work until we added the contents to the db
             self.assertEqual(0, db.query("SELECT COUNT(*) FROM {}elements".format(db.prefix)).getSingle())
@@ -85,7 +86,8 @@ class CreationTestCase(LevelTestCase):
         predictedId = db._nextId
         self.assertNotIn(predictedId, self.level) 
         self.assertEqual(self.f1.parents, [])
-        self.c = self.level.createContainer(tags=containerTags, contents=[self.f1, self.f2, self.f3])
+        self.c = self.level.createContainer(domains.default(), tags=containerTags,
+                                            contents=[self.f1, self.f2, self.f3])
         self.assertEqual(self.c.id, predictedId)
         self.assertIn(predictedId, self.level)
         self.assertEqual(self.c.contents,
@@ -99,16 +101,16 @@ class CreationTestCase(LevelTestCase):
 class ContentsTestCase(LevelTestCase):
     def setUp(self):
         super().setUp()
-        self.f1 = self.level.collect(TestUrl('test://band 1 - song'))
-        self.f2 = self.level.collect(TestUrl('test://band 2 - a song'))
-        self.f3 = self.level.collect(TestUrl('test://band 3 - another song'))
-        self.f4 = self.level.collect(TestUrl('test://band 4 - no song'))
+        self.f1 = self.level.collect(urls.URL('test:///band 1 - song'))
+        self.f2 = self.level.collect(urls.URL('test:///band 2 - a song'))
+        self.f3 = self.level.collect(urls.URL('test:///band 3 - another song'))
+        self.f4 = self.level.collect(urls.URL('test:///band 4 - no song'))
         self.fs = [self.f1, self.f2, self.f3, self.f4]
         containerTags = tags.Storage({tags.TITLE: ['Weird album']})
         if self.real:
             # On real level createContainer does not work until we added the contents to the db
             self.level.addToDb(self.fs)
-        self.c = self.level.createContainer(tags=containerTags, contents=[])
+        self.c = self.level.createContainer(domains.default(), tags=containerTags, contents=[])
         
     def runTest(self):
         self.assertEqual(self.c.contents, elements.ContentList())
@@ -174,14 +176,15 @@ class CommitTestCase(LevelTestCase):
     def setUp(self):
         super().setUp()
         self.subLevel = levels.Level('TEST', self.level)
-        self.f1 = self.subLevel.collect(TestUrl('test://band 1 - song'))
-        self.f2 = self.subLevel.collect(TestUrl('test://band 2 - a song'))
-        self.f3 = self.subLevel.collect(TestUrl('test://band 3 - another song'))
-        self.f4 = self.subLevel.collect(TestUrl('test://band 4 - no song'))
+        self.f1 = self.subLevel.collect(urls.URL('test:///band 1 - song'))
+        self.f2 = self.subLevel.collect(urls.URL('test:///band 2 - a song'))
+        self.f3 = self.subLevel.collect(urls.URL('test:///band 3 - another song'))
+        self.f4 = self.subLevel.collect(urls.URL('test:///band 4 - no song'))
         self.fs = [self.f1, self.f2, self.f3, self.f4]
         self.containerTags = tags.Storage({tags.TITLE: ['Weird album']})
         self.contentList = elements.ContentList.fromPairs([(10,self.f1), (12,self.f2)])
-        self.c = self.subLevel.createContainer(tags=self.containerTags, contents=self.contentList)
+        self.c = self.subLevel.createContainer(domains.default(), tags=self.containerTags,
+                                               contents=self.contentList)
         
     def runTest(self):
         if self.real:
@@ -203,7 +206,7 @@ class CommitTestCase(LevelTestCase):
         
         # Now change stuff on the sub level and commit again
         #===================================================
-        self.f5 = self.subLevel.collect(TestUrl('test://band 5 - new song'))
+        self.f5 = self.subLevel.collect(urls.URL('test:///band 5 - new song'))
         contentList = elements.ContentList.fromPairs([(10,self.f5), (12,self.f2)])
         self.subLevel.changeContents({self.c: contentList})
         self.subLevel.removeElements([self.f1])
@@ -217,6 +220,141 @@ class CommitTestCase(LevelTestCase):
         self.checkUndo()
         self.checkRedo()
 
+
+
+class EvictionTestCase(LevelTestCase):
+    """Check that the real level evicts unused elements when its budget is exceeded and reloads them
+    transparently."""
+    def setUp(self):
+        super().setUp()
+        self.oldBudget = config.options.database.element_cache_size
+        config.options.database.element_cache_size = 2
+        levels.editor.elements = {} # elements loaded on other levels are never evicted
+        self.fs = [self.level.collect(urls.URL('test:///band {} - song'.format(i))) for i in range(1, 5)]
+        self.level.addToDb(self.fs)
+        self.ids = [f.id for f in self.fs]
+        self.level.elements = {}
+        self.level._lastUsed.clear()
+        self.fs = None
+        
+    def tearDown(self):
+        config.options.database.element_cache_size = self.oldBudget
+        super().tearDown()
+        
+    def runTest(self):
+        first = self.level.collect(self.ids[0])
+        before = self.level.cacheInfo()
+        self.level.collect(self.ids[1:3]) # requested elements are not evicted, so request only two
+        info = self.level.cacheInfo()
+        self.assertEqual(info.misses - before.misses, 2)
+        self.assertLessEqual(info.size, 2)
+        self.assertGreater(info.evictions, 0)
+        # Evicted elements which are still referenced are not loaded a second time
+        self.assertIs(self.level.collect(self.ids[0]), first)
+        # Unreferenced evicted elements are reloaded transparently
+        self.assertEqual([element.id for element in self.level.collect(self.ids)], self.ids)
+        self.assertEqual(self.level[self.ids[2]].url, urls.URL('test:///band 3 - song'))
+
+
+class UrlResolutionTestCase(LevelTestCase):
+    """Check the bulk resolution of URLs to ids."""
+    def runTest(self):
+        urlList = [urls.URL('test:///band {} - song'.format(i)) for i in range(1, 4)]
+        fs = self.level.collect(urlList)
+        self.level.addToDb(fs)
+        levels._urlToId.clear()
+        unknown = urls.URL('test:///band 9 - unknown song')
+        self.assertEqual(levels.idsFromUrls(urlList + [unknown]), {f.url: f.id for f in fs})
+        self.assertEqual(levels._urlToId, {f.url: f.id for f in fs})
+        ids = levels.idsFromUrls([unknown], create=True)
+        self.assertNotIn(ids[unknown], [f.id for f in fs])
+        self.assertEqual(levels.idFromUrl(unknown), ids[unknown])
+        
+        # Collecting elements resolves all of their URLs with a single query
+        self.level.elements = {}
+        levels._urlToId.clear()
+        queries = []
+        with db.observeQueries(lambda query, *args: queries.append(query)):
+            self.assertEqual([f.id for f in self.level.collect(urlList)], [f.id for f in fs])
+        self.assertEqual(len([query for query in queries if 'WHERE url' in query]), 1)
+
+
+
+class ClosureTestCase(LevelTestCase):
+    """Check that the closure table of the contents hierarchy is kept up to date by the real level."""
+    def setUp(self):
+        super().setUp()
+        config.options.database.contents_closure = True
+        db.closure.init()
+        self.fs = [self.level.collect(urls.URL('test:///band {} - song'.format(i))) for i in range(1, 5)]
+        self.level.addToDb(self.fs)
+        
+    def tearDown(self):
+        config.options.database.contents_closure = False
+        db.closure.init()
+        super().tearDown()
+        
+    def runTest(self):
+        f1, f2, f3, f4 = self.fs
+        inner = self.level.createContainer(domains.default(), contents=[f1, f2])
+        outer = self.level.createContainer(domains.default(), contents=[inner, f3])
+        self.assertEqual(db.closure.differences(), [])
+        self.assertEqual(db.parents(f1.id, recursive=True), {inner.id, outer.id})
+        self.assertEqual(db.contents(outer.id, recursive=True), {inner.id, f1.id, f2.id, f3.id})
+        self.assertEqual(db.query("SELECT depth FROM {p}contents_closure WHERE ancestor=? AND descendant=?",
+                                  outer.id, f1.id).getSingle(), 2)
+        
+        self.level.insertContentsAuto(inner, 2, [f4])
+        self.assertEqual(db.closure.differences(), [])
+        self.assertIn(f4.id, db.contents(outer.id, recursive=True))
+        self.level.removeContentsAuto(outer, indexes=[0])
+        self.assertEqual(db.closure.differences(), [])
+        self.assertEqual(db.parents(f1.id, recursive=True), {inner.id})
+        self.level.setContents(outer, elements.ContentList.fromList([inner]))
+        self.assertEqual(db.closure.differences(), [])
+        self.assertEqual(sorted(f.id for f in outer.getAllFiles()), [f1.id, f2.id, f4.id])
+        
+        self.checkUndo()
+        self.assertEqual(db.closure.differences(), [])
+        self.checkRedo()
+        self.assertEqual(db.closure.differences(), [])
+
+
+
+class ToplevelTestCase(LevelTestCase):
+    """Check that the table of toplevel elements is kept up to date by the real level."""
+    def setUp(self):
+        super().setUp()
+        config.options.database.toplevel_index = True
+        db.toplevel.init()
+        self.fs = [self.level.collect(urls.URL('test:///band {} - song'.format(i))) for i in range(1, 5)]
+        self.level.addToDb(self.fs)
+    
+    def toplevel(self):
+        return set(db.query(db.toplevel.subquery(domains.default())).getSingleColumn())
+    
+    def runTest(self):
+        f1, f2, f3, f4 = self.fs
+        self.assertEqual(db.toplevel.differences(), [])
+        self.assertEqual(self.toplevel(), {f1.id, f2.id, f3.id, f4.id})
+        inner = self.level.createContainer(domains.default(), contents=[f1, f2])
+        outer = self.level.createContainer(domains.default(), contents=[inner, f3])
+        self.assertEqual(db.toplevel.differences(), [])
+        self.assertEqual(self.toplevel(), {outer.id, f4.id})
+        
+        self.level.insertContentsAuto(inner, 2, [f4])
+        self.assertEqual(self.toplevel(), {outer.id})
+        self.level.removeContentsAuto(outer, indexes=[0])
+        self.assertEqual(self.toplevel(), {outer.id, inner.id})
+        self.level.setContents(outer, elements.ContentList.fromList([inner]))
+        self.assertEqual(self.toplevel(), {outer.id, f3.id})
+        self.assertEqual(db.toplevel.differences(), [])
+        
+        self.checkUndo()
+        self.assertEqual(db.toplevel.differences(), [])
+        self.checkRedo()
+        self.assertEqual(db.toplevel.differences(), [])
+        
         
 def load_tests(loader, standard_tests, pattern):
     # See http://docs.python.org/py3k/library/unittest.html#load-tests-protocol
@@ -226,6 +364,10 @@ def load_tests(loader, standard_tests, pattern):
         suite.addTest(CreationTestCase(level))
         suite.addTest(ContentsTestCase(level))
         suite.addTest(CommitTestCase(level))
+    suite.addTest(EvictionTestCase(levels.real))
+    suite.addTest(UrlResolutionTestCase(levels.real))
+    suite.addTest(ClosureTestCase(levels.real))
+    suite.addTest(ToplevelTestCase(levels.real))
     return suite
     
 if __name__ == "__main__":
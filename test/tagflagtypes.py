@@ -16,6 +16,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import unittest
+
 from maestro import application, database as db
 from maestro.core import flags, tags
 from . import testcase
@@ -26,7 +28,7 @@ class TagTypeTestCase(testcase.UndoableTestCase):
         result = db.query("SELECT tagtype,title,icon,private,sort FROM {}tagids WHERE tagname='testtag'"
                           .format(db.prefix))
         if values is not None:
-            dbValues = [v if not db.isNull(v) else None for v in result.getSingleRow()]
+            dbValues = [v for v in result.getSingleRow()]
             dbValues[3] = bool(dbValues[3]) # private
             dbValues = tuple(dbValues)
                             
@@ -38,7 +40,7 @@ class TagTypeTestCase(testcase.UndoableTestCase):
             self.assertEqual(tag.private,values[3])
             self.assertEqual(tags.tagList.index(tag),values[4])
         else:
-            self.assertRaises(db.sql.EmptyResultException,result.getSingleRow)
+            self.assertRaises(db.EmptyResultException,result.getSingleRow)
 
     def runTest(self):
         index = len(tags.tagList)
@@ -76,11 +78,9 @@ class FlagTypeTestCase(testcase.UndoableTestCase):
         result = db.query("SELECT name,icon FROM {}flag_names WHERE name='testflag' OR name='testflag2'"
                 .format(db.prefix))
         if name is None: # no flag should exist
-            self.assertRaises(db.sql.EmptyResultException,result.getSingle)
+            self.assertRaises(db.EmptyResultException,result.getSingle)
         else:
             for dbName,dbIconPath in result:
-                if db.isNull(dbIconPath):
-                    dbIconPath = None
                 flag = flags.get(name)
                 self.assertEqual(flag.name,name)
                 self.assertEqual(dbName,name)
@@ -111,7 +111,39 @@ class FlagTypeTestCase(testcase.UndoableTestCase):
         self.checkUndo()
         self.check(None,None,redo=False) # all steps undone
         
+
+
+class ValueIdTestCase(unittest.TestCase):
+    """Check db.tags.ids and db.tags.idsForTags."""
+    def runTest(self):
+        artist, title = tags.get('artist'), tags.get('title')
+        existingId = db.tags.id(artist, 'Existing', insert=True)
+        result = db.tags.ids(artist, ['Existing', 'Dvořák'])
+        self.assertEqual(result, {'Existing': existingId})
+        
+        result = db.tags.idsForTags({artist: ['Existing', 'Dvořák'], title: ['Dvořák']}, insert=True)
+        self.assertEqual(result[artist]['Existing'], existingId)
+        self.assertEqual(result[artist]['Dvořák'], db.tags.id(artist, 'Dvořák'))
+        self.assertEqual(result[title]['Dvořák'], db.tags.id(title, 'Dvořák'))
+        self.assertNotEqual(result[artist]['Dvořák'], result[title]['Dvořák'])
+        self.assertEqual(db.tags.value(title, result[title]['Dvořák']), 'Dvořák')
+        self.assertEqual(db.query("SELECT search_value FROM {p}values_varchar WHERE id = ?",
+                                  result[artist]['Dvořák']).getSingle(), 'Dvorak')
+
+        
+class ValueCacheTestCase(unittest.TestCase):
+    """Check that db.tags.value and db.tags.id use the value cache."""
+    def runTest(self):
+        artist = tags.get('artist')
+        valueId = db.tags.id(artist, 'Cached', insert=True)
+        db.tags._cache.clear()
+        self.assertEqual(db.tags.value(artist, valueId), 'Cached')
+        hits = db.tags.cacheInfo().hits
+        self.assertEqual(db.tags.value(artist, valueId), 'Cached')
+        self.assertEqual(db.tags.id(artist, 'Cached'), valueId)
+        self.assertEqual(db.tags.cacheInfo().hits, hits + 2)
         
+
 if __name__ == "__main__":
     print("To run this test use: python setup.py test --test-suite=test.tagflagtypes")
     
\ No newline at end of file
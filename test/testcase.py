@@ -18,7 +18,7 @@
 
 import unittest, functools
 
-from maestro import application
+from maestro import stack
 
 
 class UndoableTestCase(unittest.TestCase):
@@ -28,13 +28,13 @@ class UndoableTestCase(unittest.TestCase):
     """
     def __init__(self, methodName='runTest'):
         super().__init__(methodName)
-        self.stack = application.stack
+        self.stack = stack.stack
         self.checks = []
         self._recordingStopped = False
         self._record = True
         
     def setUp(self):
-        application.stack.clear()
+        stack.stack.clear()
         
     def stopRecording(self):
         """Do not record assert*-methods anymore."""
@@ -51,13 +51,13 @@ class UndoableTestCase(unittest.TestCase):
             method(*args)
             self._record = True
         
-        application.stack.setIndex(0)
+        stack.stack.setIndex(0)
         
     def checkRedo(self):
         """Redo all commands on the stack and repeat the recorded assert*-methods at the appropriate times.
         """
         print("Start checkRedo for {}".format(type(self).__name__))
-        assert application.stack.index() == 0
+        assert stack.stack.index() == 0
         for method, index, args in self.checks:
             #print("Redoing {} at {}".format(method.__name__,index))
             self.stack.setIndex(index)
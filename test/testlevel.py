@@ -21,7 +21,7 @@ import functools
 from maestro.core import levels, tags
 from maestro.core.elements import Container, File, Element
 from maestro.core.nodes import Wrapper
-from maestro import filebackends
+from maestro.core import urls
 
 
 class TestLevel(levels.Level):
@@ -47,7 +47,7 @@ class TestLevel(levels.Level):
         """Add a file with the given name."""
         assert name not in self.nameToElement
         self.currentId -= 1
-        file = File(self,self.currentId,filebackends.BackendURL.fromString('file://test/'+name),100)
+        file = File(self,self.currentId,urls.URL.fileURL('/test/'+name),100)
         file.tags.add(tags.TITLE,name)
         self.elements[self.currentId] = file
         self.nameToElement[name] = file
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# Maestro Music Manager  -  https://github.com/maestromusic/maestro
+# Copyright (C) 2009-2015 Martin Altmayer, Michael Helmling
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import threading
+import time
+import unittest
+
+from PyQt5 import QtCore
+
+from maestro.utils import worker
+
+
+class RecordTask(worker.Task):
+    """Task which appends its name to the list *processed*, after waiting for *event* if it is given.
+    Tasks with equal names share their results."""
+    def __init__(self, name, processed, event=None):
+        self.name = name
+        self.processed = processed
+        self.event = event
+        self.result = None
+        self.interrupted = False
+        self.started = threading.Event()
+
+    def process(self):
+        self.started.set()
+        while self.event is not None and not self.event.wait(0.01):
+            yield
+        self.processed.append(self.name)
+        self.result = self.name.upper()
+
+    def interrupt(self):
+        self.interrupted = True
+
+    def key(self):
+        return self.name
+
+    def adopt(self, task):
+        self.result = task.result
+        return self
+
+
+class WorkerPoolTest(unittest.TestCase):
+    """Test priorities, deduplication and resets of SharedWorkers using a WorkerPool with a single
+    thread."""
+    def wait(self, results, count):
+        deadline = time.time() + 5
+        while len(results) < count and time.time() < deadline:
+            QtCore.QCoreApplication.processEvents()
+            time.sleep(0.001)
+        self.assertEqual(len(results), count)
+
+    def runTest(self):
+        pool = worker.WorkerPool(1)
+        hidden = worker.SharedWorker(pool)
+        hidden2 = worker.SharedWorker(pool)
+        visible = worker.SharedWorker(pool, worker.PRIORITY_VISIBLE)
+        results = []
+        for w in (hidden, hidden2, visible):
+            w.done.connect(lambda task, w=w: results.append((w, task)))
+        processed = []
+
+        # Block the thread, so that the following tasks wait in the queue
+        event = threading.Event()
+        blocker = RecordTask('blocker', processed, event)
+        hidden.submit(blocker)
+        self.assertTrue(blocker.started.wait(5))
+        a1, b, a2 = RecordTask('a', processed), RecordTask('b', processed), RecordTask('a', processed)
+        hidden.submit(a1)
+        visible.submit(b)
+        hidden2.submit(a2) # subscribes to a1
+        event.set()
+        self.wait(results, 4)
+        # The visible worker's task comes first, 'a' is processed only once
+        self.assertEqual(processed, ['blocker', 'b', 'a'])
+        self.assertEqual(a2.result, 'A')
+        self.assertIn((hidden2, a2), results)
+        self.assertIn((hidden, a1), results)
+
+        # A shared task is still processed if only one of its workers is reset...
+        del results[:], processed[:]
+        event = threading.Event()
+        c1, c2 = RecordTask('c', processed, event), RecordTask('c', processed)
+        hidden.submit(c1)
+        visible.submit(c2)
+        self.assertTrue(c1.started.wait(5))
+        hidden.reset()
+        self.assertFalse(c1.interrupted)
+        event.set()
+        self.wait(results, 1)
+        self.assertEqual(results, [(visible, c2)])
+
+        # ...but interrupted if all of them are reset
+        del results[:], processed[:]
+        event = threading.Event()
+        d = RecordTask('d', processed, event)
+        visible.submit(d)
+        self.assertTrue(d.started.wait(5))
+        visible.reset()
+        self.assertTrue(d.interrupted)
+        visible.join(5)
+        self.assertEqual(processed, [])
+
+        # join waits until adopted results are available
+        e1, e2 = RecordTask('e', processed), RecordTask('e', processed)
+        hidden.submit(e1)
+        visible.submit(e2)
+        visible.join(5)
+        self.assertEqual(e2.result, 'E')